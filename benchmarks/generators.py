@@ -0,0 +1,68 @@
+"""
+Synthetic datasets of the benchmarks, sized from 10^4 to 10^7 rows.
+"""
+import numpy as np
+import pandas as pd
+
+
+def make_frame(
+    rows,
+    n_numeric=8,
+    n_categorical=4,
+    cardinality=10,
+    missing=0.05,
+    duplicates=0.01,
+    seed=0,
+):
+    """Function to generate a classification dataset with numeric and
+    categorical columns, missing values and duplicated rows
+    :param rows: Number of rows
+    :param n_numeric: Number of float columns, named num_0, num_1, ...
+    :param n_categorical: Number of string columns, named cat_0, cat_1, ...
+    :param cardinality: Number of distinct values per categorical column,
+        drawn with a skewed (Zipf like) frequency
+    :param missing: Fraction of missing values in every feature column
+    :param duplicates: Fraction of rows which repeat an earlier row
+    :param seed: Random seed
+    :returns pandas dataframe with a binary "target" column"""
+    rng = np.random.default_rng(seed)
+    rows = int(rows)
+    columns = {}
+    signal = np.zeros(rows)
+    for i in range(n_numeric):
+        values = rng.standard_normal(rows)
+        signal += values * rng.uniform(-1, 1)
+        columns["num_{}".format(i)] = values
+
+    weights = 1.0 / np.arange(1, cardinality + 1)
+    weights /= weights.sum()
+    categories = np.array(["c{}".format(k) for k in range(cardinality)], dtype=object)
+    for i in range(n_categorical):
+        codes = rng.choice(cardinality, size=rows, p=weights)
+        signal += (codes % 2) * rng.uniform(-1, 1)
+        columns["cat_{}".format(i)] = categories[codes]
+
+    df = pd.DataFrame(columns)
+    for col in df.columns:
+        mask = rng.random(rows) < missing
+        df.loc[mask, col] = np.nan
+    df["target"] = (signal + rng.standard_normal(rows) > 0).astype("int64")
+
+    n_duplicates = int(rows * duplicates)
+    if n_duplicates:
+        source = rng.integers(0, rows, size=n_duplicates)
+        target = rng.integers(0, rows, size=n_duplicates)
+        df.iloc[target] = df.iloc[source].to_numpy()
+    return df
+
+
+def make_matrix(rows, n_features=16, seed=0):
+    """Function to generate a dense classification problem
+    :param rows: Number of rows
+    :param n_features: Number of float features
+    :param seed: Random seed
+    :returns (X, y) numpy arrays"""
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((int(rows), n_features))
+    y = (X @ rng.uniform(-1, 1, n_features) + rng.standard_normal(int(rows)) > 0)
+    return X, y.astype("int64")
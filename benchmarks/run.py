@@ -0,0 +1,357 @@
+"""
+Benchmarks of the functions and Luigi stages hot paths.
+
+Every (case, rows, cardinality) point runs in a fresh process, so the peak
+memory of one point does not leak into the next. The wall times, the peak
+traced allocation and the peak resident memory are saved as JSON, and two
+result files, ex: of two commits, are compared with ``compare``::
+
+    python -m benchmarks.run run --rows 1e4 1e5 1e6 --output base.json
+    python -m benchmarks.run run --cases encode_onehot --cardinality 1000
+    python -m benchmarks.run compare base.json new.json --threshold 1.1
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+import multiprocessing
+import luigi
+from luigi import IntParameter, Parameter
+from luigi.task import flatten
+from sklearn.ensemble import RandomForestClassifier
+from machine_learning_utils.functions.functions import (
+    encode_onehot,
+    eval_classifier,
+    impute_data,
+)
+from machine_learning_utils.functions.transforms import (
+    Deduplicate,
+    Imputer,
+    OneHotEncoder,
+)
+from machine_learning_utils.luigi.task import Requirement
+from machine_learning_utils.luigi.data import DownloadData, DataPreprocess, BuildModel
+from benchmarks.generators import make_frame, make_matrix
+
+
+class BenchDownloadData(DownloadData):
+    DATA = Parameter(default="bench.csv")
+    # Relative to the temporary directory of the stage
+    LOCAL_ROOT = Parameter(default="data")
+    chunksize = IntParameter(default=100000, significant=False)
+
+
+class BenchDataPreprocess(DataPreprocess):
+    download = Requirement(BenchDownloadData)
+
+    def transforms(self):
+        return [Deduplicate(), Imputer(), OneHotEncoder(exclude=["target"])]
+
+
+class BenchBuildModel(BuildModel):
+    preprocess = Requirement(BenchDataPreprocess)
+    class_column = Parameter(default="target")
+    models = [
+        {
+            "name": "rf",
+            "estimator": "sklearn.ensemble.RandomForestClassifier",
+            "params": {"n_estimators": 10, "max_depth": 8, "n_jobs": 1},
+        }
+    ]
+
+
+class Case:
+    """A benchmark, :meth:`setup` and :meth:`before` are not measured"""
+
+    def setup(self, rows, cardinality):
+        pass
+
+    def before(self):
+        """Called before every measured run"""
+
+    def run(self):
+        raise NotImplementedError()
+
+    def teardown(self):
+        pass
+
+
+class EncodeOnehot(Case):
+    def setup(self, rows, cardinality):
+        self.df = make_frame(rows, cardinality=cardinality)
+
+    def run(self):
+        encode_onehot(self.df, "cat_0")
+
+
+class ImputeData(Case):
+    def setup(self, rows, cardinality):
+        self.source = make_frame(rows, cardinality=cardinality)
+
+    def before(self):
+        # impute_data fills the frame in place
+        self.df = self.source.copy()
+
+    def run(self):
+        impute_data(self.df, list(self.df.columns))
+
+
+class EvalClassifier(Case):
+    def setup(self, rows, cardinality):
+        self.X, self.y = make_matrix(rows)
+
+    def run(self):
+        clf = RandomForestClassifier(n_estimators=10, max_depth=8, n_jobs=1)
+        eval_classifier(clf, self.X, self.y, n_splits=3)
+
+
+class LuigiStage(Case):
+    """Run one stage of the pipeline, its upstream stages are built first"""
+
+    task_class = None
+
+    def setup(self, rows, cardinality):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        make_frame(rows, cardinality=cardinality).to_csv("bench.csv", index=False)
+        self.task = self.task_class()
+        upstream = flatten(self.task.requires())
+        if upstream:
+            luigi.build(upstream, local_scheduler=True, log_level="WARNING")
+
+    def run(self):
+        self.task.run()
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+
+class DownloadStage(LuigiStage):
+    task_class = BenchDownloadData
+
+
+class PreprocessStage(LuigiStage):
+    task_class = BenchDataPreprocess
+
+
+class BuildStage(LuigiStage):
+    task_class = BenchBuildModel
+
+
+CASES = {
+    "encode_onehot": EncodeOnehot,
+    "impute_data": ImputeData,
+    "eval_classifier": EvalClassifier,
+    "download_data": DownloadStage,
+    "data_preprocess": PreprocessStage,
+    "build_model": BuildStage,
+}
+
+
+def _max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(name, rows, cardinality, repeats=3):
+    """Function to time a benchmark case in the current process
+    :param name: Key of :data:`CASES`
+    :param rows: Number of rows of the synthetic data
+    :param cardinality: Number of distinct values per categorical column
+    :param repeats: Number of timed runs
+    :returns dictionary of the run times in seconds, the peak traced
+        allocation of one extra run and the peak resident memory in bytes"""
+    case = CASES[name]()
+    case.setup(rows, cardinality)
+    try:
+        setup_rss = _max_rss()
+        times = []
+        for _ in range(repeats):
+            case.before()
+            start = time.perf_counter()
+            case.run()
+            times.append(time.perf_counter() - start)
+
+        # Tracing slows allocations down, so the peak is taken on its own run
+        case.before()
+        tracemalloc.start()
+        case.run()
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        case.teardown()
+    return {
+        "case": name,
+        "rows": rows,
+        "cardinality": cardinality,
+        "times": times,
+        "min": min(times),
+        "median": sorted(times)[len(times) // 2],
+        "peak_alloc": peak_alloc,
+        "setup_rss": setup_rss,
+        "max_rss": _max_rss(),
+    }
+
+
+def _measure_child(conn, *args):
+    try:
+        conn.send(measure(*args))
+    except Exception as e:
+        conn.send({"error": repr(e)})
+    finally:
+        conn.close()
+
+
+def measure_isolated(name, rows, cardinality, repeats=3):
+    """Function to run :func:`measure` in a fresh process
+    :returns dictionary of the measures, or with an "error" on failure"""
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_measure_child, args=(child, name, rows, cardinality, repeats)
+    )
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"error": "exit code {}".format(process.exitcode)}
+    process.join()
+    result.update(case=name, rows=rows, cardinality=cardinality)
+    return result
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(cases, rows, cardinalities, repeats=3):
+    """Function to measure every (case, rows, cardinality) point in turn
+    :returns JSON serializable dictionary of the environment and results"""
+    results = []
+    for name in cases:
+        for n in rows:
+            for cardinality in cardinalities:
+                result = measure_isolated(name, n, cardinality, repeats)
+                print(_format(result), flush=True)
+                results.append(result)
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def _format(result):
+    point = "{case:<16} rows={rows:<9} cardinality={cardinality:<6}".format(**result)
+    if "error" in result:
+        return "{} ERROR {}".format(point, result["error"])
+    return "{} min={:.4f}s median={:.4f}s peak_alloc={:.1f}MB max_rss={:.1f}MB".format(
+        point,
+        result["min"],
+        result["median"],
+        result["peak_alloc"] / 2**20,
+        result["max_rss"] / 2**20,
+    )
+
+
+def compare(base, new, threshold=1.1):
+    """Function to compare two result files point by point
+    :param base: Dictionary of the baseline results
+    :param new: Dictionary of the new results
+    :param threshold: Ratio of new to baseline time or peak allocation above
+        which a point is reported as a regression
+    :returns list of (point, metric, base value, new value, ratio) regressions"""
+    baseline = {
+        (r["case"], r["rows"], r["cardinality"]): r
+        for r in base["results"]
+        if "error" not in r
+    }
+    regressions = []
+    print("{:<48} {:>10} {:>10}".format("point", "time", "peak_alloc"))
+    for result in new["results"]:
+        point = (result["case"], result["rows"], result["cardinality"])
+        if "error" in result or point not in baseline:
+            continue
+        ratios = []
+        for metric in ("min", "peak_alloc"):
+            before, after = baseline[point][metric], result[metric]
+            ratio = after / before if before else float("inf") if after else 1.0
+            ratios.append(ratio)
+            if ratio > threshold:
+                regressions.append((point, metric, before, after, ratio))
+        print("{:<48} {:>9.2f}x {:>9.2f}x".format(str(point), *ratios))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run benchmarks and save the results")
+    run.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    run.add_argument(
+        "--rows", nargs="+", type=lambda n: int(float(n)), default=[10**4, 10**5]
+    )
+    run.add_argument("--cardinality", nargs="+", type=int, default=[10])
+    run.add_argument("--repeats", type=int, default=3)
+    run.add_argument(
+        "--output", help="Result file, defaults to benchmarks/results/<commit>.json"
+    )
+
+    cmp = commands.add_parser("compare", help="Compare two result files")
+    cmp.add_argument("base")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=1.1)
+    args = parser.parse_args(args)
+
+    if args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(base, new, threshold=args.threshold)
+        for point, metric, before, after, ratio in regressions:
+            print(
+                "REGRESSION {} {}: {:.4g} -> {:.4g} ({:.2f}x)".format(
+                    point, metric, before, after, ratio
+                )
+            )
+        return 1 if regressions else 0
+
+    results = run_benchmarks(args.cases, args.rows, args.cardinality, args.repeats)
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "results",
+        "{}.json".format(results["commit"]),
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results saved to {}".format(output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,20 @@
-from pkg_resources import DistributionNotFound
-from pkg_resources import get_distribution
+def __getattr__(name):
+    # The version is looked up on first access, importlib.metadata scans the
+    # installed distributions and would slow down every import of the package
+    if name == "__version__":
+        try:
+            from importlib.metadata import PackageNotFoundError, version
+        except ImportError:  # Python < 3.8
+            from importlib_metadata import PackageNotFoundError, version
+
+        try:
+            globals()["__version__"] = version(__name__)
+        except PackageNotFoundError:
+            pass
+        else:
+            return globals()["__version__"]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
-try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
-    pass
 #    from setuptools_scm import get_version
 #    __version__ = get_version(root='..', relative_to=__file__)
@@ -5,7 +5,8 @@ Why does this file exist, and why __main__? For more info, read:
 - https://docs.python.org/2/using/cmdline.html#cmdoption-m
 - https://docs.python.org/3/using/cmdline.html#cmdoption-m
 """
+import sys
 from machine_learning_utils.cli import main
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
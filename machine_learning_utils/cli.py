@@ -10,9 +10,183 @@ Why does this file exist, and why not put this in __main__?
     there's no ``machine_learning_utils.__main__`` in ``sys.modules``.
   Also see (1) from http://click.pocoo.org/5/setuptools/#setuptools-integration
 """
-from luigi import build
-from .examples.titanic import BuildTModel
+import sys
+import time
+import socket
+import argparse
+import importlib
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+# Luigi and the pipelines are imported once the arguments are parsed, so
+# --help and argument errors return without loading pandas or scikit-learn
+
+# Pipelines runnable by name, any task is also runnable by its dotted path
+PIPELINES = {
+    "titanic": "machine_learning_utils.examples.titanic.BuildTModel",
+    "mushroom": "machine_learning_utils.examples.mushroom.BuildMRModel",
+    "breast_cancer": "machine_learning_utils.examples.breast_cancer.BuildBCModel",
+}
+PIPELINES.update({path.rpartition(".")[2]: path for path in list(PIPELINES.values())})
+
+
+def load_task(name):
+    """Function to find the task class of a pipeline
+    :param name: Pipeline name, ex: "titanic" or "BuildTModel", or dotted path
+        of a task class, ex: "my_package.pipelines.BuildModel"
+    :returns luigi task class"""
+    path = PIPELINES.get(name, name)
+    module, _, attr = path.rpartition(".")
+    if not module:
+        raise ValueError(
+            "Unknown pipeline {!r}, expected one of {} or a dotted task path".format(
+                name, sorted(PIPELINES)
+            )
+        )
+    return getattr(importlib.import_module(module), attr)
+
+
+def print_dag(tasks, file=None):
+    """Function to print the dependency tree of tasks, with the tasks whose
+    targets already exist marked [x]
+    :param tasks: List of luigi tasks
+    :param file: Writable text file, defaults to stdout
+    :returns (number of distinct tasks, number of complete tasks)"""
+    from luigi.task import flatten
+
+    file = file or sys.stdout
+    complete = {}
+
+    def visit(task, depth):
+        seen = task.task_id in complete
+        if not seen:
+            complete[task.task_id] = task.complete()
+        outputs = [t.path for t in flatten(task.output()) if hasattr(t, "path")]
+        line = "{}[{}] {}".format(
+            "    " * depth, "x" if complete[task.task_id] else " ", task
+        )
+        if outputs:
+            line += " -> " + ", ".join(outputs)
+        if seen:
+            print(line + " (see above)", file=file)
+            return
+        print(line, file=file)
+        for requirement in flatten(task.requires()):
+            visit(requirement, depth + 1)
+
+    for task in tasks:
+        visit(task, 0)
+    done = sum(complete.values())
+    print("{} tasks, {} complete".format(len(complete), done), file=file)
+    return len(complete), done
+
+
+@contextmanager
+def local_luigid(port, timeout=30):
+    """Run a luigid central scheduler, with its web interface, for the
+    duration of the context
+    :param port: Port of the scheduler
+    :param timeout: Seconds to wait for the scheduler to accept connections"""
+    state_dir = tempfile.TemporaryDirectory()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from luigi.cmdline import luigid; luigid()",
+            "--port",
+            str(port),
+            "--address",
+            "localhost",
+            "--state-path",
+            state_dir.name + "/state.pickle",
+            "--logdir",
+            state_dir.name,
+        ]
+    )
+    try:
+        deadline = time.time() + timeout
+        while True:
+            try:
+                socket.create_connection(("localhost", port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("luigid did not start on port {}".format(port))
+                time.sleep(0.2)
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+        state_dir.cleanup()
 
 
 def main(args=None):
-    build([BuildTModel()], local_scheduler=True)
+    parser = argparse.ArgumentParser(
+        prog="machine-learning-utils",
+        description="Run one or more pipelines, independent tasks run concurrently",
+    )
+    parser.add_argument(
+        "pipelines",
+        nargs="*",
+        default=["titanic"],
+        help="Pipeline names ({}) or dotted task paths".format(
+            ", ".join(sorted(PIPELINES))
+        ),
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of tasks run at once"
+    )
+    parser.add_argument(
+        "--config", action="append", default=[], help="Additional luigi config file"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the tasks and which targets exist without running anything",
+    )
+    scheduler = parser.add_mutually_exclusive_group()
+    scheduler.add_argument(
+        "--scheduler-host",
+        help="Host of a running luigid, instead of a local scheduler",
+    )
+    scheduler.add_argument(
+        "--luigid",
+        action="store_true",
+        help="Start a luigid for the run, to follow it in the web interface",
+    )
+    parser.add_argument("--scheduler-port", type=int, default=8082)
+    args = parser.parse_args(args)
+
+    from luigi import build, configuration
+    from luigi.execution_summary import LuigiStatusCode
+
+    for path in args.config:
+        configuration.add_config_path(path)
+    try:
+        tasks = [load_task(name)() for name in args.pipelines]
+    except (ValueError, ImportError, AttributeError) as e:
+        parser.error(str(e))
+
+    if args.dry_run:
+        print_dag(tasks)
+        return 0
+
+    options = {"workers": args.workers, "detailed_summary": True}
+    if args.scheduler_host:
+        options.update(
+            scheduler_host=args.scheduler_host, scheduler_port=args.scheduler_port
+        )
+        result = build(tasks, **options)
+    elif args.luigid:
+        with local_luigid(args.scheduler_port):
+            result = build(
+                tasks,
+                scheduler_host="localhost",
+                scheduler_port=args.scheduler_port,
+                **options
+            )
+    else:
+        result = build(tasks, local_scheduler=True, **options)
+    succeeded = (LuigiStatusCode.SUCCESS, LuigiStatusCode.SUCCESS_WITH_RETRY)
+    return 0 if result.status in succeeded else 1
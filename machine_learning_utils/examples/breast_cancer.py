@@ -1,9 +1,25 @@
-import pandas as pd
-from luigi import Task, Parameter, LocalTarget, ExternalTask
-from machine_learning_utils.functions.functions import encode_onehot, impute_data
+from luigi import Task, Parameter, LocalTarget, ExternalTask, namespace
+from machine_learning_utils.functions.transforms import (
+    Deduplicate,
+    FilterRows,
+    Imputer,
+    OneHotEncoder,
+    Replace,
+)
 from machine_learning_utils.luigi.task import Requirement
 from machine_learning_utils.luigi.data import DownloadData, DataPreprocess, BuildModel
 
+# Prefix the task families and output paths, ex: breast_cancer.ExtractFeatures,
+# so the pipelines of the examples can be scheduled together
+namespace("breast_cancer", scope=__name__)
+
+
+def valid_age(df):
+    """Function to flag the rows with a plausible age
+    :param df: Pandas Dataframe of breast cancer data
+    :returns boolean series"""
+    return (df["age"] != 250) & (df["age"] != -5)
+
 
 class DownloadBreastCancerData(DownloadData):
     """Luigi task to demonstrate how to download the breast cancer data
@@ -12,6 +28,7 @@ class DownloadBreastCancerData(DownloadData):
 
     # Fill in the DATA Parameter
     DATA = Parameter(default="~/datasets/module03_breast_cancer.csv")
+    SHARED_RELATIVE_PATH = Parameter(default="breast_cancer.parquet")
 
 
 class CleanBreastCancerData(DataPreprocess):
@@ -20,28 +37,19 @@ class CleanBreastCancerData(DataPreprocess):
     """
 
     download = Requirement(DownloadBreastCancerData)
+    # valid_age is versioned with the task
+    code_modules = (__name__,)
 
-    def run(self):
-        df = pd.read_parquet(self.input()["download"].path, engine="pyarrow")
-        df["is_duplicate"] = df.duplicated()
-        df = df.loc[df["is_duplicate"] == False]
-        df.drop(columns="is_duplicate", inplace=True)
-
-        # Replace '?' with mode - value/level with highest frequency in the feature
-
-        df["node-caps"] = df["node-caps"].replace({"?": "no"})
-        df["breast-quad"] = df["breast-quad"].replace({"?": "left_low"})
-
-        # Fill in NA numerical values with mean
-
-        impute_data(df, columns=list(df.columns))
-
-        # Remove incorrect age values
-
-        df = df.loc[(df["age"] != 250) & (df["age"] != -5)]
-        df.reset_index(drop=True, inplace=True)
-
-        df.to_parquet(self.output().path, engine="pyarrow")
+    def transforms(self):
+        return [
+            Deduplicate(),
+            # Replace '?' with mode - value/level with highest frequency in the feature
+            Replace({"node-caps": {"?": "no"}, "breast-quad": {"?": "left_low"}}),
+            # Fill in NA numerical values with median
+            Imputer(),
+            # Remove incorrect age values
+            FilterRows(valid_age),
+        ]
 
 
 class ExtractFeatures(DataPreprocess):
@@ -51,17 +59,13 @@ class ExtractFeatures(DataPreprocess):
 
     cleandata = Requirement(CleanBreastCancerData)
 
-    def run(self):
-        df = pd.read_parquet(self.input()["cleandata"].path, engine="pyarrow")
-
+    def transforms(self):
         # One hot encode categorical features
-        df_o = encode_onehot(df, "menopause")
-        df_o = encode_onehot(df_o, "node-caps")
-        df_o = encode_onehot(df_o, "breast")
-        df_o = encode_onehot(df_o, "breast-quad")
-        df_o = encode_onehot(df_o, "irradiat")
-
-        df_o.to_parquet(self.output().path, engine="pyarrow")
+        return [
+            OneHotEncoder(
+                ["menopause", "node-caps", "breast", "breast-quad", "irradiat"]
+            )
+        ]
 
 
 class BuildBCModel(BuildModel):
@@ -1,8 +1,20 @@
-import pandas as pd
-from luigi import Task, Parameter, LocalTarget, ExternalTask
-from machine_learning_utils.luigi.task import Requirement
+from luigi import (
+    Task,
+    Parameter,
+    BoolParameter,
+    LocalTarget,
+    ExternalTask,
+    namespace,
+)
+from machine_learning_utils.functions.transforms import Deduplicate, OneHotEncoder
+from machine_learning_utils.luigi.task import Requirement, CachedTargetOutput
+from machine_learning_utils.luigi.target import SuffixPreservingLocalTarget
 from machine_learning_utils.luigi.data import DownloadData, DataPreprocess, BuildModel
 
+# Prefix the task families and output paths, ex: mushroom.ExtractFeatures,
+# so the pipelines of the examples can be scheduled together
+namespace("mushroom", scope=__name__)
+
 
 class DownloadMushroomData(DownloadData):
     """Luigi task to demonstrate how to download the mushroom dataset
@@ -10,6 +22,9 @@ class DownloadMushroomData(DownloadData):
     """
 
     DATA = Parameter(default="~/datasets/Mushroom_Dataset.csv")
+    SHARED_RELATIVE_PATH = Parameter(default="mushroom.parquet")
+    # Every column is a letter code, read as a category column
+    optimize_dtypes = BoolParameter(default=True)
 
 
 class CleanMushroomData(DataPreprocess):
@@ -19,13 +34,8 @@ class CleanMushroomData(DataPreprocess):
 
     download = Requirement(DownloadMushroomData)
 
-    def run(self):
-        df = pd.read_parquet(self.input()["download"].path, engine="pyarrow")
-        df["is_duplicate"] = df.duplicated()
-        df = df.loc[df["is_duplicate"] == False]
-
-        df.drop(columns="is_duplicate", inplace=True)
-        df.to_parquet(self.output().path, engine="pyarrow")
+    def transforms(self):
+        return [Deduplicate()]
 
 
 class ExtractFeatures(DataPreprocess):
@@ -35,11 +45,20 @@ class ExtractFeatures(DataPreprocess):
 
     cleandata = Requirement(CleanMushroomData)
 
-    def run(self):
-        df = pd.read_parquet(self.input()["cleandata"].path, engine="pyarrow")
-        df_o = pd.get_dummies(df.iloc[:, 1:], columns=df.columns[1:])
-        df_o["class"] = df["class"]
-        df_o.to_parquet(self.output().path, engine="pyarrow")
+    def transforms(self):
+        # One hot encode every feature, the class column is kept as is
+        return [OneHotEncoder(exclude=["class"], sep="_")]
+
+
+class ExtractSparseFeatures(ExtractFeatures):
+    """Luigi task to demonstrate how to one hot encode the mushroom
+    dataset into sparse features saved to a .npz file
+    """
+
+    output = CachedTargetOutput(ext=".npz", target_class=SuffixPreservingLocalTarget)
+
+    def transforms(self):
+        return [OneHotEncoder(exclude=["class"], sep="_", sparse=True)]
 
 
 class BuildMRModel(BuildModel):
@@ -49,3 +68,12 @@ class BuildMRModel(BuildModel):
 
     preprocess = Requirement(ExtractFeatures)
     class_column = Parameter(default="class")
+
+
+class BuildSparseMRModel(BuildModel):
+    """Luigi task to demonstrate how to build a model
+    from the sparse mushroom features.
+    """
+
+    preprocess = Requirement(ExtractSparseFeatures)
+    class_column = Parameter(default="class")
@@ -1,9 +1,65 @@
-import re
-import pandas as pd
-from luigi import Task, Parameter, LocalTarget, ExternalTask
-from machine_learning_utils.functions.functions import encode_onehot, impute_data
+from luigi import Task, Parameter, LocalTarget, ExternalTask, namespace
+from machine_learning_utils.functions.functions import (
+    extract_pattern,
+    map_categories,
+    threshold_flags,
+)
+from machine_learning_utils.functions.transforms import (
+    Apply,
+    Deduplicate,
+    DropColumns,
+    Imputer,
+    OneHotEncoder,
+)
 from machine_learning_utils.luigi.task import Requirement
-from machine_learning_utils.luigi.data import DownloadData, DataPreprocess, BuildModel
+from machine_learning_utils.luigi.data import (
+    DownloadData,
+    DataPreprocess,
+    BuildModel,
+    TrainModel,
+    TuneModel,
+    ScoreData,
+)
+
+# Prefix the task families and output paths, ex: titanic.ExtractFeatures,
+# so the pipelines of the examples can be scheduled together
+namespace("titanic", scope=__name__)
+
+
+def engineer_features(df):
+    """Function to derive the family size, title and deck features
+    :param df: Pandas Dataframe of cleaned titanic data
+    :returns pandas dataframe with the new features"""
+    # determine family size
+    df["familysize"] = df["parch"] + df["sibsp"] + 1
+    flags = threshold_flags(
+        df["familysize"],
+        {"singleton": (1, 1), "smallfamily": (2, 4), "largefamily": (5, None)},
+    )
+    df[list(flags.columns)] = flags
+
+    # strip titles from names, the text between the first comma and period
+    df["title"] = map_categories(
+        extract_pattern(df["name"], r"^[^,]*,([^,.]*)").str.strip(),
+        mapping={"Mlle": "Miss", "Ms": "Miss", "Mme": "Mrs"},
+        rare=[
+            "Lady",
+            "Countess",
+            "Capt",
+            "Col",
+            "Don",
+            "Dr",
+            "Major",
+            "Rev",
+            "Sir",
+            "Jonkheer",
+            "Dona",
+        ],
+    )
+
+    # convert cabin into numbers
+    df["deck"] = extract_pattern(df["cabin"], "([a-zA-Z]+)")
+    return df
 
 
 class DownloadTitanicData(DownloadData):
@@ -12,6 +68,7 @@ class DownloadTitanicData(DownloadData):
     """
 
     DATA = Parameter(default="~/datasets/titanic.csv")
+    SHARED_RELATIVE_PATH = Parameter(default="titanic.parquet")
 
 
 class CleanTitanicData(DataPreprocess):
@@ -21,16 +78,15 @@ class CleanTitanicData(DataPreprocess):
 
     download = Requirement(DownloadTitanicData)
 
-    def run(self):
-        df = pd.read_parquet(self.input()["download"].path, engine="pyarrow")
-        df["is_duplicate"] = df.duplicated()
-        df = df.loc[df["is_duplicate"] == False]
-        df.drop(columns=["is_duplicate", "boat", "body", "home.dest"], inplace=True)
-
-        # Fill in NA values with mean
-        impute_data(df, columns=list(df.columns))
-
-        df.to_parquet(self.output().path, engine="pyarrow")
+    def transforms(self):
+        return [
+            # The unused columns are dropped after deduplicating, rows
+            # differing in them only are distinct passengers
+            Deduplicate(),
+            DropColumns(["boat", "body", "home.dest"]),
+            # Fill in NA values with median or most frequent value
+            Imputer(),
+        ]
 
 
 class ExtractFeatures(DataPreprocess):
@@ -39,53 +95,17 @@ class ExtractFeatures(DataPreprocess):
     """
 
     cleandata = Requirement(CleanTitanicData)
+    exclude_columns = ["passenger_id", "ticket"]
+    # engineer_features is versioned with the task
+    code_modules = (__name__,)
 
-    def run(self):
-        df = pd.read_parquet(self.input()["cleandata"].path, engine="pyarrow")
-
-        # determine family size
-        df["familysize"] = df["parch"] + df["sibsp"] + 1
-        df["singleton"] = df["familysize"].map(lambda s: 1 if s == 1 else 0)
-        df["smallfamily"] = df["familysize"].map(lambda s: 1 if 2 <= s <= 4 else 0)
-        df["largefamily"] = df["familysize"].map(lambda s: 1 if 5 <= s else 0)
-
-        # strip titles from names
-        df["title"] = df["name"].map(
-            lambda name: name.split(",")[1].split(".")[0].strip()
-        )
-        df["title"] = df["title"].replace(
-            [
-                "Lady",
-                "Countess",
-                "Capt",
-                "Col",
-                "Don",
-                "Dr",
-                "Major",
-                "Rev",
-                "Sir",
-                "Jonkheer",
-                "Dona",
-            ],
-            "Rare",
-        )
-        df["title"] = df["title"].replace("Mlle", "Miss")
-        df["title"] = df["title"].replace("Ms", "Miss")
-        df["title"] = df["title"].replace("Mme", "Mrs")
-
-        # convert cabin into numbers
-        df["deck"] = df["cabin"].map(
-            lambda x: re.compile("([a-zA-Z]+)").search(x).group()
-        )
-
-        # onehot-encode nominal features
-        df_o = encode_onehot(df, "embarked")
-        df_o = encode_onehot(df_o, "sex")
-        df_o = encode_onehot(df_o, "title")
-        df_o = encode_onehot(df_o, "deck")
-
-        df_o = df_o.drop(columns=["passenger_id", "name", "ticket", "cabin"])
-        df_o.to_parquet(self.output().path, engine="pyarrow")
+    def transforms(self):
+        return [
+            Apply(engineer_features),
+            # onehot-encode nominal features
+            OneHotEncoder(["embarked", "sex", "title", "deck"]),
+            DropColumns(["name", "cabin"]),
+        ]
 
 
 class BuildTModel(BuildModel):
@@ -96,3 +116,30 @@ class BuildTModel(BuildModel):
 
     preprocess = Requirement(ExtractFeatures)
     class_column = Parameter(default="survived")
+
+
+class TuneTModel(TuneModel):
+    """Luigi task to demonstrate how to search the best
+    parameters of the models with successive halving
+    """
+
+    preprocess = Requirement(ExtractFeatures)
+    class_column = Parameter(default="survived")
+
+
+class TrainTModel(TrainModel):
+    """Luigi task to demonstrate how to fit and save a model
+    with its preprocessing to score new passengers
+    """
+
+    preprocess = Requirement(ExtractFeatures)
+    class_column = Parameter(default="survived")
+
+
+class ScoreTData(ScoreData):
+    """Luigi task to demonstrate how to score a parquet file
+    of new passengers with the saved model
+    """
+
+    train = Requirement(TrainTModel)
+    keep_columns = ["passenger_id"]
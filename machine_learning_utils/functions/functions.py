@@ -1,21 +1,178 @@
+import os
+import importlib
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import StratifiedKFold
-from sklearn.metrics import accuracy_score, classification_report
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from machine_learning_utils.functions.transforms import Imputer, OneHotEncoder
 
+BACKENDS = ("serial", "thread", "process", "loky")
 
-def eval_classifier(clf, X, y):
+
+def _n_workers(n_jobs):
+    """Resolve the number of workers, None or negative values use all cpus"""
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def _executor(backend, workers):
+    if backend == "loky":
+        from joblib.externals.loky import get_reusable_executor
+
+        # The loky executor is kept alive to be reused by the next batch of jobs
+        return nullcontext(get_reusable_executor(max_workers=workers))
+    if backend == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def iter_jobs(jobs, backend="serial", n_jobs=None, max_pending=None):
+    """Function to execute independent jobs lazily with a selectable backend,
+    only a bounded number of jobs is submitted ahead of the results consumed
+    :param jobs: Iterable of (function, args) tuples, functions must be
+        picklable for the process and loky backends
+    :param backend: One of "serial", "thread", "process" or "loky"
+    :param n_jobs: Maximum number of workers, defaults to the number of cpus
+    :param max_pending: Maximum number of jobs submitted and not yet
+        consumed, defaults to twice the number of workers
+    :returns iterator of job results in submission order"""
+    if backend not in BACKENDS:
+        raise ValueError(
+            "Unknown backend {!r}, expected one of {}".format(backend, BACKENDS)
+        )
+    workers = _n_workers(n_jobs)
+
+    if backend == "serial" or workers == 1:
+        for func, args in jobs:
+            yield func(*args)
+        return
+
+    max_pending = max_pending or 2 * workers
+    with _executor(backend, workers) as pool:
+        pending = deque()
+        for func, args in jobs:
+            pending.append(pool.submit(func, *args))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_jobs(jobs, backend="serial", n_jobs=None):
+    """Function to execute independent jobs with a selectable backend
+    :param jobs: List of (function, args) tuples, functions must be picklable
+        for the process and loky backends
+    :param backend: One of "serial", "thread", "process" or "loky"
+    :param n_jobs: Maximum number of workers, defaults to the number of cpus
+    :returns list of job results in submission order"""
+    jobs = list(jobs)
+    workers = min(_n_workers(n_jobs), max(len(jobs), 1))
+    return list(iter_jobs(jobs, backend, workers, max_pending=len(jobs)))
+
+
+def _fit_fold(clf, X, y, train_index, test_index):
+    """Fit a fresh copy of the classifier on a single fold, the rows of the
+    fold are copied out of X, ex: a SharedArray, since the estimators expect
+    a contiguous array
+    :returns classification report of the fold as a dictionary"""
+    from sklearn.base import clone
+    from sklearn.metrics import classification_report
+
+    clf = clone(clf)
+    clf.fit(X[train_index], y[train_index])
+    y_pred = clf.predict(X[test_index])
+    return classification_report(y[test_index], y_pred, output_dict=True)
+
+
+def aggregate_reports(reports):
+    """Function to combine classification reports of several folds
+    :param reports: List of classification report dictionaries, one per fold
+    :returns pandas dataframe indexed by (label, metric) with mean, std
+        and one column per fold"""
+    folds = pd.concat(
+        [pd.DataFrame(report).unstack() for report in reports],
+        axis=1,
+        keys=["fold_{}".format(i) for i in range(len(reports))],
+    )
+    folds.index.names = ["label", "metric"]
+    df = pd.DataFrame({"mean": folds.mean(axis=1), "std": folds.std(axis=1)})
+    return df.join(folds)
+
+
+def load_estimator(spec):
+    """Function to build an estimator from a model registry entry
+    :param spec: Dictionary with the dotted "estimator" path and optional "params",
+        Ex: {"estimator": "sklearn.svm.SVC", "params": {"C": 2}}
+    :returns unfitted scikit-learn estimator"""
+    module, _, name = spec["estimator"].rpartition(".")
+    estimator = getattr(importlib.import_module(module), name)
+    return estimator(**dict(spec.get("params", {})))
+
+
+def load_models(specs):
+    """Function to build the estimators of a model registry
+    :param specs: List of registry entries, see :func:`load_estimator`. The
+        optional "name" key defaults to the estimator class name
+    :returns dictionary of model name to unfitted estimator
+    :raises ValueError: when two entries have the same name"""
+    models = {}
+    for spec in specs:
+        name = spec.get("name", spec["estimator"].rpartition(".")[2])
+        if name in models:
+            raise ValueError(
+                "Duplicate model name {!r}, give the entries distinct names".format(
+                    name
+                )
+            )
+        models[name] = load_estimator(spec)
+    return models
+
+
+def eval_classifiers(clfs, X, y, n_splits=10, backend="serial", n_jobs=None):
+    """Function to evaluate several classifiers on the same folds, every
+    (classifier, fold) fit is scheduled as one flat batch of jobs
+    :param clfs: Dictionary of model name to classifier
+    :param X: Features values
+    :param y: label values
+    :param n_splits: Number of stratified folds
+    :param backend: Fold execution backend, see :func:`run_jobs`
+    :param n_jobs: Maximum number of fits run concurrently
+    :returns pandas dataframe of the classification reports indexed by
+        (model, label, metric)"""
+    from sklearn.model_selection import StratifiedKFold
+
+    kf = StratifiedKFold(n_splits=n_splits, shuffle=False, random_state=None)
+    folds = list(kf.split(X, y))
+    jobs = [
+        (_fit_fold, (clf, X, y, train_index, test_index))
+        for clf in clfs.values()
+        for train_index, test_index in folds
+    ]
+    reports = run_jobs(jobs, backend=backend, n_jobs=n_jobs)
+    return pd.concat(
+        {
+            name: aggregate_reports(reports[i * n_splits : (i + 1) * n_splits])
+            for i, name in enumerate(clfs)
+        },
+        names=["model"],
+    )
+
+
+def eval_classifier(clf, X, y, n_splits=10, backend="serial", n_jobs=None):
     """Function to evaluate a classifier for any given scikit-learn model
     :param clf: Classifier to be used Ex: SVM, Random Forest, Naive Bayes
     :param X: Features values
     :param y: label values
-    :returns pandas dataframe of classification report"""
-    kf = StratifiedKFold(n_splits=10, shuffle=False, random_state=None)
-    for train_index, test_index in kf.split(X, y):
-        clf.fit(X[train_index], y[train_index])
-        y_pred = clf.predict(X[test_index])
-        class_report = classification_report(y[test_index], y_pred, output_dict=True)
-        df = pd.DataFrame(class_report)
-    return df
+    :param n_splits: Number of stratified folds
+    :param backend: Fold execution backend, see :func:`run_jobs`
+    :param n_jobs: Maximum number of folds fitted concurrently
+    :returns pandas dataframe of the classification report aggregated over folds"""
+    report = eval_classifiers(
+        {"clf": clf}, X, y, n_splits=n_splits, backend=backend, n_jobs=n_jobs
+    )
+    return report.xs("clf")
 
 
 def encode_onehot(df, col):
@@ -23,14 +180,7 @@ def encode_onehot(df, col):
     :param df: Pandas Dataframe
     :param col: Column containing categorical values
     :returns pandas dataframe with encoding values"""
-    df2 = (
-        pd.get_dummies(df[col], prefix="", prefix_sep="")
-        .max(level=0, axis=1)
-        .add_prefix(col + " - ")
-    )
-    df3 = pd.concat([df, df2], axis=1)
-    df3 = df3.drop([col], axis=1)
-    return df3
+    return OneHotEncoder([col]).fit_transform(df)
 
 
 def impute_data(df, columns):
@@ -38,8 +188,55 @@ def impute_data(df, columns):
     :param df: Pandas Dataframe
     :param columns: Columns containing missing values
     :returns pandas dataframe with missing values imputed"""
-    for col in columns:
-        if df[col].dtype == object:
-            df[col].fillna(df[col].value_counts().idxmax(), inplace=True)
-        else:
-            df[col].fillna(df[col].median(), inplace=True)
+    # Fitted on the frame, the mode of a category column is one of its
+    # categories, so one fill in place covers every column
+    df.fillna(Imputer(columns).fit(df).statistics_, inplace=True)
+    return df
+
+
+def threshold_flags(series, bins):
+    """Function to flag the values of a numeric series falling in named ranges
+    :param series: Pandas Series of numbers
+    :param bins: Dictionary of flag name to inclusive (low, high) bounds,
+        None for an unbounded side Ex: {"adult": (18, None)}
+    :returns pandas dataframe with one uint8 column per flag"""
+    flags = {}
+    for name, (low, high) in bins.items():
+        flag = pd.Series(True, index=series.index)
+        if low is not None:
+            flag &= series >= low
+        if high is not None:
+            flag &= series <= high
+        flags[name] = flag.astype("uint8")
+    return pd.DataFrame(flags, index=series.index)
+
+
+def extract_pattern(series, pattern):
+    """Function to extract the first group of a regular expression
+    :param series: Pandas Series of strings
+    :param pattern: Regular expression with one capture group
+    :returns pandas series of the matches, NaN where nothing matched"""
+    return series.str.extract(pattern, expand=False)
+
+
+def map_categories(series, mapping=None, rare=(), rare_label="Rare", min_count=0):
+    """Function to relabel the categories of a series with a mapping table
+    and bucket rare categories, each distinct value is mapped only once
+    :param series: Pandas Series
+    :param mapping: Dictionary of category to new label
+    :param rare: Categories put in the rare bucket
+    :param rare_label: Label of the rare bucket
+    :param min_count: Unmapped categories seen fewer times are put in the rare bucket
+    :returns pandas series of labels"""
+    codes, uniques = pd.factorize(series)
+    table = {}
+    if min_count:
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        table.update({category: rare_label for category in uniques[counts < min_count]})
+    # The mapping table and the rare list take precedence over min_count
+    table.update(mapping or {})
+    table.update({category: rare_label for category in rare})
+    labels = [table.get(category, category) for category in uniques]
+    # Missing values have the code -1, which takes the trailing NaN
+    labels = np.array(labels + [np.nan], dtype=object)
+    return pd.Series(labels[codes], index=series.index, name=series.name)
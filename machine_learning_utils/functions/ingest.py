@@ -0,0 +1,660 @@
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+CSV_ENGINES = ("pandas", "pyarrow")
+# Part files of a dataset written by append_part, numbered in append order
+PART_FORMAT = "part-{:05d}.parquet"
+_PART = re.compile(r"^part-(\d+)\.parquet$")
+
+
+def iter_csv(source, chunksize=100000, engine="pandas", block_size=1 << 24):
+    """Function to read a csv file in bounded chunks
+    :param source: Path of the csv file
+    :param chunksize: Number of rows per chunk for the pandas engine
+    :param engine: "pandas" or "pyarrow", the pyarrow reader decodes each
+        block with multiple threads, with the types inferred from the first
+        block, while pandas infers the types of every chunk, which
+        :func:`write_parquet` reconciles
+    :param block_size: Number of bytes per chunk for the pyarrow engine
+    :returns iterator of pyarrow tables"""
+    source = os.path.expanduser(source)
+    if engine == "pyarrow":
+        from pyarrow import csv
+
+        options = csv.ReadOptions(use_threads=True, block_size=block_size)
+        with csv.open_csv(source, read_options=options) as reader:
+            for batch in reader:
+                yield pa.Table.from_batches([batch])
+    elif engine == "pandas":
+        for chunk in pd.read_csv(source, chunksize=chunksize):
+            yield pa.Table.from_pandas(chunk, preserve_index=False)
+    else:
+        raise ValueError(
+            "Unknown csv engine {!r}, expected one of {}".format(engine, CSV_ENGINES)
+        )
+
+
+def _pandas_schema(parquet_file):
+    """Schema reading every batch with the dtypes pandas gives the whole file,
+    integer columns holding nulls anywhere in the file are read as floats"""
+    schema = parquet_file.schema_arrow
+    metadata = parquet_file.metadata
+    for i, field in enumerate(schema):
+        if not pa.types.is_integer(field.type):
+            continue
+        nulls = 0
+        for j in range(metadata.num_row_groups):
+            stats = metadata.row_group(j).column(i).statistics
+            nulls += stats.null_count if stats is not None else 1
+        if nulls:
+            schema = schema.set(i, field.with_type(pa.float64()))
+    return schema
+
+
+def iter_parquet(path, batch_size=65536, columns=None, filters=None, row_groups=None):
+    """Function to read a parquet file in bounded batches
+    :param path: Path of the parquet file, or of a dataset directory written
+        by :func:`append_part`, read part by part
+    :param batch_size: Maximum number of rows per batch
+    :param columns: Columns to read, defaults to every column
+    :param filters: Row filters in the DNF form of :func:`pyarrow.parquet.read_table`,
+        pushed down so row groups excluded by their statistics are skipped
+    :param row_groups: Indices of the row groups to read, defaults to every one
+    :returns iterator of pandas dataframes"""
+    if os.path.isdir(path):
+        for part in dataset_parts(path):
+            yield from iter_parquet(part, batch_size, columns=columns, filters=filters)
+        return
+    schema = _pandas_schema(pq.ParquetFile(path))
+    if columns is not None:
+        schema = pa.schema([schema.field(col) for col in columns])
+    if filters is None and columns is None:
+        batches = pq.ParquetFile(path).iter_batches(
+            batch_size=batch_size, row_groups=row_groups
+        )
+    else:
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(path, format="parquet")
+        if row_groups is not None:
+            (fragment,) = dataset.get_fragments()
+            dataset = fragment.subset(row_group_ids=list(row_groups))
+        batches = dataset.to_batches(
+            columns=columns,
+            filter=pq.filters_to_expression(filters) if filters else None,
+            batch_size=batch_size,
+        )
+    for batch in batches:
+        yield pa.Table.from_batches([batch]).cast(schema).to_pandas()
+
+
+def discover_partitions(root):
+    """Function to list the partitions of a Hive partitioned parquet dataset
+    :param root: Directory of the dataset, ex: root/region=EU/part-0.parquet
+    :returns sorted list of the leaf partitions relative to root,
+        ex: ["region=EU/product=A", "region=EU/product=B"]"""
+    partitions = []
+
+    def walk(path, parts):
+        with os.scandir(path) as entries:
+            children = [e for e in entries if e.is_dir() and "=" in e.name]
+        if not children:
+            if parts:
+                partitions.append("/".join(parts))
+            return
+        for entry in children:
+            walk(entry.path, parts + [entry.name])
+
+    walk(os.path.expanduser(root), [])
+    return sorted(partitions)
+
+
+def iter_partition(root, partition, batch_size=65536, columns=None, filters=None):
+    """Function to read one partition of a Hive partitioned parquet dataset
+    from its own directory, so the other partitions are never listed
+    :param root: Directory of the dataset
+    :param partition: Partition path relative to root, ex: "region=EU"
+    :param batch_size: Maximum number of rows per batch
+    :param columns: Columns to read, defaults to every column
+    :param filters: Row filters in the DNF form of :func:`pyarrow.parquet.read_table`
+    :returns iterator of pyarrow tables"""
+    import pyarrow.dataset as ds
+
+    path = os.path.join(os.path.expanduser(root), partition)
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    batches = dataset.to_batches(
+        columns=columns,
+        filter=pq.filters_to_expression(filters) if filters else None,
+        batch_size=batch_size,
+    )
+    for batch in batches:
+        yield pa.Table.from_batches([batch])
+
+
+# Candidate types of the integer columns, narrowest first
+_INTEGER_TYPES = (pa.int8(), pa.int16(), pa.int32(), pa.int64())
+
+
+def _integer_type(n):
+    """Narrowest integer type holding the values -n to n"""
+    for type_ in _INTEGER_TYPES:
+        info = np.iinfo(type_.to_pandas_dtype())
+        if -n >= info.min and n <= info.max:
+            return type_
+    return None
+
+
+def _fits_float32(column):
+    """Whether every value of a float column survives a cast to float32"""
+    values = column.to_numpy()
+    with np.errstate(over="ignore"):
+        narrow = values.astype(np.float32)
+    return np.array_equal(narrow.astype(values.dtype), values, equal_nan=True)
+
+
+# Dictionary encoded columns keep their indices within int16
+_MAX_CATEGORIES = 2**15 - 1
+
+
+def _new_stats(type_):
+    return {
+        "type": type_,
+        "min": None,
+        "max": None,
+        "float32": True,
+        "count": 0,
+        "values": set(),
+    }
+
+
+def _update_stats(stats, column):
+    """Merge the statistics of a column of one table into the running ones"""
+    type_ = stats["type"]
+    if pa.types.is_integer(type_):
+        bounds = pc.min_max(column)
+        for key, merge in (("min", min), ("max", max)):
+            value = bounds[key].as_py()
+            if value is not None:
+                stats[key] = value if stats[key] is None else merge(stats[key], value)
+    elif pa.types.is_float64(type_):
+        stats["float32"] = stats["float32"] and _fits_float32(column)
+    elif pa.types.is_string(type_) or pa.types.is_large_string(type_):
+        stats["count"] += len(column) - column.null_count
+        if stats["values"] is not None:
+            stats["values"].update(pc.unique(column.drop_null()).to_pylist())
+            if len(stats["values"]) > _MAX_CATEGORIES:
+                stats["values"] = None
+
+
+def _narrow_type(stats, category_ratio):
+    """Narrowest type holding the values of a column, None to keep its type"""
+    type_ = stats["type"]
+    if pa.types.is_integer(type_):
+        if stats["min"] is not None:
+            narrow = _integer_type(max(-stats["min"], stats["max"]))
+            if narrow is not None and narrow.bit_width < type_.bit_width:
+                return narrow
+    elif pa.types.is_float64(type_):
+        if stats["float32"]:
+            return pa.float32()
+    elif stats["values"] is not None:
+        distinct = len(stats["values"])
+        if stats["count"] and distinct <= category_ratio * stats["count"]:
+            return pa.dictionary(_integer_type(distinct), type_)
+    return None
+
+
+def _format_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return "{:.1f}{}".format(n, unit)
+        n /= 1024
+    return "{:.1f}GB".format(n)
+
+
+def _type_name(type_):
+    if pa.types.is_dictionary(type_):
+        return "category[{},{}]".format(type_.value_type, type_.index_type)
+    return str(type_)
+
+
+def _parse_type(name):
+    if name.startswith("category["):
+        value_type, index_type = name[len("category[") : -1].split(",")
+        return pa.dictionary(
+            pa.type_for_alias(index_type), pa.type_for_alias(value_type)
+        )
+    return pa.type_for_alias(name)
+
+
+class SchemaOptimizer:
+    """Narrow the column types of a stream of tables to save memory
+
+    Integer columns are downcast to the smallest integer type holding their
+    values, float columns to float32 when no value loses precision, and
+    string columns with few distinct values are dictionary encoded, which
+    pandas reads as ``category`` columns. As the steps of a preprocessing
+    chain, the types are fitted over every table of the stream with
+    :meth:`partial_fit`, and can be saved and restored to cast the next
+    streams without a fitting pass.
+    :param category_ratio: Maximum ratio of distinct to non null values of
+        a dictionary encoded string column
+    """
+
+    def __init__(self, category_ratio=0.5):
+        self.category_ratio = category_ratio
+        self.columns_ = None
+        self.types_ = {}
+        self.bytes_before_ = {}
+        self.bytes_after_ = {}
+        self._columns = None
+        self._stats = {}
+
+    def partial_fit(self, table):
+        """Update the statistics of the columns with a table"""
+        if table.num_rows == 0:
+            # Types inferred from an empty chunk are unreliable
+            return self
+        if self._columns is None:
+            self._columns = list(table.column_names)
+        elif table.column_names != self._columns:
+            raise ValueError(
+                "Columns {} do not match the columns {} of the first table".format(
+                    table.column_names, self._columns
+                )
+            )
+        for name, column in zip(table.column_names, table.columns):
+            stats = self._stats.setdefault(name, _new_stats(column.type))
+            if stats["type"] is None:
+                continue
+            if stats["type"] != column.type:
+                # Columns whose type changes between tables are kept as read
+                stats["type"] = None
+                continue
+            _update_stats(stats, column)
+        return self
+
+    def finish_fit(self):
+        """Derive the narrowed types once every table has been seen"""
+        self.columns_ = self._columns or []
+        self.types_ = {}
+        for name, stats in self._stats.items():
+            type_ = None
+            if stats["type"] is not None:
+                type_ = _narrow_type(stats, self.category_ratio)
+            if type_ is not None:
+                self.types_[name] = type_
+        self._columns = None
+        self._stats = {}
+        return self
+
+    def fit(self, table):
+        return self.partial_fit(table).finish_fit()
+
+    def transform(self, table):
+        """Cast a table to the fitted types
+        :param table: Pyarrow table
+        :returns pyarrow table, raises ValueError when the values of the
+            table do not fit the types"""
+        if self.columns_ is None:
+            raise ValueError("The types are not fitted")
+        if table.column_names != self.columns_:
+            raise ValueError(
+                "Columns {} do not match the fitted columns {}".format(
+                    table.column_names, self.columns_
+                )
+            )
+        columns = []
+        try:
+            for name, column in zip(table.column_names, table.columns):
+                type_ = self.types_.get(name)
+                if type_ is None or type_ == column.type:
+                    columns.append(column)
+                    continue
+                if pa.types.is_float32(type_) and not _fits_float32(column):
+                    raise pa.ArrowInvalid("Values lose precision in float32")
+                if pa.types.is_dictionary(type_) and not pa.types.is_dictionary(
+                    column.type
+                ):
+                    column = pc.dictionary_encode(column)
+                columns.append(column.cast(type_))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(
+                "Column {} does not fit the fitted type {}: {}".format(
+                    name, type_, e
+                )
+            )
+        narrow = pa.Table.from_arrays(columns, names=table.column_names)
+        for name in table.column_names:
+            self.bytes_before_[name] = (
+                self.bytes_before_.get(name, 0) + table.column(name).nbytes
+            )
+            self.bytes_after_[name] = (
+                self.bytes_after_.get(name, 0) + narrow.column(name).nbytes
+            )
+        return narrow
+
+    def fit_transform(self, table):
+        return self.fit(table).transform(table)
+
+    def report(self):
+        """Returns a text report of the memory of the narrowed columns
+        before and after, in the Arrow layout of the tables"""
+        before = sum(self.bytes_before_.values())
+        after = sum(self.bytes_after_.values())
+        lines = [
+            "Memory {} -> {} ({:.1f}x smaller)".format(
+                _format_bytes(before),
+                _format_bytes(after),
+                before / after if after else 1.0,
+            )
+        ]
+        for name, type_ in self.types_.items():
+            lines.append(
+                "  {}: {}, {} -> {}".format(
+                    name,
+                    _type_name(type_),
+                    _format_bytes(self.bytes_before_.get(name, 0)),
+                    _format_bytes(self.bytes_after_.get(name, 0)),
+                )
+            )
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "category_ratio": self.category_ratio,
+            "columns": self.columns_,
+            "types": {name: _type_name(type_) for name, type_ in self.types_.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        optimizer = cls(category_ratio=state["category_ratio"])
+        optimizer.columns_ = state["columns"]
+        optimizer.types_ = {
+            name: _parse_type(type_name) for name, type_name in state["types"].items()
+        }
+        return optimizer
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def filter_frame(df, filters):
+    """Function to apply parquet style DNF row filters to a dataframe
+    :param df: Pandas Dataframe
+    :param filters: List of (column, op, value) tuples combined with AND,
+        or a list of such lists combined with OR
+    :returns filtered pandas dataframe"""
+    if not filters:
+        return df
+    if isinstance(filters[0], tuple):
+        filters = [filters]
+    ops = {
+        "=": lambda s, v: s == v,
+        "==": lambda s, v: s == v,
+        "!=": lambda s, v: s != v,
+        "<": lambda s, v: s < v,
+        ">": lambda s, v: s > v,
+        "<=": lambda s, v: s <= v,
+        ">=": lambda s, v: s >= v,
+        "in": lambda s, v: s.isin(v),
+        "not in": lambda s, v: ~s.isin(v),
+    }
+    mask = pd.Series(False, index=df.index)
+    for conjunction in filters:
+        keep = pd.Series(True, index=df.index)
+        for col, op, value in conjunction:
+            keep &= ops[op](df[col], value)
+        mask |= keep
+    return df.loc[mask]
+
+
+def _promote(schema, table, untyped):
+    """Schema holding both the rows written with a schema and a new table
+    :param schema: Schema of the rows written so far
+    :param table: Pyarrow table of the next rows
+    :param untyped: Names of the columns which were null in every row so
+        far, whose type was a guess, ex: float64 for pandas
+    :returns pyarrow schema"""
+    for i, field in enumerate(schema):
+        if field.name not in table.column_names:
+            continue
+        column = table.column(field.name)
+        new_type = column.type
+        if new_type == field.type or column.null_count == len(column):
+            continue
+        if field.name in untyped:
+            schema = schema.set(i, field.with_type(new_type))
+        elif (
+            pa.types.is_integer(field.type) and pa.types.is_floating(new_type)
+        ) or (pa.types.is_floating(field.type) and pa.types.is_integer(new_type)):
+            schema = schema.set(i, field.with_type(pa.float64()))
+    return schema
+
+
+def _null_columns(table):
+    return {
+        name
+        for name, column in zip(table.column_names, table.columns)
+        if column.null_count == len(column)
+    }
+
+
+def write_parquet(tables, out_file, row_group_size=None):
+    """Function to append a stream of tables to a single parquet file
+    :param tables: Iterable of pyarrow tables, every table is cast to the
+        schema of the first non empty one, widened when a later table needs
+        it: a column null so far takes the type of its first values, and
+        integers meeting floats become float64. The rows already written
+        are then copied to the widened schema, which requires out_file to
+        be a path
+    :param out_file: Path or writable file object
+    :param row_group_size: Maximum number of rows per row group
+    :returns number of rows written"""
+    writer = None
+    path = out_file
+    empty = None
+    untyped = set()
+    rows = 0
+    try:
+        for table in tables:
+            if table.num_rows == 0:
+                # Types inferred from an empty chunk are unreliable
+                empty = table if empty is None else empty
+                continue
+            if writer is None:
+                writer = pq.ParquetWriter(out_file, table.schema)
+                untyped = _null_columns(table)
+            elif not table.schema.equals(writer.schema):
+                schema = _promote(writer.schema, table, untyped)
+                if not schema.equals(writer.schema):
+                    writer, path = _widen(writer, path, out_file, schema)
+                try:
+                    table = table.cast(writer.schema)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                    raise ValueError(
+                        "Chunk does not match the types of the previous "
+                        "chunks: {}".format(e)
+                    )
+            untyped &= _null_columns(table)
+            writer.write_table(table, row_group_size=row_group_size)
+            rows += table.num_rows
+        if writer is None and empty is not None:
+            writer = pq.ParquetWriter(out_file, empty.schema)
+            writer.write_table(empty)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if path is not out_file:
+            os.remove(path)
+        raise
+    if writer is not None:
+        writer.close()
+    if path is not out_file:
+        os.replace(path, out_file)
+    return rows
+
+
+def _widen(writer, path, out_file, schema):
+    """Copy the row groups written so far to a new file of a wider schema
+    :returns (writer of the new file, path of the new file)"""
+    if not isinstance(path, (str, os.PathLike)):
+        raise ValueError(
+            "The types of the chunks changed, which requires a path to widen "
+            "the rows written so far, got a file object"
+        )
+    writer.close()
+    new_path = "{}-widen-{}".format(out_file, os.getpid())
+    new_writer = pq.ParquetWriter(new_path, schema)
+    try:
+        parquet_file = pq.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            new_writer.write_table(parquet_file.read_row_group(i).cast(schema))
+    except BaseException:
+        new_writer.close()
+        os.remove(new_path)
+        raise
+    if path is not out_file:
+        os.remove(path)
+    return new_writer, new_path
+
+
+def _fill_column(type_, rows, fill_value):
+    if fill_value is None:
+        return pa.nulls(rows, type=type_)
+    return pa.array(np.full(rows, fill_value)).cast(type_)
+
+
+def _align(table, schema, fill_value):
+    """Cast a table to a schema, with the columns it misses filled"""
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name))
+        else:
+            columns.append(_fill_column(field.type, table.num_rows, fill_value))
+    return pa.Table.from_arrays(columns, names=schema.names).cast(schema)
+
+
+def dataset_parts(path):
+    """Function to list the part files of a parquet dataset written by
+    :func:`append_part`, in the order they were appended
+    :param path: Path of the dataset directory, or of a single parquet file
+    :returns list of paths"""
+    if not os.path.isdir(path):
+        return [path]
+    numbers = sorted(
+        int(match.group(1)) for match in map(_PART.match, os.listdir(path)) if match
+    )
+    return [os.path.join(path, PART_FORMAT.format(number)) for number in numbers]
+
+
+def append_parquet(path, tables, out_file, fill_value=None, row_group_size=None):
+    """Function to write the rows of a parquet file followed by new rows,
+    the existing row groups are copied without being decoded to pandas
+    :param path: Path of the existing parquet file or dataset directory
+    :param tables: Iterable of pyarrow tables of the new rows
+    :param out_file: Path or writable file object, other than path
+    :param fill_value: Value of the columns missing from either side, ex: the
+        one hot columns of categories first seen in the new rows, null by
+        default
+    :param row_group_size: Maximum number of rows per row group
+    :returns number of rows written"""
+    tables = [table for table in tables if table.num_rows]
+    parts = dataset_parts(path)
+    schema = pq.read_schema(parts[-1]).remove_metadata()
+    for table in tables:
+        for field in table.schema:
+            if schema.get_field_index(field.name) < 0:
+                schema = schema.append(field)
+
+    def rows():
+        for part in parts:
+            for batch in pq.ParquetFile(part).iter_batches():
+                yield _align(pa.Table.from_batches([batch]), schema, fill_value)
+        for table in tables:
+            yield _align(table, schema, fill_value)
+
+    return write_parquet(rows(), out_file, row_group_size=row_group_size)
+
+
+def append_part(path, tables, fill_value=None, row_group_size=None):
+    """Function to append new rows to a parquet dataset as a new part file,
+    the rows written before are neither read nor rewritten. A single parquet
+    file is first moved into the dataset directory as its first part
+    :param path: Path of the dataset directory, or of a parquet file
+    :param tables: Iterable of pyarrow tables of the new rows, an empty part
+        with the schema of the dataset is written when they have no rows or
+        there are none
+    :param fill_value: Value of the columns of the dataset missing from the
+        new rows, null by default
+    :param row_group_size: Maximum number of rows per row group
+    :returns path of the new part
+    :raises ValueError: when the new rows have columns the dataset does not
+        have, which :func:`append_parquet` writes instead"""
+    tables = list(tables)
+    parts = dataset_parts(path)
+    schema = pq.read_schema(parts[-1]).remove_metadata()
+    new_columns = {
+        name
+        for table in tables
+        for name in table.column_names
+        if schema.get_field_index(name) < 0
+    }
+    if new_columns:
+        raise ValueError(
+            "Columns {} are not in the dataset {}".format(sorted(new_columns), path)
+        )
+    if not os.path.isdir(path):
+        moved = "{}-part-{}".format(path, os.getpid())
+        os.replace(path, moved)
+        os.makedirs(path)
+        os.replace(moved, os.path.join(path, PART_FORMAT.format(0)))
+        parts = dataset_parts(path)
+    number = int(_PART.match(os.path.basename(parts[-1])).group(1)) + 1
+    part = os.path.join(path, PART_FORMAT.format(number))
+    # Readers of the directory skip the hidden file until it is complete
+    tmp_part = os.path.join(path, "." + PART_FORMAT.format(number))
+    # No tables at all still write an empty part with the dataset schema
+    write_parquet(
+        [_align(table, schema, fill_value) for table in tables]
+        or [schema.empty_table()],
+        tmp_part,
+        row_group_size=row_group_size,
+    )
+    os.replace(tmp_part, part)
+    return part
+
+
+def csv_to_parquet(
+    source,
+    out_file,
+    chunksize=100000,
+    row_group_size=None,
+    engine="pandas",
+):
+    """Function to convert a csv file to parquet without loading it whole
+    :param source: Path of the csv file
+    :param out_file: Path or writable file object
+    :param chunksize: Number of rows read at a time, see :func:`iter_csv`
+    :param row_group_size: Maximum number of rows per row group
+    :param engine: "pandas" or "pyarrow" csv reader
+    :returns number of rows written"""
+    return write_parquet(
+        iter_csv(source, chunksize=chunksize, engine=engine),
+        out_file,
+        row_group_size=row_group_size,
+    )
@@ -0,0 +1,107 @@
+import os
+import functools
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from machine_learning_utils.functions.functions import iter_jobs
+from machine_learning_utils.functions.ingest import iter_parquet, write_parquet
+from machine_learning_utils.functions.sparse import frame_to_matrix
+from machine_learning_utils.functions.transforms import scoring_chain
+
+
+def save_model(path, model, transforms=(), features=None, class_column=None):
+    """Function to persist a fitted model with its fitted preprocessing chain
+    :param path: Path of the joblib file
+    :param model: Fitted estimator
+    :param transforms: Fitted chain of Transform, the training only steps
+        are not stored
+    :param features: Columns fed to the model, in order
+    :param class_column: Name of the predicted column"""
+    import joblib
+
+    bundle = {
+        "model": model,
+        "transforms": scoring_chain(transforms),
+        "features": list(features) if features is not None else None,
+        "class_column": class_column,
+    }
+    # Uncompressed so the arrays of the model can be memory mapped on load
+    joblib.dump(bundle, path, compress=0)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_model(path, mtime):
+    import joblib
+
+    return joblib.load(path, mmap_mode="r")
+
+
+def load_model(path):
+    """Function to load a model saved by :func:`save_model`, the arrays are
+    memory mapped read only and the model is loaded once per process
+    :param path: Path of the joblib file
+    :returns dictionary with the model, transforms, features and class_column"""
+    return _load_model(os.path.abspath(path), os.path.getmtime(path))
+
+
+def score_frame(bundle, df, keep_columns=()):
+    """Function to score raw rows with a model loaded by :func:`load_model`
+    :param bundle: Dictionary returned by :func:`load_model`
+    :param df: Pandas Dataframe of raw rows
+    :param keep_columns: Input columns copied to the scores, ex: an id
+    :returns dataframe with a prediction column and, when the model supports
+        it, a probability column per class"""
+    scores = df[list(keep_columns)].reset_index(drop=True)
+    for step in bundle["transforms"]:
+        df = step.transform(df)
+    if bundle["features"] is not None:
+        df = df.reindex(columns=bundle["features"], fill_value=0)
+    X = frame_to_matrix(df)
+
+    model = bundle["model"]
+    scores["prediction"] = model.predict(X)
+    if hasattr(model, "predict_proba"):
+        proba = model.predict_proba(X)
+        for i, label in enumerate(model.classes_):
+            scores["probability_{}".format(label)] = proba[:, i]
+    return scores
+
+
+def score_row_group(path, model_path, row_group, batch_size=65536, keep_columns=()):
+    """Function to score one row group of a parquet file in batches
+    :returns pyarrow table of the scores"""
+    bundle = load_model(model_path)
+    scores = [
+        score_frame(bundle, df, keep_columns)
+        for df in iter_parquet(path, batch_size, row_groups=[row_group])
+    ]
+    scores = pd.concat(scores, ignore_index=True)
+    return pa.Table.from_pandas(scores, preserve_index=False)
+
+
+def score_parquet(
+    path,
+    model_path,
+    out_file,
+    batch_size=65536,
+    keep_columns=(),
+    backend="serial",
+    n_jobs=None,
+):
+    """Function to score a parquet file with a model saved by :func:`save_model`
+    without loading the file whole, the row groups are scored in parallel and
+    written in order
+    :param path: Path of the parquet file of raw rows
+    :param model_path: Path of the joblib file
+    :param out_file: Path or writable file object of the parquet scores
+    :param batch_size: Maximum number of rows scored at a time
+    :param keep_columns: Input columns copied to the scores, ex: an id
+    :param backend: Row group execution backend, see :func:`functions.iter_jobs`
+    :param n_jobs: Maximum number of workers
+    :returns number of rows written"""
+    row_groups = pq.ParquetFile(path).num_row_groups
+    jobs = (
+        (score_row_group, (path, model_path, i, batch_size, tuple(keep_columns)))
+        for i in range(row_groups)
+    )
+    return write_parquet(iter_jobs(jobs, backend=backend, n_jobs=n_jobs), out_file)
@@ -0,0 +1,125 @@
+import sys
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+# Set once an attach started the resource tracker of this process, instead
+# of the process inheriting the tracker of the process creating the blocks
+_own_tracker = False
+
+
+def _open_block(name):
+    """Attach to an existing shared memory block without handing it to a
+    resource tracker which would unlink it when the process exits"""
+    global _own_tracker
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Before 3.13 attaching registers the block with the resource tracker.
+    # Workers forked or spawned by multiprocessing and loky share the tracker
+    # of their parent, where the registration belongs to the creating process
+    if getattr(resource_tracker._resource_tracker, "_fd", None) is None:
+        _own_tracker = True
+    shm = shared_memory.SharedMemory(name=name)
+    if _own_tracker:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedArray:
+    """Numpy array stored in shared memory that workers attach to by name
+
+    Only the name, shape and dtype are pickled, so handing a SharedArray to a
+    process pool never copies the data. Indexing returns the same result as
+    indexing the underlying array, ex: ``X[train_index]`` for a fold, which
+    copies the selected rows into the memory of the worker.
+    Example::
+        with SharedArray.from_array(X) as shared:
+            eval_classifier(clf, shared, y, backend="process")
+    """
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._shm = None
+        self._owner = False
+
+    @classmethod
+    def empty(cls, shape, dtype=np.float64):
+        """Allocate an uninitialized shared array
+        :param shape: Shape of the array
+        :param dtype: Numpy dtype of the array
+        :returns SharedArray owning the shared memory block"""
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        shared = cls(shm.name, shape, dtype)
+        shared._shm = shm
+        shared._owner = True
+        return shared
+
+    @classmethod
+    def from_array(cls, arr):
+        """Copy an array into shared memory
+        :param arr: Numpy array
+        :returns SharedArray owning the shared memory block"""
+        arr = np.asarray(arr)
+        shared = cls.empty(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+
+    @classmethod
+    def from_frame(cls, df, columns=None, dtype=None):
+        """Copy the columns of a dataframe into a 2d shared array one column
+        at a time, so no intermediate copy of the full matrix is made
+        :param df: Pandas Dataframe
+        :param columns: Columns to copy, defaults to all columns
+        :param dtype: Numpy dtype, defaults to the common dtype of the columns
+        :returns SharedArray owning the shared memory block"""
+        columns = list(df.columns if columns is None else columns)
+        if dtype is None:
+            dtype = np.result_type(*df.dtypes[columns]) if columns else np.float64
+        shared = cls.empty((len(df), len(columns)), dtype)
+        arr = shared.array
+        for i, col in enumerate(columns):
+            arr[:, i] = df[col].to_numpy()
+        return shared
+
+    def _attach(self):
+        if self._shm is None:
+            self._shm = _open_block(self.name)
+        return self._shm
+
+    @property
+    def array(self):
+        """Numpy view onto the shared memory block"""
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self._attach().buf)
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getstate__(self):
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype.str}
+
+    def __setstate__(self, state):
+        self.__init__(state["name"], state["shape"], state["dtype"])
+
+    def close(self):
+        """Detach from the shared memory block"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        """Free the shared memory block, only done by the creating process"""
+        if self._owner:
+            self._attach().unlink()
+            self._owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+        self.close()
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+
+def is_sparse_frame(df):
+    """Function to tell whether a dataframe holds any sparse column
+    :param df: Pandas Dataframe
+    :returns bool"""
+    return any(isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes)
+
+
+def frame_to_matrix(df):
+    """Function to turn a dataframe into an estimator input without
+    densifying sparse columns
+    :param df: Pandas Dataframe of numeric columns
+    :returns CSR matrix when any column is sparse, otherwise a numpy array"""
+    if not is_sparse_frame(df):
+        return df.to_numpy()
+    dtype = np.result_type(
+        *(getattr(dtype, "subtype", dtype) for dtype in df.dtypes)
+    )
+    return df.astype(pd.SparseDtype(dtype, 0)).sparse.to_coo().tocsr()
+
+
+def save_sparse_frame(df, file):
+    """Function to save a dataframe with sparse columns to a .npz file, the
+    sparse columns are stored as one CSR matrix and the others as arrays
+    :param df: Pandas Dataframe
+    :param file: Path or writable file object"""
+    from scipy import sparse
+
+    sparse_columns = [
+        col for col in df.columns if isinstance(df[col].dtype, pd.SparseDtype)
+    ]
+    dense_columns = [col for col in df.columns if col not in sparse_columns]
+    if sparse_columns:
+        matrix = frame_to_matrix(df[sparse_columns])
+    else:
+        matrix = sparse.csr_matrix((len(df), 0), dtype=np.uint8)
+
+    arrays = {
+        "data": matrix.data,
+        "indices": matrix.indices,
+        "indptr": matrix.indptr,
+        "shape": np.array(matrix.shape),
+        "columns": np.array(list(df.columns), dtype=str),
+        "sparse_columns": np.array(sparse_columns, dtype=str),
+    }
+    for i, col in enumerate(dense_columns):
+        values = df[col].to_numpy()
+        arrays["dense_{}".format(i)] = (
+            values.astype(str) if values.dtype == object else values
+        )
+    np.savez(file, **arrays)
+
+
+def load_sparse_frame(file):
+    """Function to load a dataframe saved by :func:`save_sparse_frame`
+    :param file: Path or readable file object
+    :returns pandas dataframe, the sparse columns keep a sparse dtype"""
+    from scipy import sparse
+
+    with np.load(file) as arrays:
+        matrix = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(arrays["shape"]),
+        )
+        columns = arrays["columns"].tolist()
+        sparse_columns = arrays["sparse_columns"].tolist()
+        dense_columns = [col for col in columns if col not in sparse_columns]
+
+        df = pd.DataFrame.sparse.from_spmatrix(matrix, columns=sparse_columns)
+        for i, col in enumerate(dense_columns):
+            df[col] = arrays["dense_{}".format(i)]
+    return df[columns]
@@ -0,0 +1,694 @@
+import os
+import json
+import tempfile
+import warnings
+import importlib
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+
+class Transform:
+    """Base class for a step of a preprocessing chain
+
+    A chain is applied to a dataframe in memory or to a stream of batches.
+    Steps with ``requires_fit`` learn global statistics from every batch
+    with :meth:`partial_fit` before any batch is transformed. Steps with
+    ``training_only`` clean the training rows and are skipped when scoring,
+    see :func:`scoring_chain`.
+    """
+
+    requires_fit = False
+    training_only = False
+
+    def start(self):
+        """Clear any state kept between the batches of one pass"""
+
+    def partial_fit(self, df):
+        """Update the fitted statistics with a batch of rows"""
+        return self
+
+    def finish_fit(self):
+        """Derive the fitted statistics once every batch has been seen"""
+        return self
+
+    def fit(self, df):
+        return self.partial_fit(df).finish_fit()
+
+    def transform(self, df):
+        raise NotImplementedError()
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    def to_dict(self):
+        """Returns the parameters and fitted state as a JSON serializable
+        dictionary, so a step fitted on training data can be reused when scoring"""
+        raise NotImplementedError()
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuild a fitted step from :meth:`to_dict`"""
+        raise NotImplementedError()
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def _function_path(func):
+    """Dotted path of a module level function, ex: "my_module:clean"
+    :raises ValueError: for a lambda or a nested function"""
+    name = getattr(func, "__qualname__", "")
+    if not name or "<" in name or "." in name:
+        raise ValueError(
+            "Only module level functions can be saved, got {!r}".format(func)
+        )
+    return "{}:{}".format(func.__module__, name)
+
+
+def _load_function(path):
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class Apply(Transform):
+    """Apply a row-wise function, ex: feature engineering, to every batch,
+    the function is saved by its dotted path"""
+
+    def __init__(self, func):
+        self.func = func
+
+    def transform(self, df):
+        return self.func(df)
+
+    def to_dict(self):
+        return {"func": _function_path(self.func)}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(_load_function(state["func"]))
+
+
+class DropColumns(Transform):
+    """Drop columns from every batch"""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+
+    def transform(self, df):
+        return df.drop(columns=self.columns)
+
+    def to_dict(self):
+        return {"columns": self.columns}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["columns"])
+
+
+class Replace(Transform):
+    """Replace values per column, ex: {"node-caps": {"?": "no"}}"""
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def transform(self, df):
+        return df.replace(self.mapping)
+
+    def to_dict(self):
+        return {"mapping": self.mapping}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["mapping"])
+
+
+class FilterRows(Transform):
+    """Keep the rows for which a function returns True, the function is
+    saved by its dotted path"""
+
+    training_only = True
+
+    def __init__(self, func):
+        self.func = func
+
+    def transform(self, df):
+        return df.loc[self.func(df)]
+
+    def to_dict(self):
+        return {"func": _function_path(self.func)}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(_load_function(state["func"]))
+
+
+def _isin_sorted(values, sorted_values):
+    """Membership of values in a sorted array, ex: a memory mapped run"""
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    index = np.searchsorted(sorted_values, values)
+    index[index == len(sorted_values)] = 0
+    return np.asarray(sorted_values[index]) == values
+
+
+class HashSet:
+    """Compact set of 64 bit hashes
+
+    Hashes are kept in sorted uint64 runs, 8 bytes per entry. Beyond
+    ``max_entries`` hashes in memory, ex: 1e6 for 8 MB, the in-memory runs
+    are merged and spilled to a memory mapped file in ``spill_dir`` (the
+    system temporary directory by default), so lookups keep working with
+    bounded memory.
+    """
+
+    max_runs = 8
+
+    def __init__(self, max_entries=None, spill_dir=None):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self._runs = []
+        self._spilled = []
+        self._tmp_dir = None
+
+    def __len__(self):
+        return sum(len(run) for run in self._runs + self._spilled)
+
+    def contains(self, hashes):
+        """Returns a boolean mask of the hashes already in the set"""
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self._runs + self._spilled:
+            found |= _isin_sorted(hashes, run)
+        return found
+
+    def add(self, hashes):
+        """Add hashes which are not in the set yet"""
+        if len(hashes) == 0:
+            return
+        self._runs.append(np.unique(hashes))
+        if len(self._runs) > self.max_runs:
+            self._runs = [np.unique(np.concatenate(self._runs))]
+        if self.max_entries is not None:
+            if sum(len(run) for run in self._runs) > self.max_entries:
+                self._spill()
+
+    def _spill(self):
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(dir=self.spill_dir)
+        path = os.path.join(self._tmp_dir.name, "run-{}.npy".format(len(self._spilled)))
+        np.save(path, np.unique(np.concatenate(self._runs)))
+        self._spilled.append(np.load(path, mmap_mode="r"))
+        self._runs = []
+
+    def __getstate__(self):
+        # The runs are pickled in memory, spilled again on the next add
+        runs = self._runs + self._spilled
+        return {
+            "max_entries": self.max_entries,
+            "spill_dir": self.spill_dir,
+            "runs": [np.unique(np.concatenate(runs))] if runs else [],
+        }
+
+    def __setstate__(self, state):
+        # Sets pickled before the limit was named max_entries
+        max_entries = state.get("max_entries", state.get("max_memory"))
+        self.__init__(max_entries=max_entries, spill_dir=state["spill_dir"])
+        self._runs = list(state["runs"])
+
+    def clear(self):
+        self._runs = []
+        self._spilled = []
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+
+class Deduplicate(Transform):
+    """Drop duplicated rows across every batch of a pass
+
+    Rows are compared by the 64 bit hash of the ``subset`` columns (every
+    column by default), so one hash pass is made per batch and only the
+    hashes of the rows already kept are remembered, see :class:`HashSet`.
+    :param subset: Columns identifying a row
+    :param max_entries: Number of hashes kept in memory before spilling to
+        disk, 8 bytes each
+    :param spill_dir: Directory of the spilled hashes
+    """
+
+    training_only = True
+
+    def __init__(self, subset=None, max_entries=None, spill_dir=None):
+        self.subset = subset
+        self.seen = HashSet(max_entries=max_entries, spill_dir=spill_dir)
+
+    def start(self):
+        self.seen.clear()
+
+    def to_dict(self):
+        # The hashes seen are the state of one pass, they are not saved
+        return {
+            "subset": self.subset,
+            "max_entries": self.seen.max_entries,
+            "spill_dir": self.seen.spill_dir,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        state = dict(state)
+        # Chains saved before the limit was named max_entries
+        if "max_memory" in state:
+            state["max_entries"] = state.pop("max_memory")
+        return cls(**state)
+
+    def transform(self, df):
+        rows = df if self.subset is None else df[self.subset]
+        hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+        keep = ~pd.Series(hashes).duplicated().to_numpy()
+        keep &= ~self.seen.contains(hashes)
+        self.seen.add(hashes[keep])
+        return df.loc[keep]
+
+
+def _median_from_counts(values, counts):
+    """Median of sorted distinct values with their counts"""
+    position = np.cumsum(counts)
+    n = position[-1]
+    lower = values[np.searchsorted(position, (n - 1) // 2, side="right")]
+    upper = values[np.searchsorted(position, n // 2, side="right")]
+    return (lower + upper) / 2
+
+
+class QuantileSketch:
+    """Bounded summary of the distribution of a numeric column
+
+    The distinct values are counted exactly while there are at most
+    ``max_size`` of them, ex: integer codes. Beyond that, adjacent values are
+    merged into at most ``max_size`` centroids of about equal counts, and the
+    quantiles are interpolated between the centroids, within about 1 /
+    ``max_size`` of the rank. Memory and the cost of a batch do not grow with
+    the number of rows seen.
+    :param max_size: Maximum number of values or centroids kept
+    """
+
+    def __init__(self, max_size=2048):
+        self.max_size = max_size
+        self.values = np.empty(0)
+        self.counts = np.empty(0)
+        self.exact = True
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def from_median(cls, median, count, max_size=2048):
+        """Sketch of ``count`` values summarized by their median, ex: of a
+        column fitted in one call, which later batches update approximately"""
+        sketch = cls(max_size)
+        sketch.values = np.array([median], dtype=np.float64)
+        sketch.counts = np.array([count], dtype=np.float64)
+        sketch.exact = False
+        return sketch
+
+    def update(self, values):
+        """Add a batch of values, missing values are ignored"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        new_values, new_counts = np.unique(values, return_counts=True)
+        values, inverse = np.unique(
+            np.concatenate([self.values, new_values]), return_inverse=True
+        )
+        counts = np.bincount(
+            inverse, weights=np.concatenate([self.counts, new_counts])
+        )
+        if len(values) > self.max_size:
+            self.exact = False
+            # Centroids of about total / max_size rows each, at their mean
+            start = np.cumsum(counts) - counts
+            bucket = (start * self.max_size // counts.sum()).astype(np.int64)
+            weights = np.bincount(bucket, weights=counts)
+            sums = np.bincount(bucket, weights=counts * values)
+            kept = weights > 0
+            values, counts = sums[kept] / weights[kept], weights[kept]
+        self.values, self.counts = values, counts
+        return self
+
+    def median(self):
+        """Median of the values added, None when there are none"""
+        if len(self.values) == 0:
+            return None
+        if self.exact:
+            return _median_from_counts(self.values, self.counts)
+        # Rank of the middle of each centroid
+        center = np.cumsum(self.counts) - self.counts / 2
+        return float(np.interp(self.counts.sum() / 2, center, self.values))
+
+
+def _mode_from_counts(counts):
+    """Most frequent value of a value -> count series, ties are broken by
+    the smallest value so every batching gives the same result"""
+    try:
+        counts = counts.sort_index()
+    except TypeError:
+        pass
+    return counts.idxmax()
+
+
+def _truncate_counts(counts, max_size):
+    """Keep the ``max_size`` largest counts of a value -> count series, less
+    the largest count dropped, as in the Misra-Gries summary: a value more
+    frequent than 1 / (max_size + 1) of the rows is never dropped, and the
+    counts kept are lower bounds"""
+    if len(counts) <= max_size:
+        return counts
+    try:
+        # Ties are kept by the smallest value, as in _mode_from_counts
+        counts = counts.sort_index()
+    except TypeError:
+        pass
+    largest = counts.nlargest(max_size + 1)
+    return largest.iloc[:max_size] - largest.iloc[-1]
+
+
+def _to_python(value):
+    """Convert numpy scalars to python objects for JSON"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class Imputer(Transform):
+    """Fill missing values with the median of numeric columns and the most
+    frequent value of the other columns
+
+    :meth:`partial_fit` updates a bounded :class:`QuantileSketch` per numeric
+    column and the ``max_size`` largest value counts of the other columns
+    over a stream of batches, the medians and modes of columns with more
+    than ``max_size`` distinct values are then approximate. :meth:`fit`
+    computes the exact medians and modes in one call, and starts the
+    sketches over from them, so batches following a fit update them
+    approximately. A column without values is not filled.
+    :param columns: Columns to fill, defaults to every column
+    :param max_size: Size of the quantile sketches and of the value counts
+    """
+
+    requires_fit = True
+
+    def __init__(self, columns=None, max_size=2048):
+        self.columns = columns
+        self.max_size = max_size
+        self.sketches_ = {}
+        self.counts_ = {}
+        self.statistics_ = {}
+
+    def fit(self, df):
+        columns = df.columns if self.columns is None else self.columns
+        numeric = [col for col in columns if is_numeric_dtype(df[col])]
+        self.sketches_ = {}
+        self.counts_ = {}
+        if numeric:
+            # Every median and count in one call on a single float block
+            values = df[numeric].to_numpy(dtype=np.float64, na_value=np.nan)
+            counts = np.count_nonzero(~np.isnan(values), axis=0)
+            with warnings.catch_warnings():
+                # A column without values has a NaN median, it is not filled
+                warnings.simplefilter("ignore", RuntimeWarning)
+                medians = np.nanmedian(values, axis=0)
+            for col, median, count in zip(numeric, medians, counts):
+                if count:
+                    self.sketches_[col] = QuantileSketch.from_median(
+                        median, count, self.max_size
+                    )
+        for col in columns:
+            if col not in self.sketches_ and not is_numeric_dtype(df[col]):
+                self._count(col, df[col])
+        return self.finish_fit()
+
+    def partial_fit(self, df):
+        columns = df.columns if self.columns is None else self.columns
+        for col in columns:
+            if is_numeric_dtype(df[col]) and col not in self.counts_:
+                if col not in self.sketches_:
+                    self.sketches_[col] = QuantileSketch(self.max_size)
+                values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+                self.sketches_[col].update(values)
+            else:
+                self._count(col, df[col])
+        return self
+
+    def _count(self, col, series):
+        # The unused categories of a category column are not counted
+        counts = series.value_counts()
+        counts = counts[counts > 0]
+        if col in self.counts_:
+            counts = self.counts_[col].add(counts, fill_value=0)
+        self.counts_[col] = _truncate_counts(counts, self.max_size)
+
+    def finish_fit(self):
+        self.statistics_ = {}
+        for col, sketch in self.sketches_.items():
+            median = sketch.median()
+            if median is not None:
+                self.statistics_[col] = _to_python(median)
+        for col, counts in self.counts_.items():
+            if not counts.empty:
+                self.statistics_[col] = _to_python(_mode_from_counts(counts))
+        return self
+
+    def transform(self, df):
+        # A category column is filled with a value of its categories only
+        missing = {
+            col: df[col].cat.add_categories([value])
+            for col, value in self.statistics_.items()
+            if col in df
+            and isinstance(df[col].dtype, pd.CategoricalDtype)
+            and value not in df[col].cat.categories
+        }
+        if missing:
+            df = df.assign(**missing)
+        # A single vectorized fill of every column
+        return df.fillna(self.statistics_)
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "max_size": self.max_size,
+            "statistics": self.statistics_,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        imputer = cls(columns=state["columns"], max_size=state.get("max_size", 2048))
+        imputer.statistics_ = dict(state["statistics"])
+        return imputer
+
+
+def _sorted_categories(values):
+    try:
+        return sorted(values)
+    except TypeError:
+        return sorted(values, key=str)
+
+
+class OneHotEncoder(Transform):
+    """One hot encode categorical columns with a vocabulary learned over
+    every batch, so each batch and the scoring data get the same encoded columns
+
+    Every encoded column is written in a single pass into one preallocated
+    uint8 block, or a scipy.sparse CSR matrix when ``sparse`` is set.
+    :param columns: Columns to encode, defaults to the non numeric columns
+    :param exclude: Columns never encoded, ex: the class column
+    :param sep: Separator between the column name and the category
+    :param sparse: Encode into sparse columns
+    """
+
+    requires_fit = True
+
+    def __init__(self, columns=None, exclude=(), sep=" - ", sparse=False):
+        self.columns = columns
+        self.exclude = list(exclude)
+        self.sep = sep
+        self.sparse = sparse
+        self.categories_ = {}
+        self._lookups = {}
+
+    def partial_fit(self, df):
+        columns = self.columns
+        if columns is None:
+            columns = [
+                col
+                for col in df.columns
+                if not is_numeric_dtype(df[col]) and col not in self.exclude
+            ]
+        for col in columns:
+            # A fitted vocabulary grows with the categories of new rows
+            seen = set(self.categories_.get(col, ()))
+            seen.update(df[col].dropna().unique())
+            self.categories_[col] = seen
+        return self
+
+    def finish_fit(self):
+        self.categories_ = {
+            col: pd.Index(_sorted_categories(values)).tolist()
+            for col, values in self.categories_.items()
+        }
+        self._lookups = {
+            col: pd.Index(categories) for col, categories in self.categories_.items()
+        }
+        return self
+
+    @property
+    def feature_names_(self):
+        return [
+            "{}{}{}".format(col, self.sep, category)
+            for col, categories in self.categories_.items()
+            for category in categories
+        ]
+
+    def transform_matrix(self, df):
+        """Encode the categorical columns of a dataframe
+        :param df: Pandas Dataframe
+        :returns uint8 numpy array, or CSR matrix when sparse, with one column
+            per entry of feature_names_, unknown categories are all zeros"""
+        width = sum(len(lookup) for lookup in self._lookups.values())
+        rows, cols = [], []
+        offset = 0
+        for col, lookup in self._lookups.items():
+            codes = lookup.get_indexer(df[col])
+            known = np.flatnonzero(codes >= 0)
+            rows.append(known)
+            cols.append(codes[known] + offset)
+            offset += len(lookup)
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.intp)
+
+        if self.sparse:
+            from scipy import sparse
+
+            data = np.ones(len(rows), dtype=np.uint8)
+            return sparse.csr_matrix((data, (rows, cols)), shape=(len(df), width))
+        block = np.zeros((len(df), width), dtype=np.uint8)
+        block[rows, cols] = 1
+        return block
+
+    def transform(self, df):
+        block = self.transform_matrix(df)
+        if self.sparse:
+            encoded = pd.DataFrame.sparse.from_spmatrix(
+                block, index=df.index, columns=self.feature_names_
+            )
+        else:
+            encoded = pd.DataFrame(block, index=df.index, columns=self.feature_names_)
+        return pd.concat([df.drop(columns=list(self.categories_)), encoded], axis=1)
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "exclude": self.exclude,
+            "sep": self.sep,
+            "sparse": self.sparse,
+            "categories": self.categories_,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        encoder = cls(
+            columns=state["columns"],
+            exclude=state["exclude"],
+            sep=state["sep"],
+            sparse=state["sparse"],
+        )
+        encoder.categories_ = state["categories"]
+        return encoder.finish_fit()
+
+
+def save_chain(transforms, path):
+    """Function to save the steps of a chain to a JSON file, each with its
+    class path and :meth:`Transform.to_dict`
+    :param transforms: List of fitted :class:`Transform`
+    :param path: Path of the JSON file"""
+    steps = [
+        {
+            "class": "{}:{}".format(type(step).__module__, type(step).__qualname__),
+            "state": step.to_dict(),
+        }
+        for step in transforms
+    ]
+    with open(path, "w") as f:
+        json.dump(steps, f)
+
+
+def load_chain(path):
+    """Function to load a chain saved by :func:`save_chain`
+    :param path: Path of the JSON file
+    :returns list of fitted :class:`Transform`"""
+    with open(path) as f:
+        steps = json.load(f)
+    return [_load_function(step["class"]).from_dict(step["state"]) for step in steps]
+
+
+def fit_chain(transforms, batches):
+    """Function to fit the steps of a chain over a stream of batches, every
+    step that requires fitting takes one pass through the steps before it
+    :param transforms: List of :class:`Transform`
+    :param batches: Callable returning a fresh iterator of dataframes
+    :returns the fitted transforms"""
+    for i, step in enumerate(transforms):
+        if step.requires_fit:
+            for batch in apply_chain(transforms[:i], batches()):
+                step.partial_fit(batch)
+            step.finish_fit()
+    return transforms
+
+
+def apply_chain(transforms, batches):
+    """Function to lazily apply fitted transforms to a stream of batches
+    :param transforms: List of fitted :class:`Transform`
+    :param batches: Iterable of dataframes
+    :returns iterator of transformed dataframes"""
+    for step in transforms:
+        step.start()
+    for batch in batches:
+        for step in transforms:
+            batch = step.transform(batch)
+        yield batch
+
+
+def scoring_chain(transforms):
+    """Function to select the steps of a fitted chain applied to new rows
+    :param transforms: List of Transform
+    :returns list of Transform without the training only steps"""
+    return [step for step in transforms if not step.training_only]
+
+
+def update_chain(transforms, df):
+    """Function to fit a chain incrementally: the fitted statistics of the
+    steps are updated with new rows, which are then transformed. Unlike
+    :func:`fit_transform_chain`, the state of the steps is kept from the
+    previous calls, ex: a Deduplicate step drops the new rows repeating rows
+    seen before, so the rows appended to a dataset are processed alone
+    :param transforms: List of :class:`Transform`, fitted by earlier calls
+        or new
+    :param df: Pandas Dataframe of the new rows
+    :returns transformed pandas dataframe"""
+    for step in transforms:
+        if step.requires_fit:
+            step.partial_fit(df).finish_fit()
+        df = step.transform(df)
+    return df
+
+
+def fit_transform_chain(transforms, df):
+    """Function to fit and apply a chain to a dataframe held in memory
+    :param transforms: List of :class:`Transform`
+    :param df: Pandas Dataframe
+    :returns transformed pandas dataframe"""
+    for step in transforms:
+        step.start()
+        df = step.fit_transform(df) if step.requires_fit else step.transform(df)
+    return df
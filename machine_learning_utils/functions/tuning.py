@@ -0,0 +1,182 @@
+import os
+import json
+import pandas as pd
+from machine_learning_utils.functions.functions import iter_jobs, load_estimator
+
+
+def expand_search(search):
+    """Function to expand search spaces into model registry entries
+    :param search: List of registry entries with a "space" of parameter name
+        to candidate values, Ex: {"name": "svc", "estimator": "sklearn.svm.SVC",
+        "params": {"kernel": "rbf"}, "space": {"C": [1, 2, 4]}}
+    :returns list of registry entries, one per point of each grid"""
+    from sklearn.model_selection import ParameterGrid
+
+    candidates = []
+    for spec in search:
+        name = spec.get("name", spec["estimator"].rpartition(".")[2])
+        space = {key: list(values) for key, values in spec.get("space", {}).items()}
+        for point in ParameterGrid(space):
+            params = dict(spec.get("params", {}))
+            params.update(point)
+            candidates.append(
+                {"name": name, "estimator": spec["estimator"], "params": params}
+            )
+    return candidates
+
+
+def _trial_key(candidate):
+    return json.dumps(
+        [candidate["name"], candidate["estimator"], candidate["params"]],
+        sort_keys=True,
+    )
+
+
+def read_trials(path):
+    """Function to read a trial log written by :func:`successive_halving`
+    :param path: Path of the JSON lines file, may not exist yet
+    :returns dictionary of candidate key to {fold: score}"""
+    trials = {}
+    if path is None or not os.path.exists(path):
+        return trials
+    with open(path) as f:
+        for line in f:
+            try:
+                trial = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted search may be truncated
+                continue
+            trials.setdefault(trial["key"], {})[trial["fold"]] = trial["score"]
+    return trials
+
+
+def _score_fold(spec, X, y, train_index, test_index, scoring):
+    """Fit a candidate on one fold
+    :returns score of the fold"""
+    from sklearn.base import clone
+    from sklearn.metrics import get_scorer
+
+    clf = clone(load_estimator(spec))
+    clf.fit(X[train_index], y[train_index])
+    return get_scorer(scoring)(clf, X[test_index], y[test_index])
+
+
+def successive_halving(
+    candidates,
+    X,
+    y,
+    n_splits=9,
+    eta=3,
+    min_folds=1,
+    scoring="accuracy",
+    backend="serial",
+    n_jobs=None,
+    trial_log=None,
+):
+    """Function to search the best candidate of each model with successive
+    halving over the folds
+
+    Every candidate is first scored on ``min_folds`` folds, then only the
+    best ``1 / eta`` of the candidates of each model are scored on ``eta``
+    times more folds, until one candidate is left or every fold is used.
+    Each (candidate, fold) fit is a trial; the trials are appended to
+    ``trial_log`` as they finish, and the ones already logged are not run
+    again, so an interrupted search resumes where it stopped.
+    :param candidates: List of registry entries, see :func:`expand_search`
+    :param X: Features values
+    :param y: label values
+    :param n_splits: Number of stratified folds
+    :param eta: Factor by which the candidates are cut and the folds grown,
+        at least 2
+    :param min_folds: Number of folds of the first round
+    :param scoring: Scikit-learn scorer name, higher is better
+    :param backend: Trial execution backend, see :func:`functions.run_jobs`
+    :param n_jobs: Maximum number of trials run concurrently
+    :param trial_log: Optional path of a JSON lines trial log
+    :returns pandas dataframe with one row per candidate: its index in
+        ``candidates``, model, params, number of folds scored and mean score,
+        best candidates first"""
+    if eta < 2:
+        # A factor of 1 would neither cut the candidates nor grow the folds
+        raise ValueError("eta must be at least 2, got {}".format(eta))
+    from sklearn.model_selection import StratifiedKFold
+
+    folds = list(StratifiedKFold(n_splits=n_splits).split(X, y))
+    keys = [_trial_key(candidate) for candidate in candidates]
+    trials = read_trials(trial_log)
+    scores = [trials.get(key, {}) for key in keys]
+
+    survivors = {}
+    for i, candidate in enumerate(candidates):
+        survivors.setdefault(candidate["name"], []).append(i)
+
+    reached = [0] * len(candidates)
+    budget = min(max(min_folds, 1), n_splits)
+    while True:
+        for group in survivors.values():
+            for i in group:
+                reached[i] = budget
+        pending = [
+            (i, fold)
+            for group in survivors.values()
+            for i in group
+            for fold in range(budget)
+            if fold not in scores[i]
+        ]
+        jobs = (
+            (_score_fold, (candidates[i], X, y) + folds[fold] + (scoring,))
+            for i, fold in pending
+        )
+        log = open(trial_log, "a") if trial_log is not None else None
+        try:
+            for (i, fold), score in zip(
+                pending, iter_jobs(jobs, backend=backend, n_jobs=n_jobs)
+            ):
+                scores[i][fold] = score
+                if log is not None:
+                    log.write(
+                        json.dumps({"key": keys[i], "fold": fold, "score": score})
+                        + "\n"
+                    )
+                    log.flush()
+        finally:
+            if log is not None:
+                log.close()
+
+        if budget == n_splits or all(len(g) == 1 for g in survivors.values()):
+            break
+        # Drop the worst configurations before spending more folds on them
+        for name, group in survivors.items():
+            group.sort(
+                key=lambda i: -sum(scores[i][f] for f in range(budget)) / budget
+            )
+            survivors[name] = group[: max(len(group) // eta, 1)]
+        budget = min(budget * eta, n_splits)
+
+    results = pd.DataFrame(
+        {
+            "candidate": range(len(candidates)),
+            "model": [candidate["name"] for candidate in candidates],
+            "params": [candidate["params"] for candidate in candidates],
+            "folds": reached,
+            "score": [
+                sum(score[f] for f in range(n)) / n
+                for score, n in zip(scores, reached)
+            ],
+        }
+    )
+    return results.sort_values(
+        ["folds", "score"], ascending=False, kind="stable"
+    ).reset_index(drop=True)
+
+
+def best_candidates(candidates, results):
+    """Function to pick the best candidate of each model of a search
+    :param candidates: List of registry entries searched
+    :param results: Dataframe returned by :func:`successive_halving`
+    :returns list of registry entries with their "score", in model order"""
+    best = []
+    for name in dict.fromkeys(candidate["name"] for candidate in candidates):
+        row = results.loc[results["model"] == name].iloc[0]
+        best.append(dict(candidates[row["candidate"]], score=float(row["score"])))
+    return best
@@ -1,64 +1,888 @@
+import io
 import os
+import json
+import hashlib
+import itertools
+import logging
+from glob import glob
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from luigi.format import Nop
-from luigi import Task, Parameter, LocalTarget
-from sklearn.svm import SVC
-from sklearn.ensemble import RandomForestClassifier
-from machine_learning_utils.luigi.task import Requires, Requirement, TargetOutput
-from machine_learning_utils.luigi.target import BaseAtomicProviderLocalTarget
-from machine_learning_utils.functions.functions import eval_classifier
+from luigi.task import flatten
+from luigi.freezing import recursively_unfreeze
+from luigi import (
+    Task,
+    Parameter,
+    BoolParameter,
+    IntParameter,
+    FloatParameter,
+    ChoiceParameter,
+    ListParameter,
+    LocalTarget,
+)
+from machine_learning_utils.luigi.task import (
+    CachedTargetOutput,
+    Requires,
+    Requirement,
+    task_digest,
+)
+# Registers the task event handlers recording the metrics of every task
+from machine_learning_utils.luigi import instrument  # noqa: F401
+from machine_learning_utils.luigi.incremental import IncrementalTask
+from machine_learning_utils.luigi.profiling import ProfiledTask
+from machine_learning_utils.luigi.target import (
+    ParquetTarget,
+    SuffixPreservingLocalTarget,
+    frame_cache,
+    iter_frames,
+    read_frame,
+)
+from machine_learning_utils.functions.functions import (
+    BACKENDS,
+    eval_classifiers,
+    load_models,
+)
+from machine_learning_utils.functions.ingest import (
+    CSV_ENGINES,
+    SchemaOptimizer,
+    dataset_parts,
+    discover_partitions,
+    iter_csv,
+    iter_partition,
+    write_parquet,
+)
+from machine_learning_utils.functions.scoring import save_model, score_parquet
+from machine_learning_utils.functions.shared import SharedArray
+from machine_learning_utils.functions.tuning import (
+    best_candidates,
+    expand_search,
+    successive_halving,
+)
+from machine_learning_utils.functions.sparse import (
+    frame_to_matrix,
+    is_sparse_frame,
+    load_sparse_frame,
+    save_sparse_frame,
+)
+from machine_learning_utils.functions.transforms import (
+    apply_chain,
+    fit_chain,
+    fit_transform_chain,
+    update_chain,
+    scoring_chain,
+)
 
+# Model registry of BuildModel, estimators are given by their dotted path
+DEFAULT_MODELS = [
+    {
+        "name": "svc",
+        "estimator": "sklearn.svm.SVC",
+        "params": {"kernel": "rbf", "gamma": 0.05, "C": 2},
+    },
+    {
+        "name": "rf",
+        "estimator": "sklearn.ensemble.RandomForestClassifier",
+        "params": {"n_estimators": 100, "n_jobs": 4},
+    },
+]
 
+logger = logging.getLogger("luigi-interface")
 
-class DownloadData(Task):
-    """A Luigi task to download data locally"""
+# Search spaces of TuneModel, registry entries with candidate values per parameter
+DEFAULT_SEARCH = [
+    {
+        "name": "svc",
+        "estimator": "sklearn.svm.SVC",
+        "params": {"kernel": "rbf"},
+        "space": {"C": [0.5, 1, 2, 4, 8], "gamma": [0.01, 0.05, 0.1, "scale"]},
+    },
+    {
+        "name": "rf",
+        "estimator": "sklearn.ensemble.RandomForestClassifier",
+        "params": {"n_jobs": 1},
+        "space": {"n_estimators": [50, 100, 200], "max_depth": [None, 5, 10]},
+    },
+]
 
-    DATA = Parameter()  # Add in where the data should be downloaded
+
+def _source_stat(path):
+    """Size and modification time of a source file, None when it is missing"""
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _tail_digest(path, offset, size=65536):
+    """Digest of the bytes before an offset of a file, an appended file keeps
+    the digest of the rows read up to the offset"""
+    start = max(offset - size, 0)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+def _read_csv_range(path, offset, size, columns):
+    """Read the rows of a csv file between two byte offsets
+    :param columns: Names of the columns, read from the header at offset 0
+    :returns pandas dataframe"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(size - offset)
+    if offset == 0:
+        return pd.read_csv(io.BytesIO(data))
+    if not data.strip():
+        return pd.DataFrame(columns=columns)
+    return pd.read_csv(io.BytesIO(data), header=None, names=columns)
+
+
+def read_features(target):
+    """Function to read the output of a DataPreprocess task, a parquet file or
+    a .npz file of sparse features
+    :param target: Luigi target
+    :returns pandas dataframe"""
+    if target.path.endswith(".npz"):
+        return load_sparse_frame(target.path)
+    return read_frame(target)
+
+
+def feature_matrix(df, features, backend="serial"):
+    """Function to build the estimator input of a set of feature columns
+    :param df: Pandas Dataframe
+    :param features: Feature columns
+    :param backend: Execution backend of the fits, see functions.run_jobs
+    :returns CSR matrix for sparse features, a SharedArray for the process
+        and loky backends, which the caller unlinks, otherwise a numpy array"""
+    if is_sparse_frame(df):
+        # Estimators accepting sparse input are fed the CSR matrix as is
+        return frame_to_matrix(df[features])
+    if backend in ("process", "loky"):
+        # Workers attach to the feature matrix by name instead of
+        # receiving a pickled copy of it
+        return SharedArray.from_frame(df, columns=features)
+    return df[features].to_numpy()
+
+
+def preprocessing_chain(task):
+    """Function to collect the fitted transforms saved by the DataPreprocess
+    tasks upstream of a task, in the order they were applied
+    :param task: Luigi task
+    :returns list of functions.transforms.Transform"""
+    chain = []
+    for requirement in flatten(task.requires()):
+        chain.extend(preprocessing_chain(requirement))
+    if isinstance(task, DataPreprocess):
+        chain.extend(task.load_transforms())
+    return chain
+
+
+class DownloadData(IncrementalTask, ProfiledTask, Task):
+    """A Luigi task to download data locally
+
+    With ``optimize_dtypes``, the columns are narrowed at ingest, see
+    functions.ingest.SchemaOptimizer, and the inferred types are saved
+    next to the output, to be reused by the next downloads of the data.
+
+    With ``incremental``, the size and a digest of every source file are
+    recorded in the manifest, and the next run reads only the new files and
+    the rows appended to the files since, which are written as a new part
+    of the output, see IncrementalTask.append_part. A source file rewritten
+    or removed makes the run read every file again.
+    """
+
+    # Add in where the data should be downloaded, a csv file or a glob
+    # pattern of csv files, ex: ~/datasets/daily/*.csv
+    DATA = Parameter()
     LOCAL_ROOT = Parameter(default=os.path.abspath("data"))
     SHARED_RELATIVE_PATH = Parameter(default="data.parquet")
+    # Streaming ingestion, a chunksize of 0 reads the whole csv at once
+    chunksize = IntParameter(default=0, significant=False)
+    row_group_size = IntParameter(default=0, significant=False)
+    csv_engine = ChoiceParameter(
+        choices=CSV_ENGINES, default="pandas", significant=False
+    )
+    optimize_dtypes = BoolParameter(default=False)
+    category_ratio = FloatParameter(default=0.5, significant=False)
+    # Modules of the functions run() calls, part of the code version of the
+    # task, see luigi.task.task_digest
+    code_modules = ("machine_learning_utils.functions.ingest",)
 
     def output(self):
-        return BaseAtomicProviderLocalTarget(
+        return ParquetTarget(
             path=os.path.join(self.LOCAL_ROOT, self.SHARED_RELATIVE_PATH), format=Nop
         )
 
+    def schema(self):
+        """Target of the column types inferred by optimize_dtypes"""
+        path = os.path.splitext(self.output().path)[0] + "-schema.json"
+        return SuffixPreservingLocalTarget(path)
+
+    def schema_optimizer(self):
+        """Returns the optimizer of the column types restored from the
+        previous download, or an unfitted one"""
+        schema = self.schema()
+        if schema.exists():
+            return SchemaOptimizer.load(schema.path)
+        return SchemaOptimizer(category_ratio=self.category_ratio)
+
+    def save_schema(self, optimizer):
+        with self.schema().temporary_path() as tmp_path:
+            optimizer.save(tmp_path)
+        logger.info("%s column types\n%s", self, optimizer.report())
+
+    def source_files(self):
+        """Paths of the source csv files"""
+        path = os.path.expanduser(self.DATA)
+        if any(char in path for char in "*?["):
+            return sorted(glob(path))
+        return [path]
+
+    def cache_key(self):
+        """Path, size and modification time of every source file, keys the
+        content-addressed outputs of the downstream tasks"""
+        if self.incremental:
+            # The manifests track the new rows, the downstream outputs keep
+            # their path to be appended to
+            return "incremental"
+        return [(path, _source_stat(path)) for path in self.source_files()]
+
+    def pending_files(self, manifest):
+        """Returns the byte offset from which each source file has rows which
+        are not ingested yet, None when the files ingested by the run of the
+        manifest were rewritten or removed since"""
+        files = manifest.get("files", {})
+        sources = self.source_files()
+        if set(files) - set(sources):
+            return None
+        offsets = {}
+        for path in sources:
+            entry = files.get(path)
+            stat = os.stat(path)
+            if entry is None:
+                offsets[path] = 0
+            elif (stat.st_size, stat.st_mtime_ns) == (entry["size"], entry["mtime_ns"]):
+                continue
+            elif stat.st_size >= entry["size"] and entry["digest"] == _tail_digest(
+                path, entry["size"]
+            ):
+                offsets[path] = entry["size"]
+            else:
+                return None
+        return offsets
+
+    def complete(self):
+        if self.incremental:
+            manifest = self.read_manifest()
+            return (
+                "version" in manifest
+                and self.output().exists()
+                and self.pending_files(manifest) == {}
+            )
+        # A source file modified after the download is downloaded again
+        path = self.output().path
+        if os.path.exists(path):
+            mtime = os.path.getmtime(path)
+            for source in self.source_files():
+                if os.path.exists(source) and os.path.getmtime(source) > mtime:
+                    return False
+        return super().complete()
+
+    def write(self, optimizer=None):
+        """Convert the source file to parquet, with its columns cast by a
+        SchemaOptimizer, which is fitted first when it is not yet"""
+        row_group_size = self.row_group_size or None
+        if self.chunksize or self.csv_engine != "pandas":
+
+            def read_chunks():
+                return itertools.chain.from_iterable(
+                    iter_csv(
+                        path,
+                        chunksize=self.chunksize or 100000,
+                        engine=self.csv_engine,
+                    )
+                    for path in self.source_files()
+                )
+
+            tables = read_chunks()
+            if optimizer is not None:
+                if optimizer.columns_ is None:
+                    # A first pass fits the types to the values of every chunk
+                    for table in tables:
+                        optimizer.partial_fit(table)
+                    optimizer.finish_fit()
+                    tables = read_chunks()
+                tables = map(optimizer.transform, tables)
+            # A path, so the rows written can be widened to a later chunk
+            with self.output().temporary_path() as tmp_path:
+                write_parquet(tables, tmp_path, row_group_size=row_group_size)
+        else:
+            df = pd.concat(
+                [pd.read_csv(path) for path in self.source_files()], ignore_index=True
+            )
+            if optimizer is not None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if optimizer.columns_ is None:
+                    optimizer.fit(table)
+                df = optimizer.transform(table).to_pandas()
+            self.output().write_frame(df, row_group_size=row_group_size)
+
+    def run(self):
+        if self.incremental:
+            self.ingest()
+        else:
+            self.clear_manifest()
+            self.download()
+
+    def download(self):
+        """Convert every row of the source files"""
+        if not self.optimize_dtypes:
+            self.write()
+            return
+        optimizer = self.schema_optimizer()
+        try:
+            self.write(optimizer)
+        except ValueError as e:
+            if optimizer.columns_ is None:
+                raise
+            # The source no longer fits the types saved by the last download
+            logger.warning("%s fitting the column types again: %s", self, e)
+            optimizer = SchemaOptimizer(category_ratio=self.category_ratio)
+            self.write(optimizer)
+        self.save_schema(optimizer)
+
+    def ingest(self):
+        """Append the rows added to the source files since the last run to
+        the output as a new part, the delta of the run"""
+        manifest = self.read_manifest()
+        sizes = {path: os.stat(path).st_size for path in self.source_files()}
+        offsets = None
+        if "version" in manifest and self.output().exists() and self.prune_parts():
+            offsets = self.pending_files(manifest)
+        if offsets is not None:
+            try:
+                self.append(manifest, offsets, sizes)
+            except ValueError as e:
+                logger.warning("%s ingesting every row again: %s", self, e)
+                offsets = None
+        if offsets is None:
+            self.remove_parts()
+            self.download()
+
+        files = {}
+        for path, size in sizes.items():
+            entry = manifest.get("files", {}).get(path, {})
+            files[path] = {
+                "size": size,
+                "mtime_ns": os.stat(path).st_mtime_ns,
+                "digest": _tail_digest(path, size),
+                "columns": entry.get("columns")
+                or list(pd.read_csv(path, nrows=0).columns),
+            }
+        self.record_run(full=offsets is None, files=files)
+
+    def append(self, manifest, offsets, sizes):
+        """Append the rows of the source files between their offsets and sizes
+        to the output, raises ValueError when they do not fit its columns"""
+        files = manifest["files"]
+        delta = pd.concat(
+            [
+                _read_csv_range(
+                    path, offset, sizes[path], files.get(path, {}).get("columns")
+                )
+                for path, offset in offsets.items()
+            ],
+            ignore_index=True,
+        )
+        table = pa.Table.from_pandas(delta, preserve_index=False)
+        if self.optimize_dtypes:
+            optimizer = self.schema_optimizer()
+            if optimizer.columns_ is None:
+                raise ValueError("The column types of the output were not saved")
+            table = optimizer.transform(table)
+
+        target = self.output()
+        # The output may still be written in the background, see handoff
+        frame_cache.flush()
+        schema = pq.read_schema(dataset_parts(target.path)[-1]).remove_metadata()
+        if table.column_names != schema.names:
+            raise ValueError(
+                "Columns {} do not match the columns {} of the output".format(
+                    table.column_names, schema.names
+                )
+            )
+        try:
+            table = table.cast(schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(
+                "New rows do not fit the types of the output: {}".format(e)
+            )
+        self.append_part(table, row_group_size=self.row_group_size or None)
+
+
+class DownloadPartition(ProfiledTask, Task):
+    """A Luigi task to extract one partition of a Hive partitioned parquet
+    dataset, ex: DATA/region=EU/part-0.parquet, only the directory of the
+    partition is read"""
+
+    DATA = Parameter()  # Add in the directory of the dataset
+    partition = Parameter()  # Ex: "region=EU" or "region=EU/product=A"
+    # Row filters pushed down to the parquet reader, see ingest.iter_partition
+    input_filters = None
+    output = CachedTargetOutput(ext=".parquet", target_class=ParquetTarget)
+    code_modules = ("machine_learning_utils.functions.ingest",)
+
+    def source_files(self):
+        """Paths of the files of the partition, skipping the hidden files
+        which the parquet reader skips as well"""
+        root = os.path.join(os.path.expanduser(self.DATA), self.partition)
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith((".", "_")))
+            paths.extend(
+                os.path.join(dirpath, name)
+                for name in sorted(filenames)
+                if not name.startswith((".", "_"))
+            )
+        return paths
+
+    def cache_key(self):
+        """Path, size and modification time of every file of the partition,
+        keys the content-addressed outputs of the downstream tasks"""
+        return [(path, _source_stat(path)) for path in self.source_files()]
+
     def run(self):
-        with self.output().open("wb") as out_file:
-            df = pd.read_csv(self.DATA)
-            df.to_parquet(out_file, engine="pyarrow")
+        with self.output().temporary_path() as tmp_path:
+            write_parquet(
+                iter_partition(self.DATA, self.partition, filters=self.input_filters),
+                tmp_path,
+            )
+
 
+class DataPreprocess(IncrementalTask, ProfiledTask, Task):
+    """A Luigi task to preprocess data after download
 
-class DataPreprocess(Task):
-    """A Luigi task to preprocess data after download"""
+    Subclasses declare a chain of transforms, which is applied to the whole
+    upstream parquet file in memory, or batch by batch when ``out_of_core``
+    is set, the transformed batches of a .npz output are still combined in
+    memory. The fitted chain is saved next to the output, see :meth:`state`,
+    to preprocess new rows the same way when scoring. Subclasses may also
+    override :meth:`run` directly, in which case no chain is saved and every
+    incremental run processes all the rows.
+
+    With ``incremental``, the chain with its training only steps is saved as
+    well, see :meth:`fit_state`, and the next run updates it with the
+    upstream delta only, see functions.transforms.update_chain, and appends
+    it to the output as a new part. The rows transformed before are not
+    transformed again, ex: with the updated medians of an Imputer, and the
+    one hot columns of new categories are 0 in the earlier rows. New one hot
+    columns make the output rewritten whole, and the downstream tasks run
+    from scratch.
+    """
 
     requires = Requires()
     # download = Requirement(DownloadData) - This task requires the DownloadData task as input
-    output = TargetOutput(ext=".parquet", target_class=LocalTarget)
+    output = CachedTargetOutput(ext=".parquet", target_class=ParquetTarget)
+    code_modules = (
+        "machine_learning_utils.functions.transforms",
+        "machine_learning_utils.functions.sparse",
+    )
+    # Segment of a partitioned dataset, see DownloadPartition
+    partition = Parameter(default="")
+    out_of_core = BoolParameter(default=False, significant=False)
+    batch_size = IntParameter(default=65536, significant=False)
+    # Columns and row filters pushed down to the parquet reader,
+    # see ParquetTarget.read_frame
+    input_columns = None
+    exclude_columns = ()
+    input_filters = None
 
-    def run(self):
-        # Read in the data using df = pd.read_parquet(self.input()['download'].path, engine='pyarrow')
-        # After you have implemented the necessary functions needed
-        # extract the correct features, save data to parquet file using the statement below
-        # df.to_parquet(self.output().path, engine='pyarrow')
+    def transforms(self):
+        """Returns the list of functions.transforms.Transform applied in order
+        Ex: [Deduplicate(), Imputer(), OneHotEncoder(["sex"])]"""
         raise NotImplementedError()
 
+    def state(self):
+        """Target of the fitted transforms, saved next to the output"""
+        path = os.path.splitext(self.output().path)[0] + "-transforms.joblib"
+        return SuffixPreservingLocalTarget(path)
+
+    def save_transforms(self, chain):
+        """Save the steps of a fitted chain applied to new rows"""
+        import joblib
 
-class BuildModel(Task):
-    """A Luigi task to classify a data using Support Vector Machine and Random Forest Model"""
+        with self.state().temporary_path() as tmp_path:
+            joblib.dump(scoring_chain(chain), tmp_path)
+
+    def load_transforms(self):
+        """Returns the fitted transforms saved by :meth:`run`, none when the
+        task does not save its chain"""
+        import joblib
+
+        state = self.state()
+        return joblib.load(state.path) if state.exists() else []
+
+    def fit_state(self):
+        """Target of the whole fitted chain of the incremental runs"""
+        path = os.path.splitext(self.output().path)[0] + "-chain.joblib"
+        return SuffixPreservingLocalTarget(path)
+
+    def read_options(self):
+        return {
+            "columns": self.input_columns,
+            "exclude": self.exclude_columns,
+            "filters": self.input_filters,
+        }
+
+    def run(self):
+        if self.incremental:
+            self.update()
+            return
+        self.clear_manifest()
+        chain = self.transforms()
+        self.fit_output(chain, fit_transform_chain)
+        self.save_transforms(chain)
+
+    def fit_output(self, chain, fit_transform):
+        """Fit a chain to every upstream row and write the transformed rows to
+        the output, batch by batch when out_of_core is set
+        :param chain: List of functions.transforms.Transform
+        :param fit_transform: Function fitting a chain to a dataframe held in
+            memory and returning it transformed, ex: fit_transform_chain"""
+        (source,) = self.input().values()
+        read_options = self.read_options()
+        if self.out_of_core:
+            # One cheap pass per fitted step collects the global statistics,
+            # then each batch is transformed and appended to the output
+            def batches():
+                return iter_frames(source, self.batch_size, **read_options)
+
+            fit_chain(chain, batches)
+            self.write_batches(apply_chain(chain, batches()))
+        else:
+            df = read_frame(source, **read_options)
+            self.write_frame(fit_transform(chain, df))
+
+    def update(self):
+        """Preprocess the rows added upstream since the last run with the
+        chain updated from them, or every row with a new chain"""
+        import joblib
+
+        upstream = self.resumable()
+        if self.output().path.endswith(".npz") or not self.fit_state().exists():
+            # A .npz file cannot be appended to
+            upstream = None
+        if upstream is None:
+            chain = self.transforms()
+            self.remove_parts()
+            self.fit_output(chain, update_chain)
+            full = True
+        else:
+            chain = joblib.load(self.fit_state().path)
+            delta = read_frame(upstream.delta(), **self.read_options())
+            full = not self.append_frame(update_chain(chain, delta))
+        with self.fit_state().temporary_path() as tmp_path:
+            joblib.dump(chain, tmp_path)
+        self.save_transforms(chain)
+        self.record_run(full=full)
+
+    def append_frame(self, df):
+        """Append a dataframe to the parquet output as a new part, the one hot
+        columns of categories first seen on either side are 0 on the other
+        :returns False when the output was rewritten, see
+            IncrementalTask.append_part"""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        return self.append_part(table, fill_value=0)
+
+    def write_frame(self, df):
+        """Write a dataframe to the output, a parquet file or a .npz file for
+        sparse features"""
+        target = self.output()
+        if target.path.endswith(".npz"):
+            with target.temporary_path() as tmp_path:
+                save_sparse_frame(df, tmp_path)
+        elif isinstance(target, ParquetTarget):
+            target.write_frame(df)
+        else:
+            target.makedirs()
+            df.to_parquet(target.path, engine="pyarrow", index=False)
+
+    def write_batches(self, batches):
+        """Append a stream of dataframes to the output"""
+        target = self.output()
+        if target.path.endswith(".npz"):
+            # A .npz file cannot be appended to, so the batches are combined
+            # in memory: out_of_core bounds the memory of a parquet output only
+            self.write_frame(pd.concat(batches, ignore_index=True))
+            return
+        with target.temporary_path() as tmp_path:
+            write_parquet(
+                (pa.Table.from_pandas(df, preserve_index=False) for df in batches),
+                tmp_path,
+            )
+
+
+class BuildModel(ProfiledTask, Task):
+    """A Luigi task to classify a data using the models of a model registry,
+    by default a Support Vector Machine and a Random Forest Model"""
 
     requires = Requires()
     preprocess = Requirement(DataPreprocess)
     class_column = Parameter()  # Add in the column that should be evaluated
-    output = TargetOutput(ext=".csv", target_class=LocalTarget)
+    # List of {"name", "estimator", "params"} dictionaries, see functions.load_estimator
+    models = ListParameter(default=DEFAULT_MODELS)
+    partition = Parameter(default="")
+    # Fold execution, see functions.run_jobs
+    backend = ChoiceParameter(choices=BACKENDS, default="serial", significant=False)
+    n_jobs = IntParameter(default=-1, significant=False)
+    output = CachedTargetOutput(ext=".csv", target_class=LocalTarget)
+    code_modules = (
+        "machine_learning_utils.functions.functions",
+        "machine_learning_utils.functions.shared",
+    )
 
     def run(self):
-        # Edit the classifiers to fit needs
-        df = pd.read_parquet(self.input()["preprocess"].path, engine="pyarrow")
-        X = df.loc[:, df.columns != self.class_column].values
-        y = df.loc[:, df.columns == self.class_column].values.ravel()
-        svc_report = eval_classifier(SVC(kernel="rbf", gamma=0.05, C=2), X, y)
-        rf_report = eval_classifier(
-            RandomForestClassifier(n_estimators=100, random_state=None, n_jobs=4), X, y
-        )
-        class_report = svc_report.join(rf_report, lsuffix="_svc", rsuffix="_rf")
+        df = read_features(self.input()["preprocess"])
+        features = [col for col in df.columns if col != self.class_column]
+        y = df[self.class_column].to_numpy()
+        X = feature_matrix(df, features, self.backend)
+        del df
+
+        try:
+            class_report = eval_classifiers(
+                load_models(self.models),
+                X,
+                y,
+                backend=self.backend,
+                n_jobs=self.n_jobs,
+            )
+        finally:
+            if isinstance(X, SharedArray):
+                X.unlink()
+                X.close()
+        self.output().makedirs()
         class_report.to_csv(self.output().path)
+
+
+class TuneModel(ProfiledTask, Task):
+    """A Luigi task to tune the models of a search space with successive
+    halving over the folds, see functions.tuning.successive_halving
+
+    The output is a model registry of the best parameters of each model,
+    usable as the ``models`` of BuildModel and TrainModel, content-addressed
+    so a change of the features, search space or code searches again. The
+    trials are logged next to the output so an interrupted search resumes.
+    """
+
+    requires = Requires()
+    preprocess = Requirement(DataPreprocess)
+    class_column = Parameter()  # Add in the column that should be evaluated
+    # Registry entries with a "space", see functions.tuning.expand_search
+    search = ListParameter(default=DEFAULT_SEARCH)
+    partition = Parameter(default="")
+    n_splits = IntParameter(default=9)
+    eta = IntParameter(default=3)
+    min_folds = IntParameter(default=1)
+    scoring = Parameter(default="accuracy")
+    # Trial execution, see functions.run_jobs
+    backend = ChoiceParameter(choices=BACKENDS, default="process", significant=False)
+    n_jobs = IntParameter(default=-1, significant=False)
+    output = CachedTargetOutput(ext=".json", target_class=LocalTarget)
+    code_modules = (
+        "machine_learning_utils.functions.tuning",
+        "machine_learning_utils.functions.shared",
+    )
+
+    def trial_log(self):
+        """Path of the trial log, keyed by the input data and folds so trials
+        are only reused for the same folds, and not by the search space or
+        the code of the task, unlike the output"""
+        digest = hashlib.sha256()
+        for requirement in self.requires().values():
+            digest.update(task_digest(requirement).encode())
+        digest.update("{}-{}".format(self.n_splits, self.scoring).encode())
+        return "{}-trials-{}.jsonl".format(
+            type(self).output.stem(self), digest.hexdigest()[:16]
+        )
+
+    def run(self):
+        df = read_features(self.input()["preprocess"])
+        features = [col for col in df.columns if col != self.class_column]
+        y = df[self.class_column].to_numpy()
+        X = feature_matrix(df, features, self.backend)
+        del df
+
+        candidates = expand_search(recursively_unfreeze(self.search))
+        trial_log = self.trial_log()
+        os.makedirs(os.path.dirname(trial_log) or ".", exist_ok=True)
+        try:
+            results = successive_halving(
+                candidates,
+                X,
+                y,
+                n_splits=self.n_splits,
+                eta=self.eta,
+                min_folds=self.min_folds,
+                scoring=self.scoring,
+                backend=self.backend,
+                n_jobs=self.n_jobs,
+                trial_log=trial_log,
+            )
+        finally:
+            if isinstance(X, SharedArray):
+                X.unlink()
+                X.close()
+        with self.output().open("w") as f:
+            json.dump(best_candidates(candidates, results), f, indent=2)
+
+
+class TrainModel(IncrementalTask, ProfiledTask, Task):
+    """A Luigi task to fit one model of the model registry on the whole
+    preprocessed data, the fitted model is saved with the fitted preprocessing
+    chain so new rows are scored without retraining, see ScoreData
+
+    With ``incremental``, a model whose estimator has ``partial_fit``, ex:
+    sklearn.linear_model.SGDClassifier, is updated with the upstream delta
+    only, other models are fitted again on the whole data."""
+
+    requires = Requires()
+    preprocess = Requirement(DataPreprocess)
+    class_column = Parameter()  # Add in the column that should be predicted
+    models = ListParameter(default=DEFAULT_MODELS)
+    model = Parameter(default="rf")  # Name of the registry entry to fit
+    partition = Parameter(default="")
+    output = CachedTargetOutput(ext=".joblib", target_class=SuffixPreservingLocalTarget)
+    code_modules = (
+        "machine_learning_utils.functions.functions",
+        "machine_learning_utils.functions.scoring",
+    )
+
+    def update_model(self, upstream):
+        """Update the saved model with the delta of the upstream task
+        :returns (model, features), (None, None) when the estimator has no
+            partial_fit or the delta has new features"""
+        import joblib
+
+        bundle = joblib.load(self.output().path)
+        clf, features = bundle["model"], bundle["features"]
+        df = read_features(upstream.delta())
+        if not hasattr(clf, "partial_fit") or set(df.columns) != set(
+            features + [self.class_column]
+        ):
+            return None, None
+        try:
+            clf.partial_fit(
+                frame_to_matrix(df[features]), df[self.class_column].to_numpy()
+            )
+        except ValueError as e:
+            # Ex: a class which was not in the training data
+            logger.warning("%s fitting the model again: %s", self, e)
+            return None, None
+        return clf, features
+
+    def run(self):
+        models = load_models(self.models)
+        if self.model not in models:
+            raise ValueError(
+                "Unknown model {!r}, expected one of {}".format(
+                    self.model, list(models)
+                )
+            )
+        clf = features = upstream = None
+        if self.incremental:
+            upstream = self.resumable()
+        if upstream is not None:
+            clf, features = self.update_model(upstream)
+        if clf is None:
+            df = read_features(self.input()["preprocess"])
+            features = [col for col in df.columns if col != self.class_column]
+            y = df[self.class_column].to_numpy()
+            X = frame_to_matrix(df[features])
+            del df
+            clf = models[self.model].fit(X, y)
+        with self.output().temporary_path() as tmp_path:
+            save_model(
+                tmp_path,
+                clf,
+                transforms=preprocessing_chain(self),
+                features=features,
+                class_column=self.class_column,
+            )
+        if self.incremental:
+            self.record_run(full=upstream is None)
+        else:
+            self.clear_manifest()
+
+
+class ScoreData(ProfiledTask, Task):
+    """A Luigi task to score a parquet file of raw rows with a model saved by
+    TrainModel, the file is read in batches and its row groups are scored in
+    parallel, the predictions and probabilities are written to parquet"""
+
+    requires = Requires()
+    # train = Requirement(TrainModel) - This task requires the TrainModel task as input
+    SCORE_DATA = Parameter()  # Add in the parquet file to score
+    batch_size = IntParameter(default=65536, significant=False)
+    # Row group execution, see functions.iter_jobs
+    backend = ChoiceParameter(choices=BACKENDS, default="serial", significant=False)
+    n_jobs = IntParameter(default=-1, significant=False)
+    # Input columns copied to the scores, ex: an id column
+    keep_columns = ()
+    output = CachedTargetOutput(ext=".parquet", target_class=ParquetTarget)
+    code_modules = ("machine_learning_utils.functions.scoring",)
+
+    def cache_key(self):
+        return _source_stat(self.SCORE_DATA)
+
+    def run(self):
+        (model,) = self.input().values()
+        with self.output().temporary_path() as tmp_path:
+            score_parquet(
+                os.path.expanduser(self.SCORE_DATA),
+                model.path,
+                tmp_path,
+                batch_size=self.batch_size,
+                keep_columns=self.keep_columns,
+                backend=self.backend,
+                n_jobs=self.n_jobs,
+            )
+
+
+class PartitionedBuildModel(ProfiledTask, Task):
+    """A Luigi task to fan out one model building chain per partition of a
+    Hive partitioned dataset and merge the classification reports
+
+    Subclasses set ``build_class`` to a BuildModel whose chain starts with a
+    DownloadPartition reading the same ``DATA``, ex: set as its default.
+    Each partition flows into the ``partition`` parameter of the chain and so
+    into its output paths. Run with several workers to build the partitions
+    concurrently.
+    """
+
+    DATA = Parameter()  # Add in the directory of the dataset
+    # Partitions to build, defaults to every partition of the dataset
+    partitions = ListParameter(default=[])
+    build_class = BuildModel
+    # Keyed on the digests of the per-partition builds, see task_digest
+    output = CachedTargetOutput(ext=".csv", target_class=LocalTarget)
+
+    def partition_list(self):
+        if "_partitions" not in self.__dict__:
+            self._partitions = list(self.partitions) or discover_partitions(self.DATA)
+        return self._partitions
+
+    def requires(self):
+        return {
+            partition: self.clone(self.build_class, partition=partition)
+            for partition in self.partition_list()
+        }
+
+    def run(self):
+        reports = {
+            partition: pd.read_csv(target.path, index_col=[0, 1, 2])
+            for partition, target in self.input().items()
+        }
+        report = pd.concat(reports, names=["partition"])
+        self.output().makedirs()
+        report.to_csv(self.output().path)
@@ -0,0 +1,212 @@
+"""
+Incremental runs of a pipeline, where each task processes only the rows
+added since its last run, see :class:`IncrementalTask`.
+"""
+import os
+import json
+import shutil
+from luigi import BoolParameter, Event, Task
+from luigi.task import flatten
+from machine_learning_utils.functions.ingest import (
+    PART_FORMAT,
+    append_parquet,
+    append_part,
+    dataset_parts,
+)
+from machine_learning_utils.luigi.target import (
+    ParquetTarget,
+    SuffixPreservingLocalTarget,
+    frame_cache,
+)
+
+
+class IncrementalTask:
+    """Task mixin of the incremental mode, set with the ``incremental``
+    parameter, which the Requirement clones pass on to the upstream tasks
+
+    Each run of an incremental task bumps the ``version`` of its manifest, a
+    JSON file next to its output, written once the task succeeds, so a
+    subclass overriding ``run`` is tracked as well, as a full run. A parquet
+    output becomes a directory of part files once a run appends rows to it,
+    each run adding a part, see :meth:`append_part`, which is the delta of
+    the run. A downstream task is complete once it has processed the current
+    version of its upstream tasks, and its next run processes the upstream
+    delta only, when the upstream version has moved by exactly one since its
+    last run and that run was not ``full``, ex: after a source file was
+    rewritten, and is not complete while one of its incremental requirements
+    is not. Example::
+        class MyTask(IncrementalTask, Task):
+            ...
+
+        luigi --module my_module TrainMyModel --incremental
+    """
+
+    incremental = BoolParameter(default=False, significant=False)
+
+    def _stem(self):
+        return os.path.splitext(self.output().path)[0]
+
+    def manifest(self):
+        """Target of the manifest of the last incremental run"""
+        return SuffixPreservingLocalTarget(self._stem() + "-manifest.json")
+
+    def delta(self):
+        """Target of the rows appended to the output by the last run, the
+        last part of the output, None when the run did not append rows"""
+        parts = self.read_manifest().get("parts")
+        if not parts:
+            return None
+        return ParquetTarget(os.path.join(self.output().path, parts[-1]))
+
+    def read_manifest(self):
+        """Returns the manifest of the last incremental run, empty when the
+        task has not run incrementally"""
+        manifest = self.manifest()
+        if not manifest.exists():
+            return {}
+        with open(manifest.path) as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest):
+        with self.manifest().temporary_path() as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+
+    def record_run(self, full, **entries):
+        """Record how the running task updated its output, written to the
+        manifest once the task succeeds
+        :param full: Whether the output was written from scratch
+        :param entries: Other entries of the manifest, the part files of the
+            output are listed in ``parts``"""
+        self._run_entries = dict(entries, full=full)
+
+    def commit_manifest(self):
+        """Write the manifest of the run which just succeeded, a run which
+        recorded nothing, ex: of a subclass overriding run, is a full run"""
+        entries = self.__dict__.pop("_run_entries", {"full": True})
+        path = self.output().path
+        if os.path.isdir(path):
+            entries["parts"] = [os.path.basename(part) for part in dataset_parts(path)]
+        self.write_manifest(
+            {
+                "version": self.read_manifest().get("version", 0) + 1,
+                **entries,
+                "upstream": self.upstream_versions(),
+            }
+        )
+
+    def clear_manifest(self):
+        """Forget the incremental runs, ex: before a full run of the task
+        outside of the incremental mode"""
+        if self.manifest().exists():
+            self.manifest().remove()
+        self.remove_parts()
+
+    def remove_parts(self):
+        """Remove the part files appended to the output by the incremental
+        runs, before the output is written from scratch"""
+        path = self.output().path
+        if os.path.isdir(path):
+            frame_cache.discard(path)
+            shutil.rmtree(path)
+
+    def prune_parts(self):
+        """Remove the part files of the output left by an interrupted run,
+        which the manifest does not list
+        :returns False when a part listed by the manifest is missing"""
+        path = self.output().path
+        if not os.path.isdir(path):
+            return True
+        # The output of a full run is moved into the directory as its first part
+        listed = set(self.read_manifest().get("parts") or [PART_FORMAT.format(0)])
+        found = {os.path.basename(part) for part in dataset_parts(path)}
+        for name in found - listed:
+            os.remove(os.path.join(path, name))
+        return listed <= found
+
+    def append_part(self, table, fill_value=None, row_group_size=None):
+        """Append rows to the parquet output as a new part file, the rows
+        written before are neither read nor rewritten, see
+        functions.ingest.append_part. Rows with columns the output does not
+        have make the output rewritten whole, see
+        functions.ingest.append_parquet
+        :param table: Pyarrow table of the new rows
+        :param fill_value: Value of the columns missing from either side
+        :param row_group_size: Maximum number of rows per row group
+        :returns False when the output was rewritten, the run is then full"""
+        target = self.output()
+        # The output may still be written in the background, see handoff
+        frame_cache.flush()
+        frame_cache.discard(target.path)
+        if set(table.column_names) <= set(target.columns()):
+            append_part(
+                target.path,
+                [table],
+                fill_value=fill_value,
+                row_group_size=row_group_size,
+            )
+            return True
+        tmp_path = "{}-rewrite-{}".format(target.path, os.getpid())
+        try:
+            append_parquet(
+                target.path,
+                [table],
+                tmp_path,
+                fill_value=fill_value,
+                row_group_size=row_group_size,
+            )
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.remove_parts()
+        os.replace(tmp_path, target.path)
+        return False
+
+    def upstream_versions(self):
+        """Returns the manifest versions of the incremental requirements,
+        keyed by task id"""
+        return {
+            task.task_id: task.read_manifest().get("version")
+            for task in self.incremental_requires()
+        }
+
+    def incremental_requires(self):
+        tasks = flatten(self.requires())
+        return [task for task in tasks if isinstance(task, IncrementalTask)]
+
+    def resumable(self):
+        """Returns the incremental requirement whose delta the next run can
+        process alone, None when the task has to run from scratch"""
+        last = self.read_manifest().get("upstream")
+        upstream = self.incremental_requires()
+        if last is None or len(upstream) != 1 or not self.output().exists():
+            return None
+        if not self.prune_parts():
+            return None
+        (task,) = upstream
+        manifest = task.read_manifest()
+        delta = task.delta()
+        if manifest.get("full", True) or delta is None or not delta.exists():
+            return None
+        if manifest.get("version") != last.get(task.task_id, -1) + 1:
+            return None
+        return task
+
+    def complete(self):
+        if not self.incremental:
+            return super().complete()
+        manifest = self.read_manifest()
+        return (
+            super().complete()
+            and "version" in manifest
+            # New rows further upstream have not reached the requirements yet
+            and all(task.complete() for task in self.incremental_requires())
+            and manifest.get("upstream") == self.upstream_versions()
+        )
+
+
+@Task.event_handler(Event.SUCCESS)
+def _commit_manifest(task):
+    if isinstance(task, IncrementalTask) and task.incremental:
+        task.commit_manifest()
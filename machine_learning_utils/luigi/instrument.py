@@ -0,0 +1,237 @@
+"""
+Task instrumentation: wall time, CPU time, peak memory and I/O of every task,
+hooked into the Luigi task events. Enable with::
+
+    [instrument]
+    enabled = true
+    log_file = data/task_metrics.jsonl
+    prometheus_file = data/task_metrics.prom
+"""
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+import pyarrow.parquet as pq
+from luigi import Config, Task, Event, BoolParameter, Parameter
+from luigi.task import flatten
+from machine_learning_utils.functions.ingest import dataset_parts
+from machine_learning_utils.luigi.target import frame_cache
+
+logger = logging.getLogger("luigi-interface")
+
+
+class instrument(Config):
+    """Records one JSON line per finished task to ``log_file``, and when
+    ``prometheus_file`` is set, rewrites it with the metrics of the last run
+    of every task in the Prometheus text format"""
+
+    enabled = BoolParameter(default=False)
+    log_file = Parameter(default="data/task_metrics.jsonl")
+    prometheus_file = Parameter(default="")
+
+
+_running = {}
+_lock = threading.Lock()
+
+
+def _reset_peak_rss():
+    """Reset the peak resident memory of the process where supported (Linux),
+    returns False when the peak can only grow over the life of the process"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    """Peak resident memory of the process in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _io_counters():
+    """Bytes read and written by the process, ex: through the page cache,
+    None where /proc/self/io is not available"""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def target_stats(target):
+    """Function to describe a file target
+    :param target: Luigi target with a path
+    :returns dictionary of its path, size in bytes and, for parquet files,
+        number of rows and columns"""
+    path = getattr(target, "path", None)
+    stats = {"path": path}
+    if path is None:
+        return stats
+    if os.path.exists(path):
+        # A parquet output appended to by incremental runs is a directory
+        parts = dataset_parts(path)
+        stats["bytes"] = sum(os.path.getsize(part) for part in parts)
+        if path.endswith(".parquet"):
+            try:
+                metadata = [pq.ParquetFile(part).metadata for part in parts]
+                stats["rows"] = sum(meta.num_rows for meta in metadata)
+                stats["columns"] = metadata[-1].num_columns
+            except Exception:
+                pass
+    else:
+        # Handed over in memory and still being written in the background
+        table = frame_cache.get(path)
+        if table is not None:
+            stats["rows"] = table.num_rows
+            stats["columns"] = table.num_columns
+    return stats
+
+
+def _on_start(task):
+    if not instrument().enabled:
+        return
+    peak_reset = _reset_peak_rss()
+    with _lock:
+        _running[task.task_id] = {
+            "started": time.time(),
+            "wall": time.perf_counter(),
+            "cpu": time.process_time(),
+            "io": _io_counters(),
+            "peak_reset": peak_reset,
+        }
+
+
+def _on_finish(task, status, exception=None):
+    with _lock:
+        start = _running.pop(task.task_id, None)
+    if start is None:
+        return
+    io = _io_counters()
+    record = {
+        "task_id": task.task_id,
+        "family": task.get_task_family(),
+        "status": status,
+        "pid": os.getpid(),
+        "started": start["started"],
+        "wall_time": time.perf_counter() - start["wall"],
+        "cpu_time": time.process_time() - start["cpu"],
+        "peak_rss": _peak_rss(),
+        # A peak which could not be reset covers the life of the process
+        "peak_rss_scope": "task" if start["peak_reset"] else "process",
+        "read_bytes": io[0] - start["io"][0] if io and start["io"] else None,
+        "write_bytes": io[1] - start["io"][1] if io and start["io"] else None,
+        "inputs": [target_stats(t) for t in flatten(task.input())],
+        "outputs": [target_stats(t) for t in flatten(task.output())],
+    }
+    if exception is not None:
+        record["error"] = repr(exception)
+
+    config = instrument()
+    try:
+        write_record(config.log_file, record)
+        if config.prometheus_file:
+            write_prometheus(read_records(config.log_file), config.prometheus_file)
+    except OSError as e:
+        logger.warning("Could not write the metrics of %s: %s", task.task_id, e)
+
+
+@Task.event_handler(Event.START)
+def _instrument_start(task):
+    _on_start(task)
+
+
+@Task.event_handler(Event.SUCCESS)
+def _instrument_success(task):
+    _on_finish(task, "SUCCESS")
+
+
+@Task.event_handler(Event.FAILURE)
+def _instrument_failure(task, exception):
+    _on_finish(task, "FAILURE", exception)
+
+
+def write_record(path, record):
+    """Function to append a record to a JSON lines file, one write per line
+    so the records of concurrent worker processes do not interleave"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    line = (json.dumps(record) + "\n").encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_records(path):
+    """Function to read the records of a JSON lines metrics file
+    :returns list of dictionaries"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+_PROMETHEUS_METRICS = [
+    ("wall_time", "luigi_task_wall_seconds", "Wall time of the task run"),
+    ("cpu_time", "luigi_task_cpu_seconds", "CPU time of the task process"),
+    ("peak_rss", "luigi_task_peak_rss_bytes", "Peak resident memory"),
+    ("read_bytes", "luigi_task_read_bytes", "Bytes read by the task"),
+    ("write_bytes", "luigi_task_write_bytes", "Bytes written by the task"),
+    ("output_bytes", "luigi_task_output_bytes", "Size of the task outputs"),
+    ("output_rows", "luigi_task_output_rows", "Rows of the parquet outputs"),
+]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def write_prometheus(records, path):
+    """Function to write the metrics of the last run of every task in the
+    Prometheus text exposition format, ex: for the node exporter textfile
+    collector
+    :param records: Records of :func:`read_records`
+    :param path: Path of the .prom file, replaced atomically"""
+    last = {}
+    for record in records:
+        outputs = record.get("outputs", [])
+        record = dict(
+            record,
+            output_bytes=sum(o.get("bytes", 0) for o in outputs),
+            output_rows=sum(o.get("rows", 0) for o in outputs),
+        )
+        last[record["task_id"]] = record
+
+    lines = []
+    for key, name, help_text in _PROMETHEUS_METRICS:
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} gauge".format(name))
+        for record in last.values():
+            if record.get(key) is None:
+                continue
+            lines.append(
+                '{}{{task_id="{}",family="{}",status="{}"}} {}'.format(
+                    name,
+                    _label(record["task_id"]),
+                    _label(record["family"]),
+                    record["status"],
+                    record[key],
+                )
+            )
+    tmp_path = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,109 @@
+"""
+Opt-in profiling of the run() of a task, see :class:`ProfiledTask`.
+"""
+import os
+import sys
+import cProfile
+import threading
+from collections import Counter
+from luigi import Task, Event, BoolParameter, FloatParameter
+from luigi.task import flatten
+
+
+class StackSampler:
+    """Sample the call stack of one thread at a fixed interval
+
+    The samples are written in the collapsed stack format, one
+    ``outer;inner;innermost count`` line per distinct stack, which
+    flamegraph.pl, speedscope or inferno render as a flame graph.
+    :param thread_id: Identifier of the sampled thread, defaults to the caller
+    :param interval: Seconds between two samples
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Write the samples in the collapsed stack format"""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+
+class ProfiledTask:
+    """Task mixin profiling :meth:`run` when the ``profile`` parameter is set
+
+    A deterministic profile is saved as ``<output>.pstats`` and the samples
+    of a stack sampler as ``<output>.collapsed``, next to the first output
+    of the task. Work done in the worker processes of a parallel backend is
+    not profiled. Example::
+        class MyTask(ProfiledTask, Task):
+            ...
+
+        luigi --module my_module MyTask --profile
+    """
+
+    profile = BoolParameter(default=False, significant=False)
+    profile_interval = FloatParameter(default=0.005, significant=False)
+
+    def profile_path(self, ext):
+        """Path of a profile file of the task, next to its first output"""
+        outputs = [t for t in flatten(self.output()) if hasattr(t, "path")]
+        if outputs:
+            stem = outputs[0].path
+        else:
+            stem = os.path.join("data", self.task_id)
+        return stem + ext
+
+
+_profiles = {}
+
+
+@Task.event_handler(Event.START)
+def _start_profile(task):
+    if not isinstance(task, ProfiledTask) or not task.profile:
+        return
+    sampler = StackSampler(interval=task.profile_interval).start()
+    profiler = cProfile.Profile()
+    _profiles[task.task_id] = (profiler, sampler)
+    profiler.enable()
+
+
+@Task.event_handler(Event.SUCCESS)
+@Task.event_handler(Event.FAILURE)
+def _save_profile(task, *args):
+    if task.task_id not in _profiles:
+        return
+    profiler, sampler = _profiles.pop(task.task_id)
+    profiler.disable()
+    sampler.stop()
+    pstats_path = task.profile_path(".pstats")
+    os.makedirs(os.path.dirname(pstats_path) or ".", exist_ok=True)
+    profiler.dump_stats(pstats_path)
+    sampler.write(task.profile_path(".collapsed"))
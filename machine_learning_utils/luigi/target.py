@@ -1,7 +1,23 @@
 import random
+import logging
+import threading
+import multiprocessing
 from pathlib import Path
+from collections import OrderedDict
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from luigi import Config, Task, Event, BoolParameter, IntParameter
 from luigi.local_target import LocalTarget, atomic_file
+from machine_learning_utils.functions.ingest import (
+    dataset_parts,
+    filter_frame,
+    iter_parquet,
+)
+
+logger = logging.getLogger("luigi-interface")
 
 
 class suffix_preserving_atomic_file(atomic_file):
@@ -41,3 +57,193 @@ class SuffixPreservingLocalTarget(BaseAtomicProviderLocalTarget):
     """Class that preserves suffix and gives access to file systems operations"""
 
     atomic_provider = suffix_preserving_atomic_file
+
+
+class handoff(Config):
+    """Fused execution: a dataframe written by a task is handed directly to
+    the downstream tasks running in the same process, the parquet file is
+    still written in the background for durability. Enable with::
+
+        [handoff]
+        enabled = true
+        max_bytes = 1073741824
+    """
+
+    enabled = BoolParameter(default=False)
+    max_bytes = IntParameter(default=1 << 30)
+
+
+class FrameCache:
+    """Process-local cache of the Arrow tables of dataframes keyed by path,
+    the least recently used tables are dropped beyond ``max_bytes``. Every
+    read converts the table to a new dataframe, so a reader modifying its
+    frame in place does not change what the next readers get"""
+
+    def __init__(self):
+        self._frames = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+    def get(self, path):
+        with self._lock:
+            table = self._frames.get(path)
+            if table is not None:
+                self._frames.move_to_end(path)
+            return table
+
+    def put(self, path, table, max_bytes):
+        """Cache a table, returns False when it is larger than max_bytes"""
+        if table.nbytes > max_bytes:
+            return False
+        with self._lock:
+            self._frames[path] = table
+            self._frames.move_to_end(path)
+            total = sum(cached.nbytes for cached in self._frames.values())
+            while total > max_bytes:
+                _, dropped = self._frames.popitem(last=False)
+                total -= dropped.nbytes
+        return True
+
+    def discard(self, path):
+        with self._lock:
+            self._frames.pop(path, None)
+
+    def submit(self, path, func, *args):
+        """Run a write in the background thread"""
+        future = self._writer.submit(func, *args)
+        with self._lock:
+            self._pending[path] = future
+        future.add_done_callback(lambda f: self._done(path, f))
+        return future
+
+    def _done(self, path, future):
+        with self._lock:
+            if self._pending.get(path) is future:
+                del self._pending[path]
+        if future.exception() is not None:
+            logger.error("Background write of %s failed: %s", path, future.exception())
+            self.discard(path)
+
+    def pending(self, path):
+        with self._lock:
+            return path in self._pending
+
+    def flush(self):
+        """Wait for every background write"""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.exception()
+
+
+frame_cache = FrameCache()
+
+
+@Task.event_handler(Event.SUCCESS)
+@Task.event_handler(Event.FAILURE)
+def _flush_frame_cache(task, *args):
+    # Worker processes exit without running atexit hooks
+    if multiprocessing.current_process().name != "MainProcess":
+        frame_cache.flush()
+
+
+class ParquetTarget(BaseAtomicProviderLocalTarget):
+    """Parquet file target that reads and writes dataframes, and hands them
+    over in memory when :class:`handoff` is enabled. The path may also be a
+    directory of part files, see functions.ingest.append_part"""
+
+    def exists(self):
+        return (
+            frame_cache.get(self.path) is not None
+            or frame_cache.pending(self.path)
+            or super().exists()
+        )
+
+    def columns(self):
+        """Names of the columns of the file, read from its metadata only"""
+        table = frame_cache.get(self.path)
+        if table is not None:
+            return table.column_names
+        # The parts of a dataset written by incremental runs share a schema
+        names = pq.read_schema(dataset_parts(self.path)[-1]).names
+        return [name for name in names if not name.startswith("__index_level_")]
+
+    def _select(self, columns, exclude):
+        if exclude:
+            columns = [
+                col
+                for col in (self.columns() if columns is None else columns)
+                if col not in exclude
+            ]
+        return None if columns is None else list(columns)
+
+    def read_frame(self, columns=None, exclude=None, filters=None):
+        """Read the dataframe of the file
+        :param columns: Columns to read, defaults to every column
+        :param exclude: Columns not to read
+        :param filters: Row filters in the DNF form of pyarrow.parquet.read_table,
+            ex: [("age", ">", 18)], pushed down to the parquet reader
+        :returns pandas dataframe"""
+        columns = self._select(columns, exclude)
+        table = frame_cache.get(self.path)
+        if table is not None:
+            if columns is not None:
+                table = table.select(columns)
+            return filter_frame(table.to_pandas(), filters)
+        return pd.read_parquet(
+            self.path, engine="pyarrow", columns=columns, filters=filters
+        )
+
+    def iter_frames(self, batch_size=65536, columns=None, exclude=None, filters=None):
+        """Read the dataframe of the file in bounded batches, see :meth:`read_frame`"""
+        columns = self._select(columns, exclude)
+        table = frame_cache.get(self.path)
+        if table is not None:
+            if columns is not None:
+                table = table.select(columns)
+            for start in range(0, table.num_rows, batch_size):
+                batch = table.slice(start, batch_size).to_pandas()
+                df = filter_frame(batch, filters)
+                if len(df):
+                    yield df
+            return
+        yield from iter_parquet(self.path, batch_size, columns=columns, filters=filters)
+
+    def write_frame(self, df, row_group_size=None):
+        config = handoff()
+        if config.enabled:
+            # The numeric columns of a table share the memory of the frame,
+            # which the producer may still modify in place
+            df = df.copy()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if config.enabled and frame_cache.put(self.path, table, config.max_bytes):
+            frame_cache.submit(self.path, self._write_table, table, row_group_size)
+        else:
+            self._write_table(table, row_group_size)
+
+    def _write_table(self, table, row_group_size=None):
+        with self.temporary_path() as tmp_path:
+            pq.write_table(table, tmp_path, row_group_size=row_group_size)
+
+
+def read_frame(target, **kwargs):
+    """Function to read the dataframe of a parquet target, from memory when
+    it was handed over by an upstream task
+    :param target: Luigi target
+    :param kwargs: columns, exclude and filters, see :meth:`ParquetTarget.read_frame`
+    :returns pandas dataframe"""
+    if not isinstance(target, ParquetTarget):
+        target = ParquetTarget(target.path)
+    return target.read_frame(**kwargs)
+
+
+def iter_frames(target, batch_size=65536, **kwargs):
+    """Function to read the dataframe of a parquet target in bounded batches
+    :param target: Luigi target
+    :param batch_size: Maximum number of rows per batch
+    :param kwargs: columns, exclude and filters, see :meth:`ParquetTarget.read_frame`
+    :returns iterator of pandas dataframes"""
+    if not isinstance(target, ParquetTarget):
+        target = ParquetTarget(target.path)
+    return target.iter_frames(batch_size, **kwargs)
@@ -1,5 +1,13 @@
-from functools import partial
-from luigi import Task, LocalTarget
+import os
+import json
+import hashlib
+import shutil
+import inspect
+import importlib
+from glob import glob, escape
+from functools import partial, lru_cache
+from luigi import Task, LocalTarget, Event
+from luigi.task import flatten
 
 
 class Requirement:
@@ -7,13 +15,28 @@ class Requirement:
     def __init__(self, task_class, **params):
         self.task_class = task_class
         self.params = params
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
 
     def __get__(self, task, cls):
         if task is None:
             return self
-        return task.clone(
+        requirement = task.clone(
             self.task_class,
             **self.params)
+        if self.name is not None:
+            # Memoize on the instance, which shadows this (non-data) descriptor
+            task.__dict__[self.name] = requirement
+        return requirement
+
+
+@lru_cache(maxsize=None)
+def requirement_names(task_class):
+    """Names of the :class:`.Requirement` descriptors of a task class,
+    computed once per class"""
+    return tuple(k for k in dir(task_class) if isinstance(getattr(task_class, k, None), Requirement))
 
 
 class Requires:
@@ -44,14 +67,18 @@ class Requires:
         :returns: requirements compatible with `task.requires()`
         :rtype: dict
         """
-        task_dict = {k: getattr(task, k) for k in dir(task)}
-        return {k: v for k, v in task_dict.items() if isinstance(getattr(type(task), k, None), Requirement)}
+        return {k: getattr(task, k) for k in requirement_names(type(task))}
 
 
 class TargetOutput:
-    """Composition to replace :meth:`luigi.task.Task.output"""
+    """Composition to replace :meth:`luigi.task.Task.output
+
+    Tasks with a non empty ``partition`` parameter, ex: 'region=EU', write one
+    file per partition under a directory named after the file pattern,
+    ex: data/BuildModel/region=EU.csv
+    """
 
-    def __init__(self, file_pattern='{task.__class__.__name__}', ext='.txt', target_class=LocalTarget, **target_kwargs):
+    def __init__(self, file_pattern='{task.task_family}', ext='.txt', target_class=LocalTarget, **target_kwargs):
         self.file_pattern = file_pattern
         self.ext = ext
         self.target_class = target_class
@@ -62,7 +89,156 @@ class TargetOutput:
             return self
         return partial(self.__call__, task)
 
+    def stem(self, task):
+        """Path of the output without its extension"""
+        stem = 'data/' + self.file_pattern.format(task=task)
+        partition = getattr(task, 'partition', None)
+        if partition:
+            stem += '/' + partition
+        return stem
+
     def __call__(self, task):
-        path = 'data/' + self.file_pattern.format(task=task) + self.ext
+        path = self.stem(task) + self.ext
         #glob = self.file_pattern.format(task=task) + self.ext
         return self.target_class(path,  **self.target_kwargs)
+
+
+def _package(name):
+    return name.split('.')[0]
+
+
+def source_modules(task_class):
+    """Names of the modules listed in the optional ``code_modules`` attribute
+    of a task class and of its bases, ex: the module of the functions called
+    by run()
+    """
+    names = set()
+    for cls in task_class.__mro__:
+        names.update(vars(cls).get('code_modules', ()))
+    return sorted(names)
+
+
+def _source(obj, name):
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return name
+
+
+@lru_cache(maxsize=None)
+def _code_version(cls):
+    """Hash of the source of a task class, of its bases and of its
+    :func:`source_modules`, computed once per class. Other modules are not
+    hashed, so an edit of one task does not change the digest of the others
+    """
+    sources = hashlib.sha256()
+    for base in cls.__mro__:
+        if _package(base.__module__) not in ('builtins', 'luigi'):
+            sources.update(_source(base, base.__qualname__).encode())
+    for name in source_modules(cls):
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            module = None
+        sources.update(_source(module, name).encode())
+    return sources.hexdigest()
+
+
+def task_digest(task):
+    """Content digest of a task: its code version, its significant parameters,
+    the optional ``cache_key()`` of the task (ex: the stat of a source file)
+    and the digests of its requirements
+
+    The digest is computed once per task instance, and luigi reuses the
+    instance of equal parameters within a process.
+    """
+    cached = task.__dict__.get('_task_digest')
+    if cached is not None:
+        return cached
+    digest = hashlib.sha256()
+    digest.update(task.get_task_family().encode())
+    digest.update(_code_version(type(task)).encode())
+    digest.update(json.dumps(task.to_str_params(only_significant=True), sort_keys=True).encode())
+    cache_key = getattr(task, 'cache_key', None)
+    if cache_key is not None:
+        digest.update(str(cache_key()).encode())
+    for requirement in flatten(task.requires()):
+        digest.update(task_digest(requirement).encode())
+    task.__dict__['_task_digest'] = digest.hexdigest()
+    return task.__dict__['_task_digest']
+
+
+class CachedTargetOutput(TargetOutput):
+    """Content-addressed :class:`TargetOutput`
+
+    The path is suffixed with the :func:`task_digest` of the task, so a change
+    of parameters, upstream tasks or code writes a new entry instead of reusing
+    a stale one. Entries of a task are evicted least recently used first,
+    beyond ``max_entries``, 3 by default, or ``max_bytes``, after the task
+    succeeds, None lifts a limit. An entry is used when its task succeeds or
+    is found complete by the scheduler.
+    Example::
+        class MyTask(Task):
+            output = CachedTargetOutput(ext='.parquet', max_entries=3)
+    """
+
+    digest_length = 16
+
+    def __init__(self, file_pattern='{task.task_family}', ext='.txt', target_class=LocalTarget,
+                 max_entries=3, max_bytes=None, **target_kwargs):
+        super().__init__(file_pattern=file_pattern, ext=ext, target_class=target_class, **target_kwargs)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def __call__(self, task):
+        path = '{}-{}{}'.format(self.stem(task), task_digest(task)[:self.digest_length], self.ext)
+        return self.target_class(path, **self.target_kwargs)
+
+    def touch(self, task):
+        """Mark the entry of the task as recently used"""
+        path = self(task).path
+        if os.path.exists(path):
+            os.utime(path)
+
+    def evict(self, task):
+        """Remove the least recently used entries of the task beyond the limits"""
+        current = self(task).path
+        pattern = '{}-{}{}'.format(self.stem(task), '?' * self.digest_length, self.ext)
+        entries = sorted(glob(pattern), key=os.path.getmtime, reverse=True)
+        count, size = 0, 0
+        for path in entries:
+            count += 1
+            size += _entry_size(path)
+            over = (self.max_entries is not None and count > self.max_entries) or \
+                (self.max_bytes is not None and size > self.max_bytes)
+            if over and path != current:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                # Files saved next to the entry, ex: a manifest or a profile
+                stem = os.path.splitext(path)[0]
+                for sidecar in glob(escape(stem) + '-*') + glob(escape(path) + '.*'):
+                    os.remove(sidecar)
+
+
+def _entry_size(path):
+    # An entry appended to by incremental runs is a directory of part files
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+@Task.event_handler(Event.DEPENDENCY_PRESENT)
+def _touch_cached_outputs(task):
+    output = getattr(type(task), 'output', None)
+    if isinstance(output, CachedTargetOutput):
+        output.touch(task)
+
+
+@Task.event_handler(Event.SUCCESS)
+def _evict_cached_outputs(task):
+    output = getattr(type(task), 'output', None)
+    if isinstance(output, CachedTargetOutput):
+        output.touch(task)
+        output.evict(task)
@@ -0,0 +1,306 @@
+"""
+Module that contains the prediction server, a local HTTP service scoring
+records with a model saved by the TrainModel task.
+
+Concurrent requests are grouped into micro batches, so the preprocessing
+chain and the model run once per batch instead of once per record::
+
+    machine-learning-utils-serve data/titanic.TrainTModel-<digest>.joblib --port 8000
+    curl -d '{"sex": "male", "age": 22}' localhost:8000/predict
+    curl localhost:8000/metrics
+"""
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """Thread safe request counters, latency percentiles are computed over
+    the last ``window`` requests"""
+
+    def __init__(self, window=10000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.batches = 0
+        self.batched_records = 0
+        self.errors = 0
+
+    def record(self, latency):
+        """Record the latency of one request in seconds"""
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(latency)
+
+    def record_batch(self, size):
+        with self._lock:
+            self.batches += 1
+            self.batched_records += size
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        """Returns the counters as a JSON serializable dictionary, latencies
+        are given in milliseconds"""
+        import numpy as np
+
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            elapsed = time.perf_counter() - self.started
+            p50, p99 = (
+                np.percentile(latencies, [50, 99]) if len(latencies) else (0.0, 0.0)
+            )
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": self.batches,
+                "mean_batch_size": self.batched_records / max(self.batches, 1),
+                "throughput": self.requests / elapsed if elapsed else 0.0,
+                "latency_p50_ms": float(p50),
+                "latency_p99_ms": float(p99),
+            }
+
+
+class MicroBatcher:
+    """Group records submitted by concurrent threads into batches
+
+    A batch is sent to ``predict`` once ``max_batch_size`` records are
+    waiting, or ``max_latency`` seconds after its first record arrived. When
+    ``predict`` fails on a batch, its records are predicted one at a time,
+    so a malformed record only fails its own request.
+    :param predict: Function from a list of records to a list of results
+    :param max_batch_size: Maximum number of records per batch
+    :param max_latency: Maximum number of seconds a record waits for a batch
+    :param stats: Optional LatencyStats counting the batches
+    """
+
+    def __init__(self, predict, max_batch_size=64, max_latency=0.005, stats=None):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.stats = stats
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        """Queue a record for the next batch
+        :returns Future of the result of the record"""
+        future = Future()
+        self._queue.put((record, future))
+        return future
+
+    def close(self):
+        """Stop the batching thread once the queued records are processed"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = (
+                    self._queue.get(timeout=timeout)
+                    if timeout > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish the current batch before stopping
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            records = [record for record, _ in batch]
+            try:
+                results = self.predict(records)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                for item in batch:
+                    self._predict_alone(*item)
+                continue
+            if self.stats is not None:
+                self.stats.record_batch(len(batch))
+            self._set_results(batch, results)
+
+    def _predict_alone(self, record, future):
+        try:
+            results = self.predict([record])
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if self.stats is not None:
+            self.stats.record_batch(1)
+        self._set_results([(record, future)], results)
+
+    @staticmethod
+    def _set_results(batch, results):
+        results = list(results)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+        # A predict function returning fewer results must not leave
+        # requests waiting forever
+        for _, future in batch[len(results) :]:
+            future.set_exception(
+                RuntimeError(
+                    "predict returned {} results for {} records".format(
+                        len(results), len(batch)
+                    )
+                )
+            )
+
+
+class Predictor:
+    """Score records with a model saved by functions.scoring.save_model, the
+    model and its fitted transforms are loaded once
+    :param model_path: Path of the joblib file
+    """
+
+    def __init__(self, model_path):
+        # Imported here so the server answers --help without loading pandas
+        from machine_learning_utils.functions.scoring import load_model
+
+        self.bundle = load_model(model_path)
+
+    def __call__(self, records):
+        """Score a batch of records with one vectorized model call
+        :param records: List of dictionaries of raw column values
+        :returns list of dictionaries with the prediction and probabilities"""
+        import pandas as pd
+        from machine_learning_utils.functions.scoring import score_frame
+
+        df = pd.DataFrame.from_records(records)
+        return score_frame(self.bundle, df).to_dict("records")
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """POST /predict with a JSON record or list of records, GET /metrics"""
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(200, self.server.stats.snapshot())
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "Unknown path {}".format(self.path)})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send_json(404, {"error": "Unknown path {}".format(self.path)})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            records = body if isinstance(body, list) else [body]
+            if not all(isinstance(record, dict) for record in records):
+                raise ValueError("Expected a JSON object or a list of objects")
+        except ValueError as e:
+            # Malformed request
+            self.server.stats.record_error()
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            futures = [self.server.batcher.submit(record) for record in records]
+            results = [future.result() for future in futures]
+        except Exception as e:
+            self.server.stats.record_error()
+            self._send_json(500, {"error": str(e)})
+            return
+        self.server.stats.record(time.perf_counter() - start)
+        self._send_json(200, results if isinstance(body, list) else results[0])
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """HTTP server answering each request in a thread, the records of
+    concurrent requests are scored together by a :class:`MicroBatcher`
+    :param address: (host, port) tuple, port 0 picks a free port
+    :param predict: Function from a list of records to a list of results,
+        ex: a :class:`Predictor`
+    :param max_batch_size: Maximum number of records per batch
+    :param max_latency: Maximum number of seconds a record waits for a batch
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, predict, max_batch_size=64, max_latency=0.005):
+        super().__init__(address, PredictionHandler)
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(
+            predict,
+            max_batch_size=max_batch_size,
+            max_latency=max_latency,
+            stats=self.stats,
+        )
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="machine-learning-utils-serve",
+        description="Serve predictions of a model saved by TrainModel",
+    )
+    parser.add_argument("model", help="Path of the joblib file of the model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument(
+        "--max-latency-ms",
+        type=float,
+        default=5.0,
+        help="Maximum time a request waits for other requests to batch with",
+    )
+    args = parser.parse_args(args)
+
+    server = PredictionServer(
+        (args.host, args.port),
+        Predictor(args.model),
+        max_batch_size=args.max_batch_size,
+        max_latency=args.max_latency_ms / 1000,
+    )
+    logger.info("Serving %s on %s:%s", args.model, *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
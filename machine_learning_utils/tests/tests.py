@@ -1,14 +1,95 @@
 import os
+import sys
+import pickle
 import shutil
+import time
+import io
+import json
+import pstats
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
 import pandas as pd
 import numpy as np
-from luigi import Parameter, build
+import pyarrow as pa
+import pyarrow.parquet as pq
+import luigi
+from luigi import Task, Parameter, IntParameter, build
 from unittest import TestCase
 from sklearn.datasets import load_breast_cancer
 from sklearn.ensemble import RandomForestClassifier
-from machine_learning_utils.functions.functions import eval_classifier, encode_onehot, impute_data
-from machine_learning_utils.luigi.task import Requirement
-from machine_learning_utils.luigi.data import DownloadData, DataPreprocess, BuildModel
+from machine_learning_utils.functions.functions import (
+    eval_classifier,
+    eval_classifiers,
+    encode_onehot,
+    extract_pattern,
+    impute_data,
+    iter_jobs,
+    load_models,
+    map_categories,
+    run_jobs,
+    threshold_flags,
+)
+from machine_learning_utils.functions.ingest import (
+    SchemaOptimizer,
+    append_part,
+    dataset_parts,
+)
+from machine_learning_utils.functions.scoring import load_model, save_model
+from machine_learning_utils.functions.shared import SharedArray
+from machine_learning_utils.functions.sparse import (
+    frame_to_matrix,
+    load_sparse_frame,
+    save_sparse_frame,
+)
+from machine_learning_utils.functions.transforms import (
+    Apply,
+    Deduplicate,
+    DropColumns,
+    FilterRows,
+    HashSet,
+    Imputer,
+    OneHotEncoder,
+    Replace,
+    apply_chain,
+    fit_chain,
+    fit_transform_chain,
+    load_chain,
+    save_chain,
+    update_chain,
+)
+from machine_learning_utils.examples.breast_cancer import valid_age
+from machine_learning_utils.examples.titanic import engineer_features
+from machine_learning_utils.luigi.instrument import read_records
+from machine_learning_utils.luigi.profiling import StackSampler
+from machine_learning_utils.luigi.target import ParquetTarget, frame_cache, read_frame
+from machine_learning_utils.luigi.task import (
+    Requirement,
+    CachedTargetOutput,
+    _code_version,
+    requirement_names,
+    source_modules,
+    task_digest,
+)
+from machine_learning_utils.functions.tuning import (
+    best_candidates,
+    expand_search,
+    successive_halving,
+)
+from machine_learning_utils.cli import load_task, main, print_dag
+from machine_learning_utils.server import MicroBatcher, Predictor, PredictionServer
+from machine_learning_utils.luigi.data import (
+    DownloadData,
+    DataPreprocess,
+    BuildModel,
+    TrainModel,
+    TuneModel,
+    ScoreData,
+    DownloadPartition,
+    PartitionedBuildModel,
+)
 
 
 def generate_data():
@@ -34,11 +115,93 @@ class MockDataPreprocess(DataPreprocess):
         df.to_parquet(self.output().path, engine="pyarrow")
 
 
+class MockChainPreprocess(DataPreprocess):
+    download = Requirement(MockDownloadData)
+
+    def transforms(self):
+        return [Deduplicate(), Imputer()]
+
+
+class MockCachedTask(Task):
+    value = IntParameter()
+    output = CachedTargetOutput(ext=".txt", max_entries=2)
+
+    def run(self):
+        with self.output().open("w") as f:
+            f.write(str(self.value))
+
+
 class MockBuildModel(BuildModel):
     preprocess = Requirement(MockDataPreprocess)
     class_column = Parameter(default="target")
 
 
+class MockTrainModel(TrainModel):
+    preprocess = Requirement(MockChainPreprocess)
+    class_column = Parameter(default="target")
+    models = [
+        {
+            "name": "rf",
+            "estimator": "sklearn.ensemble.RandomForestClassifier",
+            "params": {"n_estimators": 10, "random_state": 0},
+        }
+    ]
+
+
+class MockIncrementalTrainModel(TrainModel):
+    preprocess = Requirement(MockChainPreprocess)
+    class_column = Parameter(default="target")
+    model = Parameter(default="sgd")
+    models = [
+        {
+            "name": "sgd",
+            "estimator": "sklearn.linear_model.SGDClassifier",
+            "params": {"random_state": 0},
+        }
+    ]
+
+
+class MockTuneModel(TuneModel):
+    preprocess = Requirement(MockDataPreprocess)
+    class_column = Parameter(default="target")
+    search = [
+        {
+            "name": "rf",
+            "estimator": "sklearn.ensemble.RandomForestClassifier",
+            "params": {"n_estimators": 5, "random_state": 0},
+            "space": {"max_depth": [1, 2, 4, 8]},
+        }
+    ]
+
+
+class MockScoreData(ScoreData):
+    train = Requirement(MockTrainModel)
+    SCORE_DATA = Parameter(default="data/data.parquet")
+    keep_columns = ["Unnamed: 0"]
+
+
+class MockDownloadPartition(DownloadPartition):
+    DATA = Parameter(default="data/segments")
+
+
+class MockPartitionPreprocess(DataPreprocess):
+    download = Requirement(MockDownloadPartition)
+
+    def transforms(self):
+        return [Imputer()]
+
+
+class MockPartitionBuildModel(BuildModel):
+    preprocess = Requirement(MockPartitionPreprocess)
+    class_column = Parameter(default="target")
+    models = MockTrainModel.models
+
+
+class MockPartitionedBuildModel(PartitionedBuildModel):
+    DATA = Parameter(default="data/segments")
+    build_class = MockPartitionBuildModel
+
+
 class EvalClassifierTest(TestCase):
     def test_classifier(self):
         data = load_breast_cancer()
@@ -51,8 +214,188 @@ class EvalClassifierTest(TestCase):
             X,
             y,
         )
-        self.assertEqual(df.shape[0], 4),
-        self.assertEqual(df.shape[1], 5)
+        # 5 labels (0, 1, accuracy, macro avg, weighted avg) x 4 metrics
+        self.assertEqual(df.shape[0], 20)
+        # mean, std and one column per fold
+        self.assertEqual(df.shape[1], 12)
+        self.assertEqual(list(df.columns[:3]), ["mean", "std", "fold_0"])
+
+    def test_backends_agree(self):
+        data = load_breast_cancer()
+        X = data.data
+        y = data.target
+        clf = RandomForestClassifier(n_estimators=10, max_depth=3, random_state=0)
+        serial = eval_classifier(clf, X, y, n_splits=3)
+        threaded = eval_classifier(clf, X, y, n_splits=3, backend="thread", n_jobs=3)
+        pd.testing.assert_frame_equal(serial, threaded)
+
+    def test_run_jobs(self):
+        jobs = [(pow, (i, 2)) for i in range(5)]
+        self.assertEqual(run_jobs(jobs, backend="process", n_jobs=2), [0, 1, 4, 9, 16])
+        with self.assertRaises(ValueError):
+            run_jobs(jobs, backend="gpu")
+
+    def test_iter_jobs_bounded(self):
+        submitted = []
+
+        def jobs():
+            for i in range(10):
+                submitted.append(i)
+                yield pow, (i, 2)
+
+        results = iter_jobs(jobs(), backend="thread", n_jobs=2, max_pending=3)
+        self.assertEqual(next(results), 0)
+        # Jobs are only submitted as the results are consumed
+        self.assertEqual(len(submitted), 3)
+        self.assertEqual(list(results), [i**2 for i in range(1, 10)])
+
+
+class ModelRegistryTest(TestCase):
+    def test_load_models(self):
+        clfs = load_models(
+            [
+                {"name": "rf", "estimator": "sklearn.ensemble.RandomForestClassifier"},
+                {"estimator": "sklearn.svm.SVC", "params": {"C": 2}},
+            ]
+        )
+        self.assertEqual(list(clfs), ["rf", "SVC"])
+        self.assertEqual(clfs["SVC"].C, 2)
+
+    def test_duplicate_names(self):
+        # Two unnamed entries of one estimator would silently collapse
+        specs = [
+            {"estimator": "sklearn.svm.SVC", "params": {"C": 2}},
+            {"estimator": "sklearn.svm.SVC", "params": {"C": 4}},
+        ]
+        with self.assertRaises(ValueError):
+            load_models(specs)
+        specs[1]["name"] = "svc_c4"
+        self.assertEqual(list(load_models(specs)), ["SVC", "svc_c4"])
+
+    def test_eval_classifiers(self):
+        data = load_breast_cancer()
+        clfs = {
+            "rf": RandomForestClassifier(n_estimators=10, random_state=0),
+            "rf_shallow": RandomForestClassifier(
+                n_estimators=10, max_depth=2, random_state=0
+            ),
+        }
+        df = eval_classifiers(
+            clfs, data.data, data.target, n_splits=3, backend="thread", n_jobs=4
+        )
+        self.assertEqual(list(df.index.names), ["model", "label", "metric"])
+        self.assertEqual(list(df.index.unique("model")), ["rf", "rf_shallow"])
+        pd.testing.assert_frame_equal(
+            df.xs("rf"), eval_classifier(clfs["rf"], data.data, data.target, n_splits=3)
+        )
+
+
+class TuningTest(TestCase):
+    def test_expand_search(self):
+        candidates = expand_search(
+            [
+                {
+                    "estimator": "sklearn.svm.SVC",
+                    "params": {"kernel": "rbf"},
+                    "space": {"C": [1, 2], "gamma": [0.1, 1]},
+                }
+            ]
+        )
+        self.assertEqual(len(candidates), 4)
+        self.assertEqual(candidates[0]["name"], "SVC")
+        self.assertEqual(
+            candidates[0]["params"], {"kernel": "rbf", "C": 1, "gamma": 0.1}
+        )
+
+    def test_successive_halving(self):
+        data = load_breast_cancer()
+        candidates = expand_search(
+            [
+                {
+                    "name": "rf",
+                    "estimator": "sklearn.ensemble.RandomForestClassifier",
+                    "params": {"n_estimators": 5, "random_state": 0},
+                    "space": {"max_depth": [1, 2, 3, 4, 5, 6, 7, 8, 9]},
+                }
+            ]
+        )
+        trial_log = os.path.join(tempfile.mkdtemp(), "trials.jsonl")
+        results = successive_halving(
+            candidates, data.data, data.target, trial_log=trial_log
+        )
+
+        # 9 candidates x 1 fold, 3 x 3 folds, 1 x 9 folds instead of 81 fits
+        with open(trial_log) as f:
+            self.assertEqual(len(f.readlines()), 9 + 6 + 6)
+        self.assertEqual(list(results["folds"]), [9, 3, 3] + [1] * 6)
+        (best,) = best_candidates(candidates, results)
+        self.assertEqual(best["params"], results["params"][0])
+
+        # A resumed search reuses the logged trials
+        resumed = successive_halving(
+            candidates, data.data, data.target, trial_log=trial_log
+        )
+        with open(trial_log) as f:
+            self.assertEqual(len(f.readlines()), 21)
+        pd.testing.assert_frame_equal(resumed, results)
+        shutil.rmtree(os.path.dirname(trial_log))
+
+    def test_successive_halving_eta(self):
+        data = load_breast_cancer()
+        candidates = expand_search(
+            [{"estimator": "sklearn.tree.DecisionTreeClassifier", "params": {}}]
+        )
+        with self.assertRaises(ValueError):
+            successive_halving(candidates, data.data, data.target, eta=1)
+
+
+class SharedArrayTest(TestCase):
+    def test_pickle_attaches_by_name(self):
+        arr = np.arange(12, dtype=np.float64).reshape(4, 3)
+        with SharedArray.from_array(arr) as shared:
+            attached = pickle.loads(pickle.dumps(shared))
+            np.testing.assert_array_equal(attached[[0, 2]], arr[[0, 2]])
+
+            # Writes through one handle are visible through the other
+            shared.array[0, 0] = 100
+            self.assertEqual(attached[0, 0], 100)
+            attached.close()
+
+    def test_from_frame(self):
+        df = pd.DataFrame({"a": [1, 2], "b": [0.5, 1.5], "c": ["x", "y"]})
+        with SharedArray.from_frame(df, columns=["a", "b"]) as shared:
+            self.assertEqual(shared.shape, (2, 2))
+            self.assertEqual(shared.dtype, np.float64)
+            np.testing.assert_array_equal(shared.array, [[1, 0.5], [2, 1.5]])
+
+    def test_eval_classifier_process(self):
+        data = load_breast_cancer()
+        clf = RandomForestClassifier(n_estimators=10, max_depth=3, random_state=0)
+        expected = eval_classifier(clf, data.data, data.target, n_splits=3)
+        with SharedArray.from_array(data.data) as X:
+            df = eval_classifier(
+                clf, X, data.target, n_splits=3, backend="process", n_jobs=3
+            )
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_workers_keep_registration(self):
+        # The workers share the resource tracker of the creating process
+        code = (
+            "import numpy as np\n"
+            "from machine_learning_utils.functions.functions import run_jobs\n"
+            "from machine_learning_utils.functions.shared import SharedArray\n"
+            "with SharedArray.from_array(np.ones((4, 2))) as X:\n"
+            "    jobs = [(np.sum, (X,))] * 4\n"
+            "    for backend in ('process', 'loky'):\n"
+            "        print(run_jobs(jobs, backend=backend, n_jobs=2))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines(), ["[8.0, 8.0, 8.0, 8.0]"] * 2)
+        self.assertNotIn("KeyError", result.stderr)
+        self.assertNotIn("leaked", result.stderr)
 
 
 class EncodeOnehotTest(TestCase):
@@ -92,6 +435,543 @@ class ImputeDataTest(TestCase):
         # Check that na value in animals column have been replaced with correct value
         self.assertEqual(df["animals"][2], "dog")
 
+    def test_impute_category(self):
+        df = pd.DataFrame({"animals": pd.Categorical([None, None, "cat", "cat"])})
+        impute_data(df, columns=["animals"])
+        self.assertEqual(df["animals"].tolist(), ["cat"] * 4)
+
+
+class TransformsTest(TestCase):
+    data = {
+        "animals": ["dog", "cat", None, "dog", "dog", "snake", "cat"],
+        "numbers": [1, 2, np.nan, 4, 1, 8, np.nan],
+    }
+
+    def batches(self):
+        df = pd.DataFrame(self.data)
+        return [df.iloc[:3], df.iloc[3:5], df.iloc[5:]]
+
+    def test_batches_match_in_memory(self):
+        expected = fit_transform_chain(
+            [Deduplicate(), Imputer(), OneHotEncoder()], pd.DataFrame(self.data)
+        )
+        chain = fit_chain([Deduplicate(), Imputer(), OneHotEncoder()], self.batches)
+        df = pd.concat(apply_chain(chain, self.batches()))
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_imputer_median(self):
+        imputer = fit_chain([Imputer()], self.batches)[0]
+        self.assertEqual(imputer.statistics_["numbers"], 2.0)
+        self.assertEqual(imputer.statistics_["animals"], "dog")
+
+    def test_imputer_save_load(self):
+        imputer = Imputer().fit(pd.DataFrame(self.data))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "imputer.json")
+            imputer.save(path)
+            loaded = Imputer.load(path)
+        self.assertEqual(loaded.statistics_, {"animals": "dog", "numbers": 2.0})
+        df = loaded.transform(pd.DataFrame({"animals": [None], "numbers": [np.nan]}))
+        self.assertEqual(df.iloc[0].tolist(), ["dog", 2.0])
+
+    def test_deduplicate_across_batches(self):
+        df = pd.concat(apply_chain([Deduplicate()], self.batches()))
+        self.assertEqual(len(df), 6)
+
+    def test_deduplicate_spill(self):
+        dedup = Deduplicate(subset=["animals"], max_entries=1)
+        df = pd.concat(apply_chain([dedup], self.batches()))
+        self.assertEqual(df["animals"].tolist(), ["dog", "cat", None, "snake"])
+        self.assertEqual(len(dedup.seen), 4)
+        self.assertGreater(len(dedup.seen._spilled), 0)
+        # Chains saved with the former name of the limit still load
+        state = {"subset": None, "max_memory": 5, "spill_dir": None}
+        self.assertEqual(Deduplicate.from_dict(state).seen.max_entries, 5)
+
+    def test_hash_set(self):
+        seen = HashSet(max_entries=3)
+        for batch in np.array_split(np.arange(10, dtype=np.uint64), 4):
+            seen.add(batch)
+        self.assertEqual(len(seen), 10)
+        mask = seen.contains(np.array([0, 9, 10, 2 ** 63], dtype=np.uint64))
+        self.assertEqual(mask.tolist(), [True, True, False, False])
+        seen.clear()
+        self.assertEqual(len(seen), 0)
+
+    def test_imputer_sketch(self):
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=100000)
+        imputer = Imputer(max_size=256)
+        for batch in np.array_split(values, 20):
+            imputer.partial_fit(pd.DataFrame({"x": batch}))
+        imputer.finish_fit()
+
+        self.assertLessEqual(len(imputer.sketches_["x"]), 256)
+        rank = np.searchsorted(np.sort(values), imputer.statistics_["x"])
+        self.assertLess(abs(rank / len(values) - 0.5), 0.005)
+
+        # Columns with few distinct values keep an exact median
+        imputer = Imputer(max_size=256)
+        imputer.partial_fit(pd.DataFrame(self.data))
+        imputer.partial_fit(pd.DataFrame({"numbers": [8, 8]})).finish_fit()
+        self.assertEqual(imputer.statistics_["numbers"], 4.0)
+
+        # Batches can follow a fit, which moves its exact median
+        imputer = Imputer(max_size=256).fit(pd.DataFrame(self.data))
+        self.assertEqual(imputer.statistics_["numbers"], 2.0)
+        imputer.partial_fit(pd.DataFrame({"numbers": [8, 8]})).finish_fit()
+        self.assertTrue(2.0 < imputer.statistics_["numbers"] < 8.0)
+        self.assertEqual(imputer.statistics_["animals"], "dog")
+
+    def test_imputer_bounded_counts(self):
+        # Batches of new values keep at most max_size counts per column, the
+        # frequent value is still the mode
+        imputer = Imputer(max_size=16)
+        for i in range(50):
+            ids = ["id-{}-{}".format(i, j) for j in range(100)]
+            imputer.partial_fit(pd.DataFrame({"ids": ids + ["frequent"] * 10}))
+            self.assertLessEqual(len(imputer.counts_["ids"]), 16)
+        imputer.finish_fit()
+        self.assertEqual(imputer.statistics_["ids"], "frequent")
+
+    def test_imputer_empty_category(self):
+        # A column without values has no fill value, no category is made up
+        df = pd.DataFrame(
+            {"animals": pd.Categorical([None, None], categories=["cat", "dog"])}
+        )
+        imputer = Imputer().fit(df)
+        self.assertNotIn("animals", imputer.statistics_)
+        df = imputer.transform(df)
+        self.assertEqual(df["animals"].cat.categories.tolist(), ["cat", "dog"])
+        self.assertTrue(df["animals"].isna().all())
+
+    def test_save_load_chain(self):
+        chain = [
+            Deduplicate(subset=["animals"]),
+            Replace({"animals": {"snake": "cat"}}),
+            Apply(engineer_features),
+            FilterRows(valid_age),
+            DropColumns(["numbers"]),
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "chain.json")
+            save_chain(chain, path)
+            loaded = load_chain(path)
+            with self.assertRaises(ValueError):
+                save_chain([Apply(lambda df: df)], path)
+
+        self.assertEqual([type(step) for step in loaded], [type(s) for s in chain])
+        self.assertIs(loaded[2].func, engineer_features)
+        self.assertEqual(loaded[0].subset, ["animals"])
+        self.assertEqual(loaded[1].mapping, {"animals": {"snake": "cat"}})
+
+    def test_update_chain(self):
+        first, second, third = self.batches()
+        chain = [Deduplicate(max_entries=1), Imputer(), OneHotEncoder(["animals"])]
+        update_chain(chain, pd.concat([first, second]))
+        # The chain is saved between the incremental runs
+        chain = pickle.loads(pickle.dumps(chain))
+        df = update_chain(chain, pd.concat([third, first]))
+
+        self.assertEqual(len(df), 2)
+        self.assertEqual(chain[1].statistics_["numbers"], 3.0)
+        self.assertEqual(df["animals - snake"].tolist(), [1, 0])
+        self.assertEqual(len(chain[0].seen), 6)
+
+    def test_onehot_vocabulary(self):
+        encoder = OneHotEncoder(["animals"]).fit(pd.DataFrame(self.data))
+        df = encoder.transform(pd.DataFrame({"animals": ["cat"], "numbers": [1]}))
+        self.assertEqual(
+            list(df.columns),
+            ["numbers", "animals - cat", "animals - dog", "animals - snake"],
+        )
+
+
+class OneHotEncoderTest(TestCase):
+    train = pd.DataFrame(
+        {"animals": ["dog", "cat", "dog"], "color": ["black", None, "pink"]}
+    )
+    score = pd.DataFrame(
+        {"animals": ["cat", "snake"], "color": ["pink", "pink"]}, index=[7, 8]
+    )
+
+    def test_transform(self):
+        df = OneHotEncoder().fit(self.train).transform(self.score)
+        expected = pd.DataFrame(
+            {
+                "animals - cat": [1, 0],
+                "animals - dog": [0, 0],
+                "color - black": [0, 0],
+                "color - pink": [1, 1],
+            },
+            index=[7, 8],
+            dtype="uint8",
+        )
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_sparse(self):
+        dense = OneHotEncoder().fit(self.train)
+        sparse = OneHotEncoder(sparse=True).fit(self.train)
+        np.testing.assert_array_equal(
+            sparse.transform_matrix(self.score).toarray(),
+            dense.transform_matrix(self.score),
+        )
+
+    def test_save_load(self):
+        encoder = OneHotEncoder(exclude=["color"]).fit(self.train)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "encoder.json")
+            encoder.save(path)
+            loaded = OneHotEncoder.load(path)
+        pd.testing.assert_frame_equal(
+            loaded.transform(self.score), encoder.transform(self.score)
+        )
+
+
+class SparseFrameTest(TestCase):
+    def frame(self):
+        df = OneHotEncoder(exclude=["label"], sparse=True).fit_transform(
+            pd.DataFrame({"animals": ["dog", "cat", "dog"], "label": ["a", "b", "a"]})
+        )
+        df["numbers"] = [1.5, 0, 2]
+        return df
+
+    def test_frame_to_matrix(self):
+        df = self.frame().drop(columns="label")
+        X = frame_to_matrix(df)
+        self.assertEqual(X.format, "csr")
+        np.testing.assert_array_equal(X.toarray(), [[0, 1, 1.5], [1, 0, 0], [0, 1, 2]])
+
+    def test_save_load(self):
+        df = self.frame()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "features.npz")
+            save_sparse_frame(df, path)
+            loaded = load_sparse_frame(path)
+        pd.testing.assert_frame_equal(loaded, df)
+
+
+class SchemaOptimizerTest(TestCase):
+    table = pa.table(
+        {
+            "count": [1, 2, 300, None],
+            "ratio": [0.5, 0.25, None, 2.0],
+            "price": [0.1, 0.2, 0.3, 0.4],
+            "color": ["red", "red", "blue", "red"],
+            "name": list("abcd"),
+        }
+    )
+
+    def test_narrow_types(self):
+        optimizer = SchemaOptimizer()
+        table = optimizer.fit_transform(self.table)
+
+        self.assertEqual(table.schema.field("count").type, pa.int16())
+        self.assertEqual(table.schema.field("ratio").type, pa.float32())
+        # 0.1 is not exact in float32, and every name is distinct
+        self.assertEqual(table.schema.field("price").type, pa.float64())
+        self.assertEqual(table.schema.field("name").type, pa.string())
+        df = table.to_pandas()
+        self.assertEqual(df["color"].dtype, "category")
+        pd.testing.assert_frame_equal(
+            df, self.table.to_pandas(), check_dtype=False, check_categorical=False
+        )
+        self.assertLess(
+            sum(optimizer.bytes_after_.values()), sum(optimizer.bytes_before_.values())
+        )
+
+    def test_partial_fit(self):
+        # The values of the second chunk no longer fit in int8
+        first, second = self.table.slice(0, 2), self.table.slice(2)
+        with self.assertRaises(ValueError):
+            SchemaOptimizer().fit(first).transform(second)
+
+        optimizer = SchemaOptimizer()
+        optimizer.partial_fit(first).partial_fit(second).finish_fit()
+        self.assertEqual(optimizer.types_, SchemaOptimizer().fit(self.table).types_)
+
+    def test_save_load(self):
+        optimizer = SchemaOptimizer()
+        expected = optimizer.fit_transform(self.table).schema
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "schema.json")
+            optimizer.save(path)
+            restored = SchemaOptimizer.load(path)
+        self.assertEqual(restored.types_, optimizer.types_)
+        self.assertTrue(restored.transform(self.table).schema.equals(expected))
+
+
+class AppendPartTest(TestCase):
+    def test_append_part(self):
+        table = pa.table({"age": [10, 30], "name": ["a", "b"]})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.parquet")
+            pq.write_table(table, path)
+            append_part(path, [table.select(["age"])])
+            # No tables at all still append an empty part of the same schema
+            part = append_part(path, [])
+            self.assertEqual(len(dataset_parts(path)), 3)
+            self.assertTrue(pq.read_schema(part).equals(table.schema))
+            self.assertEqual(pq.read_metadata(part).num_rows, 0)
+            df = pq.read_table(path).to_pandas()
+        self.assertEqual(df["age"].tolist(), [10, 30, 10, 30])
+        self.assertEqual(df["name"].tolist(), ["a", "b", None, None])
+
+
+class ParquetTargetTest(TestCase):
+    df = pd.DataFrame({"age": [10, 30, 50, 70], "name": list("abcd"), "x": 0})
+    filters = [("age", ">", 20), ("name", "!=", "c")]
+
+    def test_projection_and_filters(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            target = ParquetTarget(os.path.join(tmp_dir, "data.parquet"))
+            self.df.to_parquet(target.path, row_group_size=2)
+            df = target.read_frame(exclude=["x"], filters=self.filters)
+            batches = list(
+                target.iter_frames(1, columns=["age"], filters=[("age", "<", 40)])
+            )
+
+        self.assertEqual(list(df.columns), ["age", "name"])
+        self.assertEqual(df["age"].tolist(), [30, 70])
+        self.assertEqual([batch["age"].tolist() for batch in batches], [[10], [30]])
+
+    def test_cached_frame(self):
+        path = os.path.join("cached", "data.parquet")
+        frame_cache.put(path, pa.Table.from_pandas(self.df), max_bytes=1 << 20)
+        try:
+            df = ParquetTarget(path).read_frame(exclude=["x"], filters=self.filters)
+        finally:
+            frame_cache.discard(path)
+        self.assertEqual(df["age"].tolist(), [30, 70])
+        self.assertEqual(list(df.columns), ["age", "name"])
+
+    def test_cached_frame_copies(self):
+        config = luigi.configuration.get_config()
+        config.set("handoff", "enabled", "true")
+        df = self.df.copy()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            target = ParquetTarget(os.path.join(tmp_dir, "data.parquet"))
+            try:
+                target.write_frame(df)
+                # Neither the producer nor a reader modifies the cached frame
+                df.iloc[0, 0] = 99
+                first = target.read_frame()
+                first.iloc[1, 0] = 99
+                impute_data(first, ["age"])
+                second = target.read_frame()
+                (batch,) = target.iter_frames()
+                frame_cache.flush()
+                on_disk = pd.read_parquet(target.path, engine="pyarrow")
+            finally:
+                config.remove_option("handoff", "enabled")
+                frame_cache.discard(target.path)
+        pd.testing.assert_frame_equal(second, self.df)
+        pd.testing.assert_frame_equal(batch, self.df)
+        pd.testing.assert_frame_equal(on_disk, self.df)
+
+
+class RequiresTest(TestCase):
+    def test_requirements(self):
+        task = MockBuildModel()
+        requirements = task.requires()
+        self.assertEqual(list(requirements), ["preprocess"])
+        self.assertIsInstance(requirements["preprocess"], MockDataPreprocess)
+
+        # Requirement names are computed once per class and the cloned
+        # dependency is memoized on the instance
+        self.assertEqual(requirement_names(MockBuildModel), ("preprocess",))
+        self.assertIs(task.requires()["preprocess"], task.preprocess)
+        self.assertIn("preprocess", vars(task))
+
+
+class FeaturePrimitivesTest(TestCase):
+    def test_threshold_flags(self):
+        df = threshold_flags(
+            pd.Series([1, 3, 6]),
+            {"single": (1, 1), "small": (2, 4), "large": (5, None)},
+        )
+        self.assertEqual(df.values.tolist(), [[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        self.assertEqual(df["single"].dtype, "uint8")
+
+    def test_extract_pattern(self):
+        titles = extract_pattern(
+            pd.Series(["Allen, Miss. Elisabeth", "Smith, Dr. John", "Unknown"]),
+            r"^[^,]*,([^,.]*)",
+        )
+        self.assertEqual(titles.str.strip().tolist()[:2], ["Miss", "Dr"])
+        self.assertTrue(pd.isna(titles[2]))
+
+    def test_map_categories(self):
+        labels = map_categories(
+            pd.Series(["Mr", "Mlle", "Dr", None, "Sir", "Mr"]),
+            mapping={"Mlle": "Miss"},
+            rare=["Dr"],
+            min_count=2,
+        )
+        self.assertEqual(
+            labels[[0, 1, 2, 4, 5]].tolist(), ["Mr", "Miss", "Rare", "Rare", "Mr"]
+        )
+        self.assertTrue(pd.isna(labels[3]))
+
+
+class PredictionServerTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        df = generate_data()
+        self.features = [col for col in df.columns if col != "target"]
+        self.records = df[self.features].head(50).to_dict("records")
+        self.model = RandomForestClassifier(n_estimators=10, random_state=0)
+        self.model.fit(df[self.features].to_numpy(), df["target"].to_numpy())
+        self.model_path = os.path.join(self.tmp_dir, "model.joblib")
+        save_model(self.model_path, self.model, features=self.features)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_micro_batches(self):
+        batches = []
+
+        def predict(records):
+            batches.append(len(records))
+            return [record * 2 for record in records]
+
+        batcher = MicroBatcher(predict, max_batch_size=8, max_latency=0.05)
+        futures = [batcher.submit(i) for i in range(20)]
+        self.assertEqual([future.result() for future in futures], list(range(0, 40, 2)))
+        batcher.close()
+        self.assertEqual(batches, [8, 8, 4])
+
+    def test_batch_failures(self):
+        def predict(records):
+            if "bad" in records:
+                raise ValueError("bad record")
+            # Drops the last result of a batch of 3
+            return records[:2]
+
+        batcher = MicroBatcher(predict, max_batch_size=3, max_latency=0.05)
+        futures = [batcher.submit(record) for record in ["a", "bad", "c"]]
+        futures += [batcher.submit(record) for record in ["d", "e", "f"]]
+        self.assertEqual(futures[0].result(), "a")
+        self.assertEqual(futures[2].result(), "c")
+        with self.assertRaises(ValueError):
+            futures[1].result()
+        self.assertEqual([futures[3].result(), futures[4].result()], ["d", "e"])
+        with self.assertRaises(RuntimeError):
+            futures[5].result(timeout=5)
+        batcher.close()
+
+    def test_error_status(self):
+        def predict(records):
+            raise KeyError("missing column")
+
+        server = PredictionServer(("127.0.0.1", 0), predict, max_latency=0.001)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = "http://127.0.0.1:{}/predict".format(server.server_address[1])
+        codes = []
+        try:
+            for data in [b"{not json", b"[1, 2]", b'{"age": 1}']:
+                request = urllib.request.Request(url, data=data)
+                with self.assertRaises(urllib.error.HTTPError) as context:
+                    urllib.request.urlopen(request)
+                codes.append(context.exception.code)
+                context.exception.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(codes, [400, 400, 500])
+
+    def test_predict(self):
+        server = PredictionServer(
+            ("127.0.0.1", 0), Predictor(self.model_path), max_latency=0.01
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = "http://127.0.0.1:{}".format(server.server_address[1])
+
+        def post(record):
+            request = urllib.request.Request(
+                url + "/predict", data=json.dumps(record).encode()
+            )
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)
+
+        try:
+            results = run_jobs(
+                [(post, (record,)) for record in self.records],
+                backend="thread",
+                n_jobs=8,
+            )
+            with urllib.request.urlopen(url + "/metrics") as response:
+                metrics = json.load(response)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        X = pd.DataFrame(self.records).to_numpy()
+        self.assertEqual(
+            [result["prediction"] for result in results],
+            self.model.predict(X).tolist(),
+        )
+        np.testing.assert_allclose(
+            [result["probability_1"] for result in results],
+            self.model.predict_proba(X)[:, 1],
+        )
+        self.assertEqual(metrics["requests"], len(self.records))
+        self.assertLess(metrics["batches"], len(self.records))
+        self.assertGreaterEqual(metrics["latency_p99_ms"], metrics["latency_p50_ms"])
+
+
+class StackSamplerTest(TestCase):
+    def test_collapsed_stacks(self):
+        def busy():
+            end = time.perf_counter() + 0.1
+            while time.perf_counter() < end:
+                pass
+
+        sampler = StackSampler(interval=0.001).start()
+        busy()
+        sampler.stop()
+        path = os.path.join(tempfile.mkdtemp(), "run.collapsed")
+        sampler.write(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        shutil.rmtree(os.path.dirname(path))
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertIn("tests.py:busy", stack.split(";"))
+        self.assertGreater(int(count), 0)
+
+
+class LazyImportTest(TestCase):
+    def loaded_modules(self, code):
+        """Top level modules loaded by running code in a fresh interpreter"""
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                code + "; import sys; print(' '.join(sorted(sys.modules)))",
+            ],
+            text=True,
+        )
+        return {name.partition(".")[0] for name in output.split()}
+
+    def test_cli(self):
+        modules = self.loaded_modules(
+            "import machine_learning_utils.cli, machine_learning_utils.server"
+        )
+        for name in ("luigi", "pandas", "numpy", "sklearn", "pkg_resources"):
+            self.assertNotIn(name, modules)
+
+    def test_task_definitions(self):
+        modules = self.loaded_modules(
+            "from machine_learning_utils.examples.titanic import BuildTModel; "
+            "BuildTModel().requires()"
+        )
+        self.assertIn("luigi", modules)
+        for name in ("sklearn", "scipy", "joblib", "pkg_resources"):
+            self.assertNotIn(name, modules)
+
 
 class LuigiWorkflowTests(TestCase):
     filename = "test_data.csv"
@@ -123,6 +1003,172 @@ class LuigiWorkflowTests(TestCase):
 
         self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "data.parquet")))
 
+    def test_download_chunked(self):
+        task = MockDownloadData(chunksize=100, row_group_size=50)
+
+        build([task], local_scheduler=True)
+
+        expected = pd.read_csv(os.path.join(self.tmp_dir, self.filename))
+        df = pd.read_parquet(task.output().path, engine="pyarrow")
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertEqual(pq.ParquetFile(task.output().path).num_row_groups, 12)
+
+    def test_download_chunked_drift(self):
+        # Types inferred from the first chunk do not hold for the next ones
+        path = os.path.join(self.tmp_dir, "drift.csv")
+        pd.DataFrame(
+            {
+                "id": range(20),
+                "note": [None] * 5 + ["x"] * 15,
+                "value": list(range(5)) + [0.5] * 15,
+            }
+        ).to_csv(path, index=False)
+        task = MockDownloadData(
+            DATA=path, SHARED_RELATIVE_PATH="drift.parquet", chunksize=5
+        )
+
+        build([task], local_scheduler=True)
+
+        df = pd.read_parquet(task.output().path, engine="pyarrow")
+        pd.testing.assert_frame_equal(df, pd.read_csv(path))
+        self.assertEqual(pq.ParquetFile(task.output().path).num_row_groups, 4)
+
+    def test_download_pyarrow(self):
+        task = MockDownloadData(csv_engine="pyarrow")
+
+        build([task], local_scheduler=True)
+
+        df = pd.read_parquet(task.output().path, engine="pyarrow")
+        self.assertEqual(df.shape, generate_data().reset_index().shape)
+
+    def test_download_optimize_dtypes(self):
+        task = MockDownloadData(optimize_dtypes=True, chunksize=100)
+
+        build([task], local_scheduler=True)
+
+        expected = pd.read_csv(os.path.join(self.tmp_dir, self.filename))
+        df = pd.read_parquet(task.output().path, engine="pyarrow")
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+        self.assertEqual(df["target"].dtype, "int8")
+        self.assertTrue(task.schema().exists())
+
+        # The next download reuses the saved types
+        os.remove(task.output().path)
+        optimizer = task.schema_optimizer()
+        self.assertEqual(optimizer.types_["target"], pa.int8())
+        build([MockDownloadData(optimize_dtypes=True)], local_scheduler=True)
+        df = pd.read_parquet(task.output().path, engine="pyarrow")
+        self.assertEqual(df["target"].dtype, "int8")
+
+    def test_download_incremental(self):
+        task = MockDownloadData(incremental=True)
+        build([task], local_scheduler=True)
+        self.assertTrue(task.complete())
+        self.assertEqual(task.read_manifest()["version"], 1)
+        self.assertTrue(task.read_manifest()["full"])
+        inode = os.stat(task.output().path).st_ino
+
+        # Rows appended to the source file are ingested alone, as a new part
+        path = os.path.join(self.tmp_dir, self.filename)
+        df = generate_data()
+        df.index += len(df)
+        df.iloc[:10].to_csv(path, mode="a", header=False)
+        self.assertFalse(task.complete())
+        build([task], local_scheduler=True)
+
+        manifest = task.read_manifest()
+        self.assertEqual(manifest["version"], 2)
+        self.assertFalse(manifest["full"])
+        self.assertEqual(len(read_frame(task.delta())), 10)
+        expected = pd.read_csv(path)
+        pd.testing.assert_frame_equal(read_frame(task.output()), expected)
+        # The rows of the first run were moved, not rewritten
+        parts = dataset_parts(task.output().path)
+        self.assertEqual([os.path.basename(part) for part in parts], manifest["parts"])
+        self.assertEqual(os.stat(parts[0]).st_ino, inode)
+
+        # A part left by an interrupted run is dropped by the next one
+        df.iloc[10:15].to_csv(path, mode="a", header=False)
+        shutil.copy(parts[1], os.path.join(task.output().path, "part-00002.parquet"))
+        build([task], local_scheduler=True)
+        self.assertEqual(task.read_manifest()["parts"][-1], "part-00002.parquet")
+        self.assertEqual(len(read_frame(task.delta())), 5)
+        self.assertEqual(len(read_frame(task.output())), len(expected) + 5)
+
+        # A rewritten source file is downloaded again
+        expected.iloc[:20].to_csv(path, index=False)
+        build([task], local_scheduler=True)
+        self.assertTrue(task.read_manifest()["full"])
+        self.assertTrue(os.path.isfile(task.output().path))
+        self.assertEqual(len(read_frame(task.output())), 20)
+
+    def test_download_glob(self):
+        for i in range(2):
+            generate_data().to_csv(os.path.join(self.tmp_dir, "part{}.csv".format(i)))
+        task = MockDownloadData(DATA=os.path.join(self.tmp_dir, "part*.csv"))
+        key = task.cache_key()
+        self.assertEqual(len(key), 2)
+        build([task], local_scheduler=True)
+        self.assertTrue(task.complete())
+
+        # A change of any matched file makes the download stale
+        path = os.path.join(self.tmp_dir, "part1.csv")
+        generate_data().iloc[:10].to_csv(path)
+        mtime = os.path.getmtime(task.output().path) + 1
+        os.utime(path, (mtime, mtime))
+        self.assertNotEqual(task.cache_key(), key)
+        self.assertFalse(task.complete())
+
+    def test_preprocess_incremental_run(self):
+        # A subclass overriding run has its runs recorded as full ones
+        task = MockDataPreprocess(incremental=True)
+        build([task], local_scheduler=True)
+        self.assertTrue(task.complete())
+        self.assertEqual(task.read_manifest()["version"], 1)
+        self.assertTrue(task.read_manifest()["full"])
+
+    def test_preprocess_incremental_out_of_core(self):
+        expected = MockChainPreprocess()
+        task = MockChainPreprocess(incremental=True, out_of_core=True, batch_size=50)
+        build([expected], local_scheduler=True)
+        build([task], local_scheduler=True)
+
+        self.assertTrue(task.read_manifest()["full"])
+        pd.testing.assert_frame_equal(
+            read_frame(task.output()), read_frame(expected.output())
+        )
+
+    def test_train_incremental(self):
+        task = MockIncrementalTrainModel(incremental=True)
+        build([task], local_scheduler=True)
+        self.assertTrue(task.complete())
+        preprocess = task.requires()["preprocess"]
+        self.assertTrue(preprocess.read_manifest()["full"])
+        self.assertTrue(task.read_manifest()["full"])
+
+        # Duplicates of earlier rows are dropped from the delta
+        path = os.path.join(self.tmp_dir, self.filename)
+        df = generate_data()
+        df.index += len(df)
+        new = df.iloc[:20].copy()
+        new.iloc[10:, 1:] = new.iloc[:10, 1:].to_numpy()
+        new.iloc[:10].to_csv(path, mode="a", header=False)
+        build([task], local_scheduler=True)
+        new.iloc[10:].to_csv(path, mode="a", header=False)
+        self.assertFalse(task.complete())
+        build([task], local_scheduler=True)
+
+        self.assertTrue(task.complete())
+        self.assertEqual(preprocess.read_manifest()["version"], 3)
+        self.assertFalse(preprocess.read_manifest()["full"])
+        self.assertEqual(len(read_frame(preprocess.delta())), 10)
+        self.assertEqual(len(read_frame(preprocess.output())), len(df) + 20)
+        manifest = task.read_manifest()
+        self.assertEqual(manifest["version"], 3)
+        self.assertFalse(manifest["full"])
+        bundle = load_model(task.output().path)
+        self.assertEqual(len(bundle["transforms"]), 1)
+
     def test_preprocess(self):
         task = MockDataPreprocess()
 
@@ -130,8 +1176,84 @@ class LuigiWorkflowTests(TestCase):
 
         self.assertTrue(task.complete())
 
-        self.assertTrue(
-            os.path.exists(os.path.join(self.tmp_dir, "MockDataPreprocess.parquet"))
+        self.assertTrue(os.path.exists(task.output().path))
+        self.assertTrue(task.output().path.startswith("data/MockDataPreprocess-"))
+
+    def test_preprocess_out_of_core(self):
+        expected = MockChainPreprocess()
+        task = MockChainPreprocess(out_of_core=True, batch_size=50)
+
+        build([expected], local_scheduler=True)
+        df = pd.read_parquet(expected.output().path, engine="pyarrow")
+        os.remove(expected.output().path)
+        build([task], local_scheduler=True)
+
+        self.assertTrue(task.complete())
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(task.output().path, engine="pyarrow"), df
+        )
+
+    def test_cached_output(self):
+        tasks = [MockCachedTask(value=i) for i in range(3)]
+        paths = [task.output().path for task in tasks]
+        self.assertEqual(len(set(paths)), 3)
+        self.assertTrue(paths[0].startswith("data/MockCachedTask-"))
+
+        for i, task in enumerate(tasks):
+            build([task], local_scheduler=True)
+            os.utime(paths[i], (i, i))
+            if i == 0:
+                # Files saved next to an entry are evicted with it
+                sidecar = paths[0][: -len(".txt")] + "-state.json"
+                open(sidecar, "w").close()
+
+        # Only the two most recently used entries are kept
+        self.assertEqual([os.path.exists(path) for path in paths], [False, True, True])
+        self.assertFalse(os.path.exists(sidecar))
+        self.assertTrue(tasks[2].complete())
+
+        # Looking the output up does not use the entry, scheduling it does
+        tasks[1].output()
+        self.assertEqual(os.path.getmtime(paths[1]), 1)
+        build([tasks[1]], local_scheduler=True)
+        self.assertGreater(os.path.getmtime(paths[1]), 1)
+
+    def test_code_version(self):
+        task = MockChainPreprocess()
+        modules = source_modules(type(task))
+        # The modules of the functions called by run() version the task
+        self.assertIn("machine_learning_utils.functions.transforms", modules)
+        self.assertNotIn("machine_learning_utils.functions.tuning", modules)
+        # Another task of the same module has its own code version
+        self.assertNotEqual(
+            _code_version(MockChainPreprocess), _code_version(MockDataPreprocess)
+        )
+        self.assertEqual(
+            source_modules(MockChainPreprocess), source_modules(MockDataPreprocess)
+        )
+
+        digest = task_digest(task)
+        self.assertEqual(vars(task)["_task_digest"], digest)
+        self.assertIn(digest[:16], task.output().path)
+
+    def test_handoff(self):
+        config = luigi.configuration.get_config()
+        config.set("handoff", "enabled", "true")
+        try:
+            task = MockChainPreprocess()
+            build([task], local_scheduler=True)
+            cached = frame_cache.get(task.output().path)
+            self.assertIsNotNone(cached)
+            cached = cached.to_pandas()
+            frame_cache.flush()
+        finally:
+            config.remove_option("handoff", "enabled")
+            frame_cache.discard(task.output().path)
+            frame_cache.discard(task.requires()["download"].output().path)
+
+        # The parquet file was still written in the background
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(task.output().path, engine="pyarrow"), cached
         )
 
     def test_build(self):
@@ -141,6 +1263,146 @@ class LuigiWorkflowTests(TestCase):
 
         self.assertTrue(task.complete())
 
+        self.assertTrue(os.path.exists(task.output().path))
+        self.assertTrue(task.output().path.startswith("data/MockBuildModel-"))
+
+    def test_train_and_score(self):
+        task = MockScoreData(backend="thread", n_jobs=2, batch_size=100)
+
+        build([task], local_scheduler=True)
+
+        self.assertTrue(task.complete())
+        bundle = load_model(task.input()["train"].path)
+        self.assertEqual(len(bundle["transforms"]), 1)
+        self.assertIsInstance(bundle["transforms"][0], Imputer)
+
+        scores = pd.read_parquet(task.output().path, engine="pyarrow")
+        df = pd.read_parquet(task.SCORE_DATA, engine="pyarrow")
+        self.assertEqual(
+            list(scores.columns),
+            ["Unnamed: 0", "prediction", "probability_0", "probability_1"],
+        )
+        self.assertEqual(len(scores), len(generate_data()))
+        np.testing.assert_array_equal(
+            scores["prediction"],
+            bundle["model"].predict(df[bundle["features"]].to_numpy()),
+        )
+
+
+    def test_tune(self):
+        task = MockTuneModel(backend="thread", n_jobs=2)
+
+        build([task], local_scheduler=True)
+
+        self.assertTrue(task.complete())
+        with task.output().open() as f:
+            (best,) = json.load(f)
+        self.assertEqual(best["name"], "rf")
+        self.assertIn(best["params"]["max_depth"], [1, 2, 4, 8])
+        self.assertTrue(os.path.exists(task.trial_log()))
+        self.assertEqual(len(load_models([best])), 1)
+
+    def test_instrument(self):
+        config = luigi.configuration.get_config()
+        config.set("instrument", "enabled", "true")
+        config.set("instrument", "prometheus_file", "data/metrics.prom")
+        try:
+            build([MockChainPreprocess()], local_scheduler=True)
+        finally:
+            config.remove_section("instrument")
+
+        records = {
+            record["family"]: record
+            for record in read_records("data/task_metrics.jsonl")
+        }
+        self.assertEqual(set(records), {"MockDownloadData", "MockChainPreprocess"})
+        record = records["MockChainPreprocess"]
+        self.assertEqual(record["status"], "SUCCESS")
+        self.assertGreater(record["wall_time"], 0)
+        self.assertGreater(record["peak_rss"], 0)
+        self.assertTrue(record["inputs"][0]["path"].endswith("data/data.parquet"))
+        (output,) = record["outputs"]
+        self.assertEqual(output["rows"], len(generate_data()))
+        self.assertEqual(output["columns"], generate_data().shape[1] + 1)
+        with open("data/metrics.prom") as f:
+            prometheus = f.read()
+        self.assertIn('luigi_task_output_rows{task_id="MockChainPreprocess', prometheus)
+
+    def test_profile(self):
+        task = MockChainPreprocess(profile=True)
+
+        build([task], local_scheduler=True)
+
+        self.assertTrue(task.complete())
+        stats = pstats.Stats(task.output().path + ".pstats")
+        functions = {name for _, _, name in stats.stats}
+        self.assertIn("fit_transform_chain", functions)
+        self.assertTrue(os.path.exists(task.output().path + ".collapsed"))
+        # Upstream tasks are profiled too
+        download = task.requires()["download"]
+        self.assertTrue(os.path.exists(download.output().path + ".pstats"))
+
+    def test_cli_dry_run(self):
+        build([MockDownloadData()], local_scheduler=True)
+        out = io.StringIO()
+        counts = print_dag([MockBuildModel()], file=out)
+
+        self.assertEqual(counts, (3, 1))
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("[ ] MockBuildModel("))
+        self.assertTrue(lines[2].startswith("        [x] MockDownloadData("))
+        self.assertEqual(lines[-1], "3 tasks, 1 complete")
+
+    def test_cli_workers(self):
+        self.assertIs(load_task("mushroom").__name__, "BuildMRModel")
+        code = main(
+            [
+                "machine_learning_utils.tests.tests.MockBuildModel",
+                "machine_learning_utils.tests.tests.MockChainPreprocess",
+                "--workers",
+                "2",
+            ]
+        )
+        self.assertEqual(code, 0)
+        self.assertTrue(MockBuildModel().complete())
+        self.assertTrue(MockChainPreprocess().complete())
+
+    def test_partitioned_build(self):
+        df = generate_data()
+        for region, rows in [("A", df.iloc[::2]), ("B", df.iloc[1::2])]:
+            path = os.path.join(self.tmp_dir, "segments", "region=" + region)
+            os.makedirs(path)
+            rows.to_parquet(os.path.join(path, "part-0.parquet"), index=False)
+
+        task = MockPartitionedBuildModel()
+        self.assertEqual(task.partition_list(), ["region=A", "region=B"])
+        build([task], local_scheduler=True, workers=2)
+
+        self.assertTrue(task.complete())
+        download = task.requires()["region=B"].requires()["preprocess"].input()
         self.assertTrue(
-            os.path.exists(os.path.join(self.tmp_dir, "MockBuildModel.csv"))
+            download["download"].path.startswith("data/MockDownloadPartition/region=B-")
+        )
+        self.assertEqual(len(read_frame(download["download"])), len(df) // 2)
+        report = pd.read_csv(task.output().path, index_col=[0, 1, 2, 3])
+        self.assertEqual(list(report.index.levels[0]), ["region=A", "region=B"])
+        self.assertEqual(list(report.index.levels[1]), ["rf"])
+
+        # A rewritten partition keys new entries of its chain and of the report
+        key = task.requires()["region=B"].requires()["preprocess"].requires()
+        key = key["download"].cache_key()
+        path = os.path.join(self.tmp_dir, "segments", "region=B", "part-0.parquet")
+        df.iloc[1::4].to_parquet(path, index=False)
+        mtime = os.path.getmtime(path) + 1
+        os.utime(path, (mtime, mtime))
+        # New instances, whose digests are computed again
+        luigi.task_register.Register.clear_instance_cache()
+        updated = MockPartitionedBuildModel()
+        download = updated.requires()["region=B"].requires()["preprocess"].requires()
+        self.assertNotEqual(download["download"].cache_key(), key)
+        self.assertNotEqual(updated.output().path, task.output().path)
+        self.assertEqual(
+            updated.requires()["region=A"].output().path,
+            task.requires()["region=A"].output().path,
         )
+        self.assertFalse(updated.complete())
@@ -81,6 +81,7 @@ setup(
         'pandas',
         'numpy',
         'sklearn',
+        'importlib_metadata; python_version<"3.8"',
     ],
     extras_require={
         # eg:
@@ -93,6 +94,7 @@ setup(
     entry_points={
         'console_scripts': [
             'machine-learning-utils = machine_learning_utils.cli:main',
+            'machine-learning-utils-serve = machine_learning_utils.server:main',
         ]
     },
 )